@@ -12,9 +12,11 @@ __version__ = ".".join(map(str, __version__))
 from . import buildingblocks   # noqa: F401
 from . import comm             # noqa: F401
 from . import db               # noqa: F401
+from . import inference        # noqa: F401
 from . import network          # noqa: F401
 from . import samplers         # noqa: F401
 from . import simple           # noqa: F401
+from . import spikes           # noqa: F401
 from . import tools            # noqa: F401
 from . import training         # noqa: F401
 from . import utils            # noqa: F401
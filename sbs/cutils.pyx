@@ -1,342 +1,1583 @@
 
-from cpython cimport bool
-
 import numpy as np
 cimport numpy as np
 
-import time
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 
 cimport cython
+from libc.math cimport exp, log, ceil, INFINITY
+from libc.stdlib cimport calloc, free
 
 ctypedef unsigned long uint
 
-cdef inline double get_bm_prob(
+# If the exponent of a newly enumerated state exceeds the current reference
+# exponent by more than this value, the running partition sum is rescaled to
+# the new reference in order to avoid overflows.
+DEF LOG_RESCALE_THRESHOLD = 300.
+
+
+cdef inline uint count_trailing_zeros(uint value) nogil:
+    cdef uint num_zeros = 0
+    while (value & 1) == 0:
+        value >>= 1
+        num_zeros += 1
+    return num_zeros
+
+
+cdef inline double init_local_fields(
         uint num_dims,
         long* state,
         double* weights,
-        double* biases
-    ):
+        double* biases,
+        double* fields,
+    ) nogil:
+    """
+        Compute the local field of every unit for the given state and return
+        the exponent of the (unnormalized) Boltzmann probability of the state.
+
+        Expects effective weights/biases (see `get_bm_effective_parameters`).
+    """
     cdef uint i, j
     cdef double exponent = 0.
-    # print "State (pre prob)",
-    # for i in range(num_dims):
-        # print state[i],
-    # print ""
     for i in range(num_dims):
+        fields[i] = biases[i]
         for j in range(num_dims):
-            exponent += .5 * state[i] * weights[i*num_dims+j] * state[j]
-        exponent += state[i] * biases[i]
-    return np.exp(exponent)
+            fields[i] += weights[i*num_dims+j] * state[j]
+    for i in range(num_dims):
+        exponent += .5 * state[i] * (biases[i] + fields[i])
+    return exponent
+
+
+cdef inline double flip_unit(
+        uint unit,
+        uint num_dims,
+        long* state,
+        double* weights,
+        double* fields,
+    ) nogil:
+    """
+        Flip `unit`, update all local fields in O(num_dims) and return the
+        change of the exponent.
 
+        Since the effective weights have a zero diagonal, the local field of
+        the flipped unit itself is not affected.
+    """
+    cdef uint j
+    cdef double sign = 1. - 2. * state[unit]
+    cdef double* row = weights + unit * num_dims
 
-cdef bool check_value_in_uint_array(
-        uint value, uint num_vector_elem, uint* vector):
-    for i in range(num_vector_elem):
-        if vector[i] == value:
-            return True
-    return False
+    state[unit] = 1 - state[unit]
+    for j in range(num_dims):
+        fields[j] += sign * row[j]
 
-cdef bool check_value_in_long_array(
-        uint value, uint num_vector_elem, long* vector):
-    for i in range(num_vector_elem):
-        if vector[i] == value:
-            return True
-    return False
+    return sign * fields[unit]
 
-@cython.boundscheck(False)
-cdef double get_bm_partition_theo_for_fixed(
-        np.ndarray[np.int_t, ndim=1] state,
-        np.ndarray[np.float64_t, ndim=2] weights,
-        np.ndarray[np.float64_t, ndim=1] biases,
-        np.ndarray[np.int_t, ndim=1] fixed,
-    ):
-    cdef uint num_dims = state.shape[0]
-    cdef uint num_fixed = fixed.shape[0]
-    # just extract the arguments
-    return _get_bm_partition_theo_for_fixed(
-            num_dims,
-            <long*> state.data,
-            <double*> weights.data,
-            <double*> biases.data,
-            num_fixed,
-            <uint*> fixed.data,
-        )
-
-
-# returns whether the state looped around
-cdef inline bool advance_state(
+
+cdef inline void rescale_moments(
+        double factor,
+        uint num_dims,
+        double* moments_first,
+        double* moments_second,
+        double* starts_first,
+        double* starts_second,
+    ) nogil:
+    cdef uint i
+    if moments_first != NULL:
+        for i in range(num_dims):
+            moments_first[i] *= factor
+            starts_first[i] *= factor
+    if moments_second != NULL:
+        for i in range(num_dims * num_dims):
+            moments_second[i] *= factor
+            starts_second[i] *= factor
+
+
+cdef inline void update_moments(
+        uint unit,
         uint num_dims,
         long* state,
-        uint num_fixed,
-        uint* fixed,
-    ):
-    cdef long carry = 0
-    cdef long add = 1
+        double partition,
+        double* moments_first,
+        double* moments_second,
+        double* starts_first,
+        double* starts_second,
+    ) nogil:
+    """
+        Account for `unit` having been switched (the current value is read
+        from `state`).
+
+        Instead of adding the probability of every state to all active units,
+        we remember the running partition sum when a unit (or pair of units)
+        becomes active and add the difference once it becomes inactive again.
+        Hence, the first moments cost O(1) and the second moments O(num_dims)
+        per enumerated state.
+    """
+    cdef uint j, pair_idx
+    cdef bint is_active = state[unit] == 1
 
-    cdef long i
-    for i in range(num_dims-1, -1, -1):
-        if num_fixed > 0 and check_value_in_uint_array(i, num_fixed, fixed):
-            continue
+    if moments_first != NULL:
+        if is_active:
+            starts_first[unit] = partition
+        else:
+            moments_first[unit] += partition - starts_first[unit]
 
-        carry = (state[i] + add) == 2
-        state[i] = state[i] ^ add
-        add = carry
+    if moments_second != NULL:
+        for j in range(num_dims):
+            if j == unit or state[j] == 0:
+                continue
+            # only the upper triangle is used during the enumeration
+            if j < unit:
+                pair_idx = j * num_dims + unit
+            else:
+                pair_idx = unit * num_dims + j
+
+            if is_active:
+                starts_second[pair_idx] = partition
+            else:
+                moments_second[pair_idx] += partition - starts_second[pair_idx]
 
-    # if the carry contains 1 after we looped over all dimensions, we fully
-    # wrapped around and reached the beginning state again
-    return carry > 0
 
-cdef inline double _get_bm_partition_theo_for_fixed(
+cdef double enumerate_log_partition(
         uint num_dims,
         long* state,
         double* weights,
         double* biases,
-        uint num_fixed,
-        uint* fixed,
+        double* fields,
+        uint num_free,
+        uint* free_idx,
+        double* log_weights,
+        double* moments_first,
+        double* moments_second,
+        double* starts_first,
+        double* starts_second,
+    ) nogil:
+    """
+        Enumerate all states of the `num_free` units in `free_idx` in
+        Gray-code order and return the logarithm of their summed
+        (unnormalized) probabilities.
+
+        Units not in `free_idx` keep the value they have in `state`, the free
+        units are reset to zero before the enumeration starts.
+
+        Since consecutive states only differ in a single unit, the exponent is
+        updated in O(num_dims) per state instead of evaluating the full
+        quadratic form. The partition sum is accumulated relative to a
+        reference exponent so that large weights/biases do not overflow.
+
+        If `log_weights` is not NULL, the exponent of each enumerated state is
+        written to its index in the joint distribution over all `num_dims`
+        units (unit 0 being the most significant bit).
+
+        If `moments_first` (size `num_dims`) or `moments_second` (size
+        `num_dims`**2) are not NULL, they are filled with <s_i> and <s_i s_j>
+        (upper triangle only) of the enumerated states. `starts_first` and
+        `starts_second` are workspaces of the same size.
+    """
+    cdef uint i, j, unit
+    cdef uint num_states = (<uint> 1) << num_free
+    cdef uint joint_idx = 0
+    cdef double exponent, log_reference, factor
+    cdef double partition = 0.
+
+    for i in range(num_free):
+        state[free_idx[i]] = 0
+
+    exponent = init_local_fields(num_dims, state, weights, biases, fields)
+    log_reference = exponent
+
+    if moments_first != NULL:
+        for i in range(num_dims):
+            moments_first[i] = 0.
+            starts_first[i] = 0.
+    if moments_second != NULL:
+        for i in range(num_dims * num_dims):
+            moments_second[i] = 0.
+            starts_second[i] = 0.
+
+    if log_weights != NULL:
+        for i in range(num_dims):
+            joint_idx = (joint_idx << 1) | state[i]
+        log_weights[joint_idx] = exponent
+
+    partition = 1.
+
+    for i in range(1, num_states):
+        # the last free unit is flipped most often
+        unit = free_idx[num_free - 1 - count_trailing_zeros(i)]
+        exponent += flip_unit(unit, num_dims, state, weights, fields)
+
+        if moments_first != NULL or moments_second != NULL:
+            update_moments(unit, num_dims, state, partition,
+                           moments_first, moments_second,
+                           starts_first, starts_second)
+
+        if log_weights != NULL:
+            joint_idx ^= (<uint> 1) << (num_dims - 1 - unit)
+            log_weights[joint_idx] = exponent
+
+        if exponent > log_reference + LOG_RESCALE_THRESHOLD:
+            factor = exp(log_reference - exponent)
+            partition *= factor
+            rescale_moments(factor, num_dims,
+                            moments_first, moments_second,
+                            starts_first, starts_second)
+            log_reference = exponent
+
+        partition += exp(exponent - log_reference)
+
+    # close all intervals that are still active and normalize
+    if moments_first != NULL:
+        for i in range(num_dims):
+            if state[i] == 1:
+                moments_first[i] += partition - starts_first[i]
+            moments_first[i] /= partition
+
+    if moments_second != NULL:
+        for i in range(num_dims):
+            for j in range(i+1, num_dims):
+                if state[i] == 1 and state[j] == 1:
+                    moments_second[i * num_dims + j] +=\
+                        partition - starts_second[i * num_dims + j]
+                moments_second[i * num_dims + j] /= partition
+
+    return log_reference + log(partition)
+
+
+def get_bm_effective_parameters(
+        np.ndarray[np.float64_t, ndim=2] weights,
+        np.ndarray[np.float64_t, ndim=1] biases):
+    """
+        Return symmetrized weights with zero diagonal and biases that absorb
+        the diagonal of the weight matrix.
+
+        Both describe the same Boltzmann distribution as the original
+        parameters, but flipping a single unit now changes the exponent by
+        exactly the unit's local field.
+    """
+    assert weights.shape[0] == weights.shape[1], "Weights must be quadratic"
+    assert weights.shape[0] == biases.shape[0], "Biases and weights must match"
+
+    eff_weights = .5 * (weights + weights.T)
+    eff_biases = biases + .5 * np.diag(weights)
+    eff_weights[np.diag_indices_from(eff_weights)] = 0.
+
+    return (np.require(eff_weights, dtype=np.float64, requirements=["C"]),
+            np.require(eff_biases, dtype=np.float64, requirements=["C"]))
+
+
+@cython.boundscheck(False)
+def _enumerate_log_partition_for_prefix(
+        np.ndarray[np.float64_t, ndim=2] eff_weights,
+        np.ndarray[np.float64_t, ndim=1] eff_biases,
+        uint prefix,
+        uint num_prefix,
+        np.ndarray[np.float64_t, ndim=1] log_weights,
+        bint first_moments,
+        bint second_moments,
     ):
+    """
+        Enumerate all states whose first `num_prefix` units are fixed to the
+        bits of `prefix` (unit 0 being the most significant bit).
+
+        The GIL is released during the enumeration so that several prefixes
+        can be enumerated concurrently from different threads.
+
+        Returns (log_partition, first_moments, second_moments) with the
+        moments being None if they were not requested.
+    """
     cdef uint i
+    cdef uint num_dims = eff_weights.shape[0]
+    cdef uint num_free = num_dims - num_prefix
 
-    # init the state variable to be zero everywhere it isnt fixed
-    for i in range(num_dims):
-        if num_fixed > 0 and check_value_in_uint_array(i, num_fixed, fixed):
-            continue
-        else:
-            state[i] = 0
+    cdef np.ndarray[np.int_t, ndim=1] state = np.zeros((num_dims,),
+            dtype=np.int)
+    cdef np.ndarray[np.float64_t, ndim=1] fields = np.zeros((num_dims,),
+            dtype=np.float64)
+    cdef np.ndarray[np.uint_t, ndim=1] free_idx = np.arange(
+            num_prefix, num_dims, dtype=np.uint)
+
+    for i in range(num_prefix):
+        state[i] = (prefix >> (num_prefix - 1 - i)) & 1
+
+    cdef np.ndarray[np.float64_t, ndim=1] moments_first = None
+    cdef np.ndarray[np.float64_t, ndim=1] starts_first = None
+    cdef np.ndarray[np.float64_t, ndim=2] moments_second = None
+    cdef np.ndarray[np.float64_t, ndim=2] starts_second = None
+
+    cdef double* log_weights_ptr = NULL
+    cdef double* moments_first_ptr = NULL
+    cdef double* starts_first_ptr = NULL
+    cdef double* moments_second_ptr = NULL
+    cdef double* starts_second_ptr = NULL
+
+    if log_weights is not None:
+        log_weights_ptr = <double*> log_weights.data
+
+    if first_moments:
+        moments_first = np.zeros((num_dims,), dtype=np.float64)
+        starts_first = np.zeros((num_dims,), dtype=np.float64)
+        moments_first_ptr = <double*> moments_first.data
+        starts_first_ptr = <double*> starts_first.data
+
+    if second_moments:
+        moments_second = np.zeros((num_dims, num_dims), dtype=np.float64)
+        starts_second = np.zeros((num_dims, num_dims), dtype=np.float64)
+        moments_second_ptr = <double*> moments_second.data
+        starts_second_ptr = <double*> starts_second.data
+
+    cdef double log_partition
+
+    with nogil:
+        log_partition = enumerate_log_partition(
+                num_dims,
+                <long*> state.data,
+                <double*> eff_weights.data,
+                <double*> eff_biases.data,
+                <double*> fields.data,
+                num_free,
+                <uint*> free_idx.data,
+                log_weights_ptr,
+                moments_first_ptr,
+                moments_second_ptr,
+                starts_first_ptr,
+                starts_second_ptr)
+
+    return log_partition, moments_first, moments_second
+
+
+def _enumerate_log_partition(
+        np.ndarray[np.float64_t, ndim=2] weights,
+        np.ndarray[np.float64_t, ndim=1] biases,
+        log_weights=None,
+        first_moments=False,
+        second_moments=False,
+        num_threads=1,
+    ):
+    """
+        Enumerate all states of the Boltzmann distribution, possibly
+        distributed over `num_threads` threads.
 
-    cdef double partition = 0.
-    cdef bool final_state_reached = False
+        For the parallel mode the state space is split into blocks of fixed
+        high-order units (prefixes). The partial results are always reduced
+        in prefix order so that the result does not depend on the order in
+        which the threads finish.
 
-    while True:
-        partition += get_bm_prob(num_dims, state, weights, biases)
+        Returns (log_partition, first_moments, second_moments), the moments
+        being None if they were not requested.
+    """
+    eff_weights, eff_biases = get_bm_effective_parameters(weights, biases)
 
-        # advance the state
-        if advance_state(num_dims, state, num_fixed, fixed):
-            break
+    cdef uint num_dims = weights.shape[0]
+    cdef uint num_prefix = 0
+
+    if num_threads is None:
+        num_threads = mp.cpu_count()
+
+    if num_threads > 1:
+        # use more blocks than threads to even out the load if the number of
+        # threads is not a power of two
+        num_prefix = min(num_dims,
+                         int(np.ceil(np.log2(4 * num_threads))))
+
+    if num_prefix == 0:
+        return _enumerate_log_partition_for_prefix(
+                eff_weights, eff_biases, 0, 0, log_weights,
+                first_moments, second_moments)
+
+    def enumerate_prefix(prefix):
+        return _enumerate_log_partition_for_prefix(
+                eff_weights, eff_biases, prefix, num_prefix, log_weights,
+                first_moments, second_moments)
+
+    pool = ThreadPool(num_threads)
+    try:
+        results = pool.map(enumerate_prefix, range(1 << num_prefix))
+    finally:
+        pool.close()
+        pool.join()
+
+    log_partitions = np.array([r[0] for r in results])
+    log_partition = np.logaddexp.reduce(log_partitions)
+    block_probs = np.exp(log_partitions - log_partition)
 
-    return partition
+    moments_first = None
+    moments_second = None
+
+    if first_moments:
+        moments_first = np.zeros((num_dims,), dtype=np.float64)
+        for p, result in zip(block_probs, results):
+            moments_first += p * result[1]
+
+    if second_moments:
+        moments_second = np.zeros((num_dims, num_dims), dtype=np.float64)
+        for p, result in zip(block_probs, results):
+            moments_second += p * result[2]
+
+    return log_partition, moments_first, moments_second
+
+
+@cython.boundscheck(False)
+def get_bm_log_partition_theo(np.ndarray[np.float64_t, ndim=2] weights,
+                              np.ndarray[np.float64_t, ndim=1] biases,
+                              num_threads=1):
+    """
+        Get the logarithm of the partition function of the Boltzmann
+        distribution.
+
+        num_threads: Number of threads among which to split the enumeration
+                     (None for all available cores).
+    """
+    return _enumerate_log_partition(weights, biases,
+                                    num_threads=num_threads)[0]
 
 
 @cython.boundscheck(False)
 def get_bm_partition_theo(np.ndarray[np.float64_t, ndim=2] weights,
-                 np.ndarray[np.float64_t, ndim=1] biases):
-    assert weights.shape[0] == weights.shape[1], "Weights must be quadratic"
-    assert weights.shape[0] == biases.shape[0], "Biases and weights must match"
+                          np.ndarray[np.float64_t, ndim=1] biases,
+                          num_threads=1):
+    """
+        Get the partition function of the Boltzmann distribution.
 
-    cdef uint num_dims = weights.shape[0]
+        Note: For large weights/biases the partition function itself might
+        not be representable, use `get_bm_log_partition_theo` instead.
+    """
+    return exp(get_bm_log_partition_theo(weights, biases,
+                                         num_threads=num_threads))
 
-    # no fixed indices
-    cdef np.ndarray[np.int_t, ndim=1] no_fixed = np.zeros((0,), dtype=np.int)
-    cdef np.ndarray[np.int_t, ndim=1] state = np.zeros((num_dims,),
-            dtype=np.int)
 
-    cdef double partition = get_bm_partition_theo_for_fixed(
-            state, weights, biases, no_fixed)
+@cython.boundscheck(False)
+def get_bm_moments_theo(np.ndarray[np.float64_t, ndim=2] weights,
+                        np.ndarray[np.float64_t, ndim=1] biases,
+                        bint second_moments=False,
+                        num_threads=1):
+    """
+        Get the log partition function and the marginals of all units of the
+        Boltzmann distribution in a single enumeration.
+
+        If `second_moments` is True, the pairwise second moments <s_i s_j>
+        (with the marginals on the diagonal) are computed as well.
 
-    return partition
+        Returns:
+            (log_partition, marginals) or
+            (log_partition, marginals, second_moments)
+    """
+    log_partition, marginals, moments = _enumerate_log_partition(
+            weights, biases, first_moments=True,
+            second_moments=second_moments, num_threads=num_threads)
+
+    if not second_moments:
+        return log_partition, marginals
+
+    moments += moments.T
+    moments[np.diag_indices_from(moments)] = marginals
+
+    return log_partition, marginals, moments
 
 
 @cython.boundscheck(False)
 def get_bm_marginal_theo(np.ndarray[np.float64_t, ndim=2] weights,
                  np.ndarray[np.float64_t, ndim=1] biases,
-                 np.ndarray[np.int_t, ndim=1] selected_idx):
+                 np.ndarray[np.int_t, ndim=1] selected_idx,
+                 num_threads=1):
     """
         Get theoretical marginal distribution for Boltzmann distribution.
 
         This does not calculate the joint probability explicitly and is
         therefore able to compute the marginal for higher dimensions.
+
+        All marginals are computed in the same enumeration as the partition
+        function, so the cost does not depend on the number of selected
+        samplers.
     """
-    assert weights.shape[0] == weights.shape[1], "Weights must be quadratic"
-    assert weights.shape[0] == biases.shape[0], "Biases and weights must match"
+    log_partition, marginals = get_bm_moments_theo(
+            weights, biases, num_threads=num_threads)
+    return marginals[selected_idx]
 
-    cdef uint num_selected = selected_idx.shape[0]
+
+@cython.boundscheck(False)
+def get_bm_joint_theo(np.ndarray[np.float64_t, ndim=2] weights,
+                 np.ndarray[np.float64_t, ndim=1] biases,
+                 num_threads=1):
+    """
+        Get theoretical joint distribution for Boltzmann distribution.
+    """
+    assert weights.shape[0] == weights.shape[1], "Weights must be quadratic"
 
     cdef uint num_dims = weights.shape[0]
-    cdef np.ndarray[np.int_t, ndim=1] state = np.zeros((num_dims,),
-            dtype=np.int)
-    cdef np.ndarray[np.int_t, ndim=1] fixed = np.zeros((1,), dtype=np.int)
+    cdef uint i
+    cdef uint num_total = ((<uint> 1) << num_dims)
 
-    cdef np.ndarray[np.float64_t, ndim=1] probs = np.zeros((num_selected,),
+    cdef np.ndarray[np.float64_t, ndim=1] joints = np.zeros((num_total,),
             dtype=np.float64)
 
-    cdef uint i,j
+    cdef double* joints_ptr = <double*> joints.data
+    cdef double log_partition
 
-    cdef double partition = get_bm_partition_theo(weights, biases)
+    # write the exponents into the joint and normalize in-place
+    log_partition = _enumerate_log_partition(
+            weights, biases, log_weights=joints, num_threads=num_threads)[0]
 
-    for i in range(num_selected):
-        fixed[0] = selected_idx[i]
-        state[selected_idx[i]] = 1
-        probs[i] = get_bm_partition_theo_for_fixed(
-                state,
-                weights,
-                biases,
-                fixed
-                ) / partition
+    with nogil:
+        for i in range(num_total):
+            joints_ptr[i] = exp(joints_ptr[i] - log_partition)
 
-    return probs
+    return joints.reshape([2 for i in range(num_dims)])
+
+
+cdef void enumerate_block_log_partitions(
+        uint num_dims,
+        long* state,
+        double* weights,
+        double* biases,
+        double* fields,
+        uint num_fixed,
+        uint* fixed_idx,
+        uint num_free,
+        uint* free_idx,
+        uint block_start,
+        uint block_stop,
+        double* log_partitions,
+    ) nogil:
+    """
+        For every block in [block_start, block_stop), fix the units in
+        `fixed_idx` to the bits of the block index (first fixed unit being the
+        most significant bit) and write the log partition sum over all states
+        of the free units to `log_partitions[block]`.
+    """
+    cdef uint i, block
+    for block in range(block_start, block_stop):
+        for i in range(num_fixed):
+            state[fixed_idx[i]] = (block >> (num_fixed - 1 - i)) & 1
+        log_partitions[block] = enumerate_log_partition(
+                num_dims, state, weights, biases, fields, num_free, free_idx,
+                NULL, NULL, NULL, NULL, NULL)
 
 
 @cython.boundscheck(False)
-def get_bm_joint_theo(np.ndarray[np.float64_t, ndim=2] weights,
-                 np.ndarray[np.float64_t, ndim=1] biases):
+def _enumerate_block_log_partitions(
+        np.ndarray[np.float64_t, ndim=2] eff_weights,
+        np.ndarray[np.float64_t, ndim=1] eff_biases,
+        np.ndarray[np.uint_t, ndim=1] fixed_idx,
+        np.ndarray[np.uint_t, ndim=1] free_idx,
+        uint block_start,
+        uint block_stop,
+        np.ndarray[np.float64_t, ndim=1] log_partitions,
+    ):
     """
-        Get theoretical marginal distribution for Boltzmann distribution.
+        Python entry point for `enumerate_block_log_partitions` that releases
+        the GIL so that ranges of blocks can be processed concurrently.
+    """
+    cdef uint num_dims = eff_weights.shape[0]
+
+    cdef np.ndarray[np.int_t, ndim=1] state = np.zeros((num_dims,),
+            dtype=np.int)
+    cdef np.ndarray[np.float64_t, ndim=1] fields = np.zeros((num_dims,),
+            dtype=np.float64)
+
+    with nogil:
+        enumerate_block_log_partitions(
+                num_dims,
+                <long*> state.data,
+                <double*> eff_weights.data,
+                <double*> eff_biases.data,
+                <double*> fields.data,
+                fixed_idx.shape[0],
+                <uint*> fixed_idx.data,
+                free_idx.shape[0],
+                <uint*> free_idx.data,
+                block_start,
+                block_stop,
+                <double*> log_partitions.data)
+
+
+@cython.boundscheck(False)
+def get_bm_joint_theo_selected(np.ndarray[np.float64_t, ndim=2] weights,
+                               np.ndarray[np.float64_t, ndim=1] biases,
+                               np.ndarray[np.int_t, ndim=1] selected_idx,
+                               num_threads=1):
+    """
+        Get the theoretical joint distribution of the selected units only
+        (axes in the order of `selected_idx`).
+
+        The states of the selected units are enumerated in the outer loop and
+        all other units are summed out in the inner Gray-code enumeration, so
+        only 2**len(selected_idx) values are ever allocated.
+
+        num_threads: Number of threads among which to split the enumeration
+                     (None for all available cores).
     """
     assert weights.shape[0] == weights.shape[1], "Weights must be quadratic"
-    assert weights.shape[0] == biases.shape[0], "Biases and weights must match"
 
     cdef uint num_dims = weights.shape[0]
-    cdef uint i
-    cdef uint num_total = (1 << num_dims)
+    cdef uint num_selected = selected_idx.shape[0]
+    cdef uint num_prefix = 0
 
-    cdef double* weights_ptr = <double*> weights.data
-    cdef double* biases_ptr = <double*> biases.data
+    assert len(np.unique(selected_idx)) == num_selected,\
+        "Selected units must be unique"
 
-    cdef np.ndarray[np.float64_t, ndim=1] joints = np.zeros((num_total,),
-            dtype=np.float64)
-    cdef np.ndarray[np.int_t, ndim=1] state = np.zeros((num_dims,),
-            dtype=np.int)
+    eff_weights, eff_biases = get_bm_effective_parameters(weights, biases)
 
-    cdef long* state_ptr = <long*> state.data
+    is_selected = np.zeros(num_dims, dtype=bool)
+    is_selected[selected_idx] = True
+    free_idx = np.require(np.where(~is_selected)[0], dtype=np.uint,
+                          requirements=["C"])
 
-    for i in range(num_total):
-        joints[i] = get_bm_prob(num_dims, state_ptr, weights_ptr, biases_ptr)
-        advance_state(num_dims, state_ptr, 0, NULL)
+    if num_threads is None:
+        num_threads = mp.cpu_count()
 
-    joints /= joints.sum()
+    if num_threads > 1:
+        # if there are only few selected states, additionally fix some of the
+        # free units to have enough blocks to even out the load
+        num_prefix = min(len(free_idx), max(0, int(np.ceil(
+            np.log2(4 * num_threads))) - num_selected))
 
-    return joints.reshape([2 for i in range(num_dims)])
+    fixed_idx = np.require(np.r_[selected_idx, free_idx[:num_prefix]],
+                           dtype=np.uint, requirements=["C"])
+    free_idx = np.require(free_idx[num_prefix:], requirements=["C"])
 
+    num_blocks = (<uint> 1) << (num_selected + num_prefix)
+    log_partitions = np.zeros((num_blocks,), dtype=np.float64)
 
-cdef inline uint get_current_state(uint num_selected, double* tau_sampler_ptr):
+    if num_threads <= 1:
+        _enumerate_block_log_partitions(eff_weights, eff_biases, fixed_idx,
+                                        free_idx, 0, num_blocks,
+                                        log_partitions)
 
-    cdef uint current_state = 0
+    else:
+        bounds = np.linspace(0, num_blocks, min(num_blocks, 4 * num_threads)
+                             + 1).astype(np.uint)
 
-    for i in range(num_selected):
-        if tau_sampler_ptr[i] > 0.:
-            current_state += (1 << (num_selected - 1 - i))
+        def enumerate_range(i):
+            _enumerate_block_log_partitions(
+                    eff_weights, eff_biases, fixed_idx, free_idx,
+                    bounds[i], bounds[i+1], log_partitions)
 
-    return current_state
+        pool = ThreadPool(num_threads)
+        try:
+            pool.map(enumerate_range, range(len(bounds) - 1))
+        finally:
+            pool.close()
+            pool.join()
 
+    # sum out the additionally fixed free units (in a fixed order)
+    log_weights = np.logaddexp.reduce(
+            log_partitions.reshape(1 << num_selected, 1 << num_prefix), axis=1)
 
-def autocorr(np.ndarray[np.float64_t, ndim=1] array, uint max_step_diff):
-    cdef np.ndarray[np.float64_t, ndim=1] joints = np.zeros((max_step_diff,),
-            dtype=np.float64)
+    joint = np.exp(log_weights - np.logaddexp.reduce(log_weights))
 
-    cdef uint i
-    cdef uint len_array = len(array)
+    return joint.reshape([2 for i in range(num_selected)])
+
+
+# int32/int64 spike ids (spelled as C types since Cython cannot declare const
+# memoryviews of fused numpy typedefs)
+ctypedef fused spike_id_t:
+    int
+    long long
 
-    joints[0] = 1.
 
-    for i in range(1,max_step_diff):
-        joints[i] = np.corrcoef(array[:len_array-i], array[i:])[0,1]
+cdef struct IndexedHeap:
+    # Indexed binary min-heap of items 0..capacity-1, each contained at most
+    # once and ordered by its key. The position index allows to look up and
+    # change the key of any contained item in O(log n).
+    uint size
+    double* keys     # per item
+    long* heap       # contained items ordered by key
+    long* position   # position of each item in heap (-1: not contained)
 
-    return joints
+
+cdef inline void indexed_heap_swap(IndexedHeap* h, uint i, uint j) nogil:
+    cdef long tmp = h.heap[i]
+    h.heap[i] = h.heap[j]
+    h.heap[j] = tmp
+    h.position[h.heap[i]] = i
+    h.position[h.heap[j]] = j
+
+
+cdef inline void indexed_heap_sift_up(IndexedHeap* h, uint i) nogil:
+    cdef uint parent
+    while i > 0:
+        parent = (i - 1) >> 1
+        if h.keys[h.heap[parent]] <= h.keys[h.heap[i]]:
+            break
+        indexed_heap_swap(h, i, parent)
+        i = parent
+
+
+cdef inline void indexed_heap_sift_down(IndexedHeap* h, uint i) nogil:
+    cdef uint child
+    while True:
+        child = 2 * i + 1
+        if child >= h.size:
+            break
+        if child + 1 < h.size and h.keys[h.heap[child + 1]]\
+                < h.keys[h.heap[child]]:
+            child += 1
+        if h.keys[h.heap[i]] <= h.keys[h.heap[child]]:
+            break
+        indexed_heap_swap(h, i, child)
+        i = child
+
+
+cdef inline bint indexed_heap_contains(IndexedHeap* h, long item) nogil:
+    return h.position[item] >= 0
+
+
+cdef inline void indexed_heap_push(IndexedHeap* h, long item,
+                                   double key) nogil:
+    """
+        Set the key of `item`, inserting it if it is not contained already.
+    """
+    h.keys[item] = key
+    if h.position[item] < 0:
+        h.heap[h.size] = item
+        h.position[item] = h.size
+        h.size += 1
+    indexed_heap_sift_up(h, h.position[item])
+    indexed_heap_sift_down(h, h.position[item])
+
+
+cdef inline long indexed_heap_top(IndexedHeap* h) nogil:
+    return h.heap[0]
+
+
+cdef inline double indexed_heap_min_key(IndexedHeap* h) nogil:
+    if h.size == 0:
+        return INFINITY
+    return h.keys[h.heap[0]]
+
+
+cdef inline void indexed_heap_replace(IndexedHeap* h, double key) nogil:
+    """
+        Change the key of the top item (which may only increase it).
+    """
+    h.keys[h.heap[0]] = key
+    indexed_heap_sift_down(h, 0)
+
+
+cdef inline long indexed_heap_pop(IndexedHeap* h) nogil:
+    """
+        Remove and return the item with the smallest key.
+    """
+    cdef long item = h.heap[0]
+    h.size -= 1
+    if h.size > 0:
+        indexed_heap_swap(h, 0, h.size)
+    h.position[item] = -1
+    indexed_heap_sift_down(h, 0)
+    return item
+
+
+cdef class IndexedMinHeap:
+    """
+        Owns the memory of an `IndexedHeap` for `capacity` items.
+    """
+    cdef IndexedHeap h
+    cdef np.ndarray keys
+    cdef np.ndarray heap
+    cdef np.ndarray position
+
+    def __cinit__(self, uint capacity):
+        self.keys = np.zeros((capacity,), dtype=np.float64)
+        self.heap = np.zeros((capacity,), dtype=np.int)
+        self.position = -np.ones((capacity,), dtype=np.int)
+
+        self.h.size = 0
+        self.h.keys = <double*> self.keys.data
+        self.h.heap = <long*> self.heap.data
+        self.h.position = <long*> self.position.data
+
+
+# The refractory state of the selected samplers is tracked in an indexed
+# min-heap keyed by the end of the refractory period of every currently
+# active sampler.
+
+cdef inline bint refractory_is_active(IndexedHeap* rh, long unit) nogil:
+    return indexed_heap_contains(rh, unit)
+
+
+cdef inline void refractory_activate(IndexedHeap* rh, long unit,
+                                     double end_time) nogil:
+    """
+        Set the refractory end time of `unit`, activating it if it is not
+        active already.
+    """
+    indexed_heap_push(rh, unit, end_time)
+
+
+cdef inline double refractory_next_end_time(IndexedHeap* rh) nogil:
+    return indexed_heap_min_key(rh)
+
+
+cdef inline long refractory_pop(IndexedHeap* rh) nogil:
+    """
+        Remove and return the sampler that becomes inactive next.
+    """
+    return indexed_heap_pop(rh)
+
+
+cdef class RefractoryTracker:
+    """
+        Refractory end times of `num_selected` samplers.
+    """
+    cdef IndexedMinHeap heap
+    cdef IndexedHeap* rh
+
+    def __cinit__(self, uint num_selected):
+        self.heap = IndexedMinHeap(num_selected)
+        self.rh = &self.heap.h
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def merge_spike_trains(spiketrains, np.int32_t[:] spike_ids,
+                       double[:] spike_times):
+    """
+        Merge the (individually sorted) `spiketrains` into `spike_ids` and
+        `spike_times`, which need to hold all spikes and may be strided (e.g.
+        the fields of a record array).
+
+        The next spike of every train is kept in a min-heap, so merging n
+        spikes from k trains takes O(n log k).
+    """
+    cdef uint num_trains = len(spiketrains)
+    cdef uint i, i_train
+    cdef uint num_spikes = 0
+
+    trains = []
+    for st in spiketrains:
+        st = np.ascontiguousarray(st, dtype=np.float64).reshape(-1)
+        if np.any(np.diff(st) < 0.):
+            st = np.sort(st)
+        trains.append(st)
+        num_spikes += st.shape[0]
+
+    if spike_ids.shape[0] != num_spikes or spike_times.shape[0] != num_spikes:
+        raise ValueError("Output arrays need to hold {} spikes.".format(
+            num_spikes))
+
+    # index of the next spike and number of spikes per train
+    cdef np.ndarray positions_arr = np.zeros((num_trains,), dtype=np.int)
+    cdef np.ndarray lengths_arr = np.array([st.shape[0] for st in trains],
+                                           dtype=np.int)
+    cdef long* positions = <long*> positions_arr.data
+    cdef long* lengths = <long*> lengths_arr.data
+
+    cdef double** times = <double**> calloc(max(1, num_trains),
+                                            sizeof(double*))
+    if times == NULL:
+        raise MemoryError()
+
+    cdef np.ndarray train
+    cdef IndexedMinHeap next_spikes = IndexedMinHeap(num_trains)
+    cdef IndexedHeap* h = &next_spikes.h
+
+    try:
+        for i_train in range(num_trains):
+            train = trains[i_train]
+            if lengths[i_train] > 0:
+                times[i_train] = <double*> train.data
+                indexed_heap_push(h, i_train, times[i_train][0])
+
+        with nogil:
+            for i in range(num_spikes):
+                i_train = indexed_heap_top(h)
+                spike_ids[i] = i_train
+                spike_times[i] = times[i_train][positions[i_train]]
+
+                positions[i_train] += 1
+                if positions[i_train] < lengths[i_train]:
+                    # the train stays in the heap keyed by its next spike
+                    indexed_heap_replace(h, times[i_train][positions[i_train]])
+                else:
+                    indexed_heap_pop(h)
+    finally:
+        free(times)
+
+
+def get_selected_lut(np.ndarray spike_ids, np.ndarray sampler_idx):
+    """
+        Return a lookup table mapping every sampler id occurring in
+        `spike_ids` or `sampler_idx` to its position in `sampler_idx` (-1 if
+        it is not selected).
+    """
+    cdef long max_id = -1
+    if spike_ids.shape[0] > 0:
+        max_id = spike_ids.max()
+    if sampler_idx.shape[0] > 0:
+        max_id = max(max_id, sampler_idx.max())
+
+    lut = -np.ones((max_id + 1,), dtype=np.int)
+    lut[sampler_idx] = np.arange(sampler_idx.shape[0])
+    return lut
+
+
+# kinds of events returned by `next_event`
+DEF EVENT_NONE = 0     # end of the recording
+DEF EVENT_ON = 1       # a selected sampler became active
+DEF EVENT_OFF = 2      # a selected sampler became inactive
+DEF EVENT_REFRESH = 3  # an active sampler spiked again
+
+
+cdef struct EventIterator:
+    # Iterates over the state changes of the selected samplers in a sorted
+    # spike stream. Spike ids are passed separately to `next_event` since
+    # structs cannot hold fused types.
+    double current_time
+    double duration
+    uint i_spike
+    uint num_spikes
+    const double* spike_times
+    long* lut          # sampler id -> selected index (-1: not selected)
+    double* tau        # refractory time per selected sampler
+    IndexedHeap* rh    # refractory end times of the active samplers
+    long unit          # selected index affected by the last event
+
+
+cdef inline uint next_selected_spike(
+        uint i_spike, uint num_spikes, const spike_id_t* spike_ids,
+        long* lut) nogil:
+    # skip all spikes from samplers we do not care about
+    while i_spike < num_spikes and lut[spike_ids[i_spike]] < 0:
+        i_spike += 1
+    return i_spike
+
+
+cdef inline void init_event_iterator(
+        EventIterator* ei, const spike_id_t* spike_ids, const double* spike_times,
+        uint num_spikes, long* lut, double* tau, IndexedHeap* rh,
+        double duration) nogil:
+    ei.current_time = 0.
+    ei.duration = duration
+    ei.num_spikes = num_spikes
+    ei.spike_times = spike_times
+    ei.lut = lut
+    ei.tau = tau
+    ei.rh = rh
+    ei.unit = -1
+    ei.i_spike = next_selected_spike(0, num_spikes, spike_ids, lut)
+
+
+cdef inline int next_event(
+        EventIterator* ei, const spike_id_t* spike_ids, double* time_step) nogil:
+    """
+        Advance to the next event, update the refractory heap accordingly and
+        return the kind of the event.
+
+        `time_step` is set to the time the network spent in the previous
+        state. Inactivations take precedence over simultaneous spikes and no
+        time beyond the duration of the recording is accounted for.
+    """
+    cdef double next_inactivation, next_spike, event_time
+    cdef bint is_spike
+    cdef int kind = EVENT_NONE
+
+    next_inactivation = refractory_next_end_time(ei.rh)
+
+    if ei.i_spike < ei.num_spikes:
+        next_spike = ei.spike_times[ei.i_spike]
+    else:
+        next_spike = ei.duration
+
+    # check out if the next event is a spike or a simple inactivation of a
+    # sampler
+    if next_inactivation > next_spike:
+        is_spike = ei.i_spike < ei.num_spikes
+        event_time = next_spike
+    else:
+        is_spike = False
+        event_time = next_inactivation
+
+    if event_time > ei.duration:
+        is_spike = False
+        event_time = ei.duration
+
+    time_step[0] = event_time - ei.current_time
+    ei.current_time = event_time
+
+    if is_spike:
+        ei.unit = ei.lut[spike_ids[ei.i_spike]]
+        if refractory_is_active(ei.rh, ei.unit):
+            kind = EVENT_REFRESH
+        else:
+            kind = EVENT_ON
+        refractory_activate(ei.rh, ei.unit, event_time + ei.tau[ei.unit])
+
+        ei.i_spike = next_selected_spike(ei.i_spike + 1, ei.num_spikes,
+                                         spike_ids, ei.lut)
+
+    elif next_inactivation <= event_time:
+        ei.unit = refractory_pop(ei.rh)
+        kind = EVENT_OFF
+
+    return kind
+
+
+cdef class SpikeEventSource:
+    """
+        Keeps all buffers needed to iterate over the events of the selected
+        samplers alive and provides the pointers for `init_event_iterator`.
+    """
+    cdef RefractoryTracker tracker
+    cdef np.ndarray lut
+    cdef np.ndarray tau
+    cdef np.ndarray spike_times
+    cdef uint num_spikes
+    cdef uint num_selected
+
+    def __cinit__(self, np.ndarray spike_ids, np.ndarray spike_times,
+                  np.ndarray sampler_idx, np.ndarray tau_refrac_pss):
+        assert spike_ids.shape[0] == spike_times.shape[0]
+        assert sampler_idx.shape[0] == tau_refrac_pss.shape[0],\
+            "Need one refractory time per selected sampler"
+
+        self.num_spikes = spike_ids.shape[0]
+        self.num_selected = sampler_idx.shape[0]
+        self.tracker = RefractoryTracker(self.num_selected)
+        self.lut = get_selected_lut(spike_ids, sampler_idx)
+        self.tau = np.require(tau_refrac_pss, dtype=np.float64,
+                              requirements=["C"])
+        self.spike_times = np.require(spike_times, dtype=np.float64,
+                                      requirements=["C"])
+
+    cdef void init_iterator(self, EventIterator* ei, const spike_id_t* spike_ids,
+                            double duration):
+        init_event_iterator(ei, spike_ids, <double*> self.spike_times.data,
+                            self.num_spikes, <long*> self.lut.data,
+                            <double*> self.tau.data, self.tracker.rh,
+                            duration)
 
 
 @cython.boundscheck(False)
+@cython.wraparound(False)
 def get_bm_joint_sim(
-        np.ndarray[np.int_t, ndim=1] spike_ids,
-        np.ndarray[np.float64_t, ndim=1] spike_times,
+        const spike_id_t[::1] spike_ids,
+        const double[::1] spike_times,
         np.ndarray[np.int_t, ndim=1] sampler_idx,
         np.ndarray[np.float64_t, ndim=1] tau_refrac_pss, # per selected sampler
         double duration,
     ):
-    sampler_idx.sort()
-    assert spike_ids.shape[0] == spike_times.shape[0]
+    """
+        Get the joint distribution of the selected samplers from the time the
+        network spends in each state.
 
-    cdef double current_time = 0.
-    cdef uint i_spike = 0
-    cdef uint i, sampler_id
-    cdef double next_inactivation, next_spike, time_step
-    cdef uint num_spikes = spike_ids.shape[0]
+        Spikes are routed to the selected samplers via a lookup table and the
+        refractory end times are kept in a min-heap, so each event costs
+        O(log num_selected).
+
+        Note: `sampler_idx` is sorted in-place and `tau_refrac_pss` has to
+        correspond to the sorted order.
+    """
+    sampler_idx.sort()
 
     cdef uint num_selected = sampler_idx.shape[0]
-    cdef long* sampler_idx_ptr = <long*> sampler_idx.data 
+    cdef uint num_total = ((<uint> 1) << num_selected)
 
-    cdef np.ndarray[np.float64_t, ndim=1] tau_sampler =\
-            np.zeros((num_selected,), dtype=np.float64)
-    cdef double* tau_sampler_ptr = <double*> tau_sampler.data
+    cdef SpikeEventSource source = SpikeEventSource(
+            np.asarray(spike_ids), np.asarray(spike_times), sampler_idx,
+            tau_refrac_pss)
 
-    cdef uint num_total = (1 << num_selected)
     cdef np.ndarray[np.float64_t, ndim=1] joints = np.zeros((num_total,),
             dtype=np.float64)
+    cdef double* joints_ptr = <double*> joints.data
 
-    cdef bool is_spike
+    cdef const spike_id_t* spike_ids_ptr = NULL
+    if spike_ids.shape[0] > 0:
+        spike_ids_ptr = &spike_ids[0]
 
-    # since getting the joint for too many samplers is infeasable
-    # we can store 
-    cdef uint current_state
+    cdef EventIterator ei
+    cdef double time_step
+    cdef uint current_state = 0
+    cdef int kind
 
-    # skip all spikes from samplers we do not care about
-    while i_spike < num_spikes and not check_value_in_long_array(
-            spike_ids[i_spike], num_selected, sampler_idx_ptr):
-        i_spike += 1
+    source.init_iterator(&ei, spike_ids_ptr, duration)
 
-    while current_time < duration:
+    with nogil:
+        while ei.current_time < duration:
+            kind = next_event(&ei, spike_ids_ptr, &time_step)
 
-        # find next activation
-        next_inactivation = np.inf
-        for i in range(num_selected):
-            if tau_sampler_ptr[i] > 0.\
-                    and tau_sampler_ptr[i] < next_inactivation:
-                next_inactivation = tau_sampler_ptr[i]
+            # note that the current state is on until the next event
+            joints_ptr[current_state] += time_step
 
-        if i_spike < num_spikes:
-            next_spike = spike_times[i_spike] - current_time
-        else:
-            next_spike = duration - current_time
+            if kind == EVENT_ON or kind == EVENT_OFF:
+                current_state ^= (<uint> 1) << (num_selected - 1 - ei.unit)
 
-        # check out if the next event is a spike or a simple inactivation of
-        # a sampler
-        if next_inactivation > next_spike:
-            is_spike = i_spike < num_spikes
-            time_step = next_spike
+    joints /= duration
+    return joints.reshape([2 for i in range(num_selected)])
 
-        else:
-            is_spike = False
-            time_step = next_inactivation
 
-        current_state = get_current_state(num_selected, tau_sampler_ptr)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_bm_sim_checkpoints(
+        const spike_id_t[::1] spike_ids,
+        const double[::1] spike_times,
+        np.ndarray[np.int_t, ndim=1] sampler_idx,
+        np.ndarray[np.float64_t, ndim=1] tau_refrac_pss, # per selected sampler
+        checkpoints,
+        bint joint=True,
+    ):
+    """
+        Get the marginal and (if `joint` is True) joint distributions of the
+        selected samplers over the recording up to each of the (sorted)
+        `checkpoints` in a single pass over the spikes.
 
-        # note that the current state is on for the next time
-        joints[current_state] += time_step
+        Returns a tuple (marginals, joints) with marginals being of shape
+        (num_checkpoints, num_selected) and joints of shape
+        (num_checkpoints, 2, ..., 2) (None if `joint` is False). Each row is
+        what `get_bm_joint_sim` would return for duration = checkpoint.
 
-        for i in range(num_selected):
-            tau_sampler[i] -= time_step
+        Note: `sampler_idx` is sorted in-place and `tau_refrac_pss` has to
+        correspond to the sorted order.
+    """
+    sampler_idx.sort()
+
+    cdef np.ndarray[np.float64_t, ndim=1] cps = np.require(
+            checkpoints, dtype=np.float64, requirements=["C"])
+    cdef uint num_checkpoints = cps.shape[0]
 
-        if is_spike:
-            sampler_id = spike_ids[i_spike]
+    if num_checkpoints > 0 and (cps[0] <= 0. or np.any(np.diff(cps) < 0.)):
+        raise ValueError("Checkpoints have to be positive and sorted.")
+
+    cdef uint num_selected = sampler_idx.shape[0]
+    cdef uint num_total = ((<uint> 1) << num_selected) if joint else 0
+
+    cdef SpikeEventSource source = SpikeEventSource(
+            np.asarray(spike_ids), np.asarray(spike_times), sampler_idx,
+            tau_refrac_pss)
+
+    cdef np.ndarray[np.float64_t, ndim=2] marginals = np.zeros(
+            (num_checkpoints, num_selected), dtype=np.float64)
+    cdef np.ndarray[np.float64_t, ndim=2] joints = np.zeros(
+            (num_checkpoints if joint else 0, num_total), dtype=np.float64)
+
+    # time spent in each state / active per sampler up to the current time
+    cdef np.ndarray[np.float64_t, ndim=1] dwell_times = np.zeros(
+            (num_total,), dtype=np.float64)
+    cdef np.ndarray[np.float64_t, ndim=1] active_times = np.zeros(
+            (num_selected,), dtype=np.float64)
+    cdef np.ndarray[np.float64_t, ndim=1] active_since = np.zeros(
+            (num_selected,), dtype=np.float64)
+
+    cdef double* dwell_ptr = <double*> dwell_times.data
+    cdef double* active_times_ptr = <double*> active_times.data
+    cdef double* active_since_ptr = <double*> active_since.data
+
+    cdef const spike_id_t* spike_ids_ptr = NULL
+    if spike_ids.shape[0] > 0:
+        spike_ids_ptr = &spike_ids[0]
+
+    cdef EventIterator ei
+    cdef double time_step, active_time
+    cdef uint current_state = 0
+    cdef uint i_cp, i
+    cdef int kind
+
+    source.init_iterator(&ei, spike_ids_ptr, 0.)
+
+    with nogil:
+        for i_cp in range(num_checkpoints):
+            ei.duration = cps[i_cp]
+
+            while ei.current_time < ei.duration:
+                kind = next_event(&ei, spike_ids_ptr, &time_step)
+
+                if joint:
+                    dwell_ptr[current_state] += time_step
+                    if kind == EVENT_ON or kind == EVENT_OFF:
+                        current_state ^= (<uint> 1)\
+                            << (num_selected - 1 - ei.unit)
+
+                if kind == EVENT_ON:
+                    active_since_ptr[ei.unit] = ei.current_time
+                elif kind == EVENT_OFF:
+                    active_times_ptr[ei.unit] +=\
+                        ei.current_time - active_since_ptr[ei.unit]
 
             for i in range(num_selected):
-                if sampler_idx_ptr[i] == sampler_id:
-                    sampler_id = i
-                    break
-            # adjust current spike
-            tau_sampler[sampler_id] = tau_refrac_pss[sampler_id]
+                active_time = active_times_ptr[i]
+                if refractory_is_active(ei.rh, i):
+                    active_time += ei.current_time - active_since_ptr[i]
+                marginals[i_cp, i] = active_time / ei.current_time
+
+            for i in range(num_total):
+                joints[i_cp, i] = dwell_ptr[i] / ei.current_time
 
-            # find next spike
-            i_spike += 1
-            # skip all spikes from samplers we do not care about
-            while i_spike < num_spikes and not check_value_in_long_array(
-                    spike_ids[i_spike], num_selected, sampler_idx_ptr):
-                i_spike += 1
+    if joint:
+        return marginals, joints.reshape(
+                [num_checkpoints] + [2 for i in range(num_selected)])
+    else:
+        return marginals, None
 
-        current_time += time_step
-        # print "tau",
-        # for i in range(num_selected):
-            # print tau_sampler_ptr[i],
-        # print ""
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_bm_joint_sim_subsets(
+        const spike_id_t[::1] spike_ids,
+        const double[::1] spike_times,
+        subsets,
+        np.ndarray[np.float64_t, ndim=1] tau_refracs, # per sampler id
+        double duration,
+    ):
+    """
+        Get the joint distributions of several subsets of samplers (e.g. all
+        pairs) in a single pass over the spikes.
+
+        Every subset keeps the index of its current state, which is only
+        updated when one of its members changes state, so the cost per event
+        is proportional to the number of subsets containing the sampler.
+
+        subsets: Sequence of arrays of (unique) sampler ids. The axes of each
+                 joint are ordered as the samplers in the subset.
+
+        tau_refracs: Refractory time of each sampler, indexed by sampler id.
+
+        Returns a list with the joint distribution of each subset.
+    """
+    subsets = [np.asarray(s, dtype=np.int).reshape(-1) for s in subsets]
+    cdef uint num_subsets = len(subsets)
+
+    if num_subsets == 0:
+        return []
+
+    for s in subsets:
+        assert len(np.unique(s)) == len(s),\
+            "Samplers within a subset must be unique"
+
+    cdef np.ndarray[np.int_t, ndim=1] subset_sizes = np.array(
+            [len(s) for s in subsets], dtype=np.int)
+    cdef np.ndarray[np.int_t, ndim=1] offsets = np.r_[
+            0, np.cumsum(1 << subset_sizes)].astype(np.int)
+
+    # all samplers contained in any subset
+    cdef np.ndarray[np.int_t, ndim=1] sampler_idx = np.unique(
+            np.concatenate(subsets)).astype(np.int)
+    cdef uint num_selected = sampler_idx.shape[0]
+
+    # for each selected sampler, the subsets it belongs to and the bit it
+    # sets in their state index (stored contiguously per sampler)
+    member_units = np.concatenate(
+            [np.searchsorted(sampler_idx, s) for s in subsets])
+    member_subsets = np.repeat(np.arange(num_subsets), subset_sizes)
+    member_bits = np.concatenate(
+            [1 << np.arange(size - 1, -1, -1) for size in subset_sizes])
+
+    order = np.argsort(member_units, kind="mergesort")
+    cdef np.ndarray[np.int_t, ndim=1] membership_subsets = np.require(
+            member_subsets[order], dtype=np.int, requirements=["C"])
+    cdef np.ndarray[np.int_t, ndim=1] membership_bits = np.require(
+            member_bits[order], dtype=np.int, requirements=["C"])
+    cdef np.ndarray[np.int_t, ndim=1] membership_ptr = np.r_[
+            0, np.cumsum(np.bincount(member_units, minlength=num_selected))
+            ].astype(np.int)
+
+    cdef SpikeEventSource source = SpikeEventSource(
+            np.asarray(spike_ids), np.asarray(spike_times), sampler_idx,
+            tau_refracs[sampler_idx])
+
+    cdef np.ndarray[np.float64_t, ndim=1] joints = np.zeros(
+            (offsets[num_subsets],), dtype=np.float64)
+    cdef np.ndarray[np.int_t, ndim=1] current_states = np.zeros(
+            (num_subsets,), dtype=np.int)
+    cdef np.ndarray[np.float64_t, ndim=1] last_changes = np.zeros(
+            (num_subsets,), dtype=np.float64)
+
+    cdef const spike_id_t* spike_ids_ptr = NULL
+    if spike_ids.shape[0] > 0:
+        spike_ids_ptr = &spike_ids[0]
+
+    cdef EventIterator ei
+    cdef double time_step
+    cdef long i, i_subset
+    cdef int kind
+
+    source.init_iterator(&ei, spike_ids_ptr, duration)
+
+    with nogil:
+        while ei.current_time < duration:
+            kind = next_event(&ei, spike_ids_ptr, &time_step)
+
+            if kind != EVENT_ON and kind != EVENT_OFF:
+                continue
+
+            # only the subsets containing the affected sampler change state
+            for i in range(membership_ptr[ei.unit],
+                           membership_ptr[ei.unit + 1]):
+                i_subset = membership_subsets[i]
+                joints[offsets[i_subset] + current_states[i_subset]] +=\
+                    ei.current_time - last_changes[i_subset]
+                last_changes[i_subset] = ei.current_time
+                current_states[i_subset] ^= membership_bits[i]
+
+        for i_subset in range(num_subsets):
+            joints[offsets[i_subset] + current_states[i_subset]] +=\
+                ei.current_time - last_changes[i_subset]
 
     joints /= duration
-    return joints.reshape([2 for i in range(num_selected)])
+
+    return [joints[offsets[k]:offsets[k+1]].reshape([2] * subset_sizes[k])
+            for k in range(num_subsets)]
+
+
+cdef struct StateTable:
+    # Open-addressing hash map from packed binary states (`num_words` uint64
+    # words each, unit i being bit i % 64 of word i // 64) to accumulated
+    # dwell times.
+    uint num_words
+    uint capacity  # always a power of two
+    uint size
+    np.uint64_t* keys
+    np.uint64_t* hashes
+    double* values
+    np.uint8_t* used
+
+
+cdef inline bint state_table_alloc(StateTable* st, uint capacity) nogil:
+    st.capacity = capacity
+    st.size = 0
+    st.keys = <np.uint64_t*> calloc(capacity * st.num_words,
+                                     sizeof(np.uint64_t))
+    st.hashes = <np.uint64_t*> calloc(capacity, sizeof(np.uint64_t))
+    st.values = <double*> calloc(capacity, sizeof(double))
+    st.used = <np.uint8_t*> calloc(capacity, sizeof(np.uint8_t))
+    return st.keys != NULL and st.hashes != NULL and st.values != NULL\
+        and st.used != NULL
+
+
+cdef inline void state_table_free(StateTable* st) nogil:
+    free(st.keys)
+    free(st.hashes)
+    free(st.values)
+    free(st.used)
+    st.keys = NULL
+    st.hashes = NULL
+    st.values = NULL
+    st.used = NULL
+
+
+cdef inline uint state_table_find(
+        StateTable* st, np.uint64_t* key, np.uint64_t hash_value) nogil:
+    """
+        Return the slot of `key` or of the empty slot where it belongs.
+    """
+    cdef uint slot = hash_value & (st.capacity - 1)
+    cdef uint i
+    cdef bint equal
+    while st.used[slot]:
+        if st.hashes[slot] == hash_value:
+            equal = True
+            for i in range(st.num_words):
+                if st.keys[slot * st.num_words + i] != key[i]:
+                    equal = False
+                    break
+            if equal:
+                break
+        slot = (slot + 1) & (st.capacity - 1)
+    return slot
+
+
+cdef inline bint state_table_grow(StateTable* st) nogil:
+    cdef StateTable old = st[0]
+    cdef uint i, j, slot
+
+    if not state_table_alloc(st, 2 * old.capacity):
+        state_table_free(st)
+        st[0] = old
+        return False
+
+    for i in range(old.capacity):
+        if not old.used[i]:
+            continue
+        slot = state_table_find(st, old.keys + i * old.num_words,
+                                old.hashes[i])
+        for j in range(st.num_words):
+            st.keys[slot * st.num_words + j] = old.keys[i * old.num_words + j]
+        st.hashes[slot] = old.hashes[i]
+        st.values[slot] = old.values[i]
+        st.used[slot] = 1
+        st.size += 1
+
+    state_table_free(&old)
+    return True
+
+
+cdef inline bint state_table_add(
+        StateTable* st, np.uint64_t* key, np.uint64_t hash_value,
+        double value) nogil:
+    """
+        Add `value` to the entry of `key`, returns False if out of memory.
+    """
+    cdef uint i
+    cdef uint slot = state_table_find(st, key, hash_value)
+
+    if not st.used[slot]:
+        # keep the load factor below one half
+        if 2 * (st.size + 1) > st.capacity:
+            if not state_table_grow(st):
+                return False
+            slot = state_table_find(st, key, hash_value)
+
+        for i in range(st.num_words):
+            st.keys[slot * st.num_words + i] = key[i]
+        st.hashes[slot] = hash_value
+        st.used[slot] = 1
+        st.size += 1
+
+    st.values[slot] += value
+    return True
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_bm_joint_sim_sparse(
+        const spike_id_t[::1] spike_ids,
+        const double[::1] spike_times,
+        np.ndarray[np.int_t, ndim=1] sampler_idx,
+        np.ndarray[np.float64_t, ndim=1] tau_refrac_pss, # per selected sampler
+        double duration,
+    ):
+    """
+        Get the joint distribution of the selected samplers as sparse
+        representation containing only the states actually visited.
+
+        The dwell time of each visited state is accumulated in a hash map
+        keyed by the packed bit pattern of the state (updated incrementally
+        via Zobrist hashing), so memory scales with the number of visited
+        states instead of 2**num_selected.
+
+        Note: `sampler_idx` is sorted in-place and `tau_refrac_pss` has to
+        correspond to the sorted order.
+
+        Returns:
+            (states, probabilities) with states of shape
+            (num_visited, num_selected) (uint8), sorted by descending
+            probability.
+    """
+    sampler_idx.sort()
+
+    cdef uint num_selected = sampler_idx.shape[0]
+    cdef uint num_words = max(1, (num_selected + 63) // 64)
+
+    cdef SpikeEventSource source = SpikeEventSource(
+            np.asarray(spike_ids), np.asarray(spike_times), sampler_idx,
+            tau_refrac_pss)
+
+    # random (but fixed) bit strings per sampler for incremental hashing
+    cdef np.ndarray[np.uint64_t, ndim=1] zobrist = np.random.RandomState(
+            42).randint(0, 1 << 62, size=max(1, num_selected)).astype(
+                    np.uint64) * np.uint64(3) + np.uint64(1)
+    cdef np.ndarray[np.uint64_t, ndim=1] current_state = np.zeros(
+            (num_words,), dtype=np.uint64)
+
+    cdef np.uint64_t* zobrist_ptr = <np.uint64_t*> zobrist.data
+    cdef np.uint64_t* state_ptr = <np.uint64_t*> current_state.data
+    cdef np.uint64_t current_hash = 0
+
+    cdef const spike_id_t* spike_ids_ptr = NULL
+    if spike_ids.shape[0] > 0:
+        spike_ids_ptr = &spike_ids[0]
+
+    cdef StateTable st
+    st.num_words = num_words
+    if not state_table_alloc(&st, 1024):
+        state_table_free(&st)
+        raise MemoryError()
+
+    cdef EventIterator ei
+    cdef double time_step
+    cdef int kind
+    cdef bint success = True
+
+    source.init_iterator(&ei, spike_ids_ptr, duration)
+
+    try:
+        with nogil:
+            while ei.current_time < duration:
+                kind = next_event(&ei, spike_ids_ptr, &time_step)
+
+                if time_step > 0.:
+                    if not state_table_add(&st, state_ptr, current_hash,
+                                           time_step):
+                        success = False
+                        break
+
+                if kind == EVENT_ON or kind == EVENT_OFF:
+                    state_ptr[ei.unit >> 6] ^= (<np.uint64_t> 1)\
+                        << (ei.unit & 63)
+                    current_hash ^= zobrist_ptr[ei.unit]
+
+        if not success:
+            raise MemoryError()
+
+        used = np.array(<np.uint8_t[:st.capacity]> st.used, dtype=bool)
+        keys = np.array(<np.uint64_t[:st.capacity * num_words]> st.keys
+                        ).reshape(st.capacity, num_words)[used]
+        probs = np.array(<double[:st.capacity]> st.values)[used]
+
+    finally:
+        state_table_free(&st)
+
+    # unpack the bits of each byte (least significant bit first)
+    packed = keys.astype("<u8").view(np.uint8).reshape(len(keys), -1)
+    states = np.unpackbits(packed[:, :, None], axis=2)[:, :, ::-1].reshape(
+            len(keys), -1)[:, :num_selected]
+
+    # most probable states first
+    order = np.argsort(-probs, kind="mergesort")
+
+    return states[order], probs[order] / duration
+
+
+cdef inline void update_coactivations(
+        long unit,
+        bint is_active,
+        double clock,
+        uint num_selected,
+        long* active,
+        long* active_pos,
+        uint* num_active,
+        double* correlations,
+        double* starts,
+    ) nogil:
+    """
+        Account for `unit` having been switched on/off at time `clock`, only
+        touching the pairs of `unit` with the currently active samplers
+        (including itself).
+    """
+    cdef uint i
+    cdef long other, pair_idx
+
+    if is_active:
+        active[num_active[0]] = unit
+        active_pos[unit] = num_active[0]
+        num_active[0] += 1
+
+    for i in range(num_active[0]):
+        other = active[i]
+        # only the upper triangle is used during the accumulation
+        if other < unit:
+            pair_idx = other * num_selected + unit
+        else:
+            pair_idx = unit * num_selected + other
+
+        if is_active:
+            starts[pair_idx] = clock
+        else:
+            correlations[pair_idx] += clock - starts[pair_idx]
+
+    if not is_active:
+        # swap-remove from the list of active samplers
+        num_active[0] -= 1
+        other = active[num_active[0]]
+        active[active_pos[unit]] = other
+        active_pos[other] = active_pos[unit]
+        active_pos[unit] = -1
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def get_pairwise_correlations(
-        np.ndarray[np.int_t, ndim=1] spike_ids,
-        np.ndarray[np.float64_t, ndim=1] spike_times,
+        const spike_id_t[::1] spike_ids,
+        const double[::1] spike_times,
         np.ndarray[np.int_t, ndim=1] sampler_idx,
         np.ndarray[np.float64_t, ndim=1] tau_refrac_pss,  # per selected
                                                           # sampler
@@ -367,155 +1608,701 @@ def get_pairwise_correlations(
                       only start to be recorded once `ignore_until` is reached.
                       This way we can set the initial state of the network.
 
+    The co-activation time of each pair is accumulated lazily: When a
+    sampler becomes active, the current time is remembered for all pairs with
+    already active samplers and the elapsed time is added once it becomes
+    inactive again, so each event costs O(number of active samplers).
+
     Returns:
         Numpy array of shape (N, N).
     """
     sampler_idx.sort()
-    assert spike_ids.shape[0] == spike_times.shape[0]
-
-    cdef double current_time = 0.
-    cdef uint i_spike = 0
-    cdef uint i, sampler_id
-    cdef double next_inactivation, next_spike, time_step
-    cdef uint num_spikes = spike_ids.shape[0]
 
     cdef uint num_selected = sampler_idx.shape[0]
-    cdef long* sampler_idx_ptr = <long*> sampler_idx.data
-
-    cdef np.ndarray[np.float64_t, ndim=1] tau_sampler =\
-            np.zeros((num_selected,), dtype=np.float64)
-    cdef double* tau_sampler_ptr = <double*> tau_sampler.data
-
-    cdef bool is_spike
 
-    # store the current configuration
-    cdef np.ndarray[np.float64_t, ndim=1] current_state =\
-        np.zeros((num_selected,), dtype=np.float64)
+    cdef SpikeEventSource source = SpikeEventSource(
+            np.asarray(spike_ids), np.asarray(spike_times), sampler_idx,
+            tau_refrac_pss)
 
     # store the total correlations
     cdef np.ndarray[np.float64_t, ndim=2] correlations =\
         np.zeros((num_selected, num_selected), dtype=np.float64)
+    cdef np.ndarray[np.float64_t, ndim=2] starts =\
+        np.zeros((num_selected, num_selected), dtype=np.float64)
 
-    while current_time < duration:
-        # skip all spikes from samplers we do not care about
-        while i_spike < num_spikes and not check_value_in_long_array(
-                spike_ids[i_spike], num_selected, sampler_idx_ptr):
-            i_spike += 1
-
-        # find next activation
-        next_inactivation = np.inf
-        for i in range(num_selected):
-            if tau_sampler_ptr[i] > 0.\
-                    and tau_sampler_ptr[i] < next_inactivation:
-                next_inactivation = tau_sampler_ptr[i]
-
-        if i_spike < num_spikes:
-            next_spike = spike_times[i_spike] - current_time
-        else:
-            next_spike = duration - current_time
-
-        # check out if the next event is a spike or a simple inactivation of
-        # a sampler
-        if next_inactivation > next_spike:
-            is_spike = i_spike < num_spikes
-            time_step = next_spike
-        else:
-            is_spike = False
-            time_step = next_inactivation
-
-        if current_time < ignore_until:
-            # check if ignore_until is the next event to handle
-            time_till_record_start = (ignore_until - current_time)
-
-            if time_step > time_till_record_start:
-                # only advance till start point of recording
-                time_step = time_till_record_start
-                # the next spike could only be after we start recording
-                is_spike = False
-
-        for i in range(num_selected):
-            if tau_sampler[i] > 0.:
-                current_state[i] = 1.0
-            else:
-                current_state[i] = 0.0
-
-        # only calculate correlations after we passed the recording offset
-        if current_time >= ignore_until:
-            # compute which neurons are active toegether
-            current_correlation = np.outer(current_state.T, current_state)
-            # weight with current time_step and add to correlations
-            correlations += (current_correlation * time_step)
-
-        for i in range(num_selected):
-            tau_sampler[i] -= time_step
+    # list of currently active samplers
+    cdef np.ndarray[np.int_t, ndim=1] active = np.zeros((num_selected,),
+            dtype=np.int)
+    cdef np.ndarray[np.int_t, ndim=1] active_pos = -np.ones((num_selected,),
+            dtype=np.int)
+    cdef uint num_active = 0
 
-        if is_spike:
-            sampler_id = spike_ids[i_spike]
+    cdef double* correlations_ptr = <double*> correlations.data
+    cdef double* starts_ptr = <double*> starts.data
+    cdef long* active_ptr = <long*> active.data
+    cdef long* active_pos_ptr = <long*> active_pos.data
 
-            for i in range(num_selected):
-                if sampler_idx_ptr[i] == sampler_id:
-                    sampler_id = i
-                    break
-            # adjust current spike
-            tau_sampler[sampler_id] = tau_refrac_pss[sampler_id]
+    cdef const spike_id_t* spike_ids_ptr = NULL
+    if spike_ids.shape[0] > 0:
+        spike_ids_ptr = &spike_ids[0]
 
-            # find next spike
-            i_spike += 1
+    cdef EventIterator ei
+    cdef double time_step, clock
+    cdef int kind
+    cdef uint i, j
 
-        current_time += time_step
+    source.init_iterator(&ei, spike_ids_ptr, duration)
+
+    with nogil:
+        while ei.current_time < duration:
+            kind = next_event(&ei, spike_ids_ptr, &time_step)
+
+            if kind == EVENT_ON or kind == EVENT_OFF:
+                # correlations are only recorded after `ignore_until`
+                clock = ei.current_time - ignore_until
+                if clock < 0.:
+                    clock = 0.
+                update_coactivations(
+                        ei.unit, kind == EVENT_ON, clock, num_selected,
+                        active_ptr, active_pos_ptr, &num_active,
+                        correlations_ptr, starts_ptr)
+
+        # close all intervals that are still open
+        clock = ei.current_time - ignore_until
+        if clock < 0.:
+            clock = 0.
+        for i in range(num_active):
+            for j in range(num_active):
+                if active_ptr[i] <= active_ptr[j]:
+                    correlations_ptr[active_ptr[i] * num_selected
+                                     + active_ptr[j]] +=\
+                        clock - starts_ptr[active_ptr[i] * num_selected
+                                           + active_ptr[j]]
+
+    correlations += np.triu(correlations, 1).T
 
     # normalize with duration
     correlations /= (duration - ignore_until)
     return correlations
 
 
+cdef inline void set_state_bits(
+        np.uint8_t* samples, uint num_bytes, uint unit, uint sample_start,
+        uint sample_stop) nogil:
+    """
+        Set the bit of `unit` in all (packed) samples in
+        [sample_start, sample_stop).
+    """
+    cdef uint i_sample
+    cdef np.uint8_t* byte = samples + sample_start * num_bytes + (unit >> 3)
+    cdef np.uint8_t mask = 0x80 >> (unit & 7)
+    for i_sample in range(sample_start, sample_stop):
+        byte[0] |= mask
+        byte += num_bytes
+
+
+cdef class SpikeStreamAccumulator:
+    """
+        Base class for analyses of spike recordings that are processed chunk
+        by chunk with bounded memory.
+
+        Spikes have to be supplied in temporal order via `add_spikes`, the
+        refractory state of all selected samplers is carried across chunk
+        boundaries. `finalize` returns the result up to any point in time not
+        earlier than the last processed spike, after which more spikes can be
+        added. For this base class, the result are the states of the selected
+        samplers at that time.
+
+        Samplers are ordered as in `sampler_idx` (which is NOT sorted) and
+        `tau_refrac_pss` has one refractory time per selected sampler.
+    """
+    cdef RefractoryTracker tracker
+    cdef EventIterator ei
+    cdef np.ndarray lut
+    cdef np.ndarray tau
+    cdef np.ndarray state
+    cdef long* state_ptr
+    cdef readonly np.ndarray sampler_idx
+    cdef readonly uint num_selected
+
+    def __init__(self, sampler_idx, tau_refrac_pss):
+        self.sampler_idx = np.require(sampler_idx, dtype=np.int,
+                                      requirements=["C"])
+        self.num_selected = self.sampler_idx.shape[0]
+
+        assert len(np.unique(self.sampler_idx)) == self.num_selected,\
+            "Selected samplers must be unique"
+        assert len(tau_refrac_pss) == self.num_selected,\
+            "Need one refractory time per selected sampler"
+
+        self.tracker = RefractoryTracker(self.num_selected)
+        self.lut = get_selected_lut(np.zeros((0,), dtype=np.int),
+                                    self.sampler_idx)
+        self.tau = np.require(tau_refrac_pss, dtype=np.float64,
+                              requirements=["C"])
+        self.state = np.zeros((self.num_selected,), dtype=np.int)
+        self.state_ptr = <long*> self.state.data
+
+        self.ei.current_time = 0.
+        self.ei.duration = INFINITY
+        self.ei.i_spike = 0
+        self.ei.num_spikes = 0
+        self.ei.spike_times = NULL
+        self.ei.lut = <long*> self.lut.data
+        self.ei.tau = <double*> self.tau.data
+        self.ei.rh = self.tracker.rh
+        self.ei.unit = -1
+
+    property current_time:
+        """
+            Time up to which the recording has been processed.
+        """
+        def __get__(self):
+            return self.ei.current_time
+
+    cdef void handle_event(self, int kind, long unit,
+                           double time_step) nogil:
+        """
+            Called for every event with the state (in `state_ptr`) still
+            being the one before the event.
+        """
+        pass
+
+    cdef void prepare_until(self, double until) except *:
+        """
+            Called (with the GIL) before processing events up to `until`.
+        """
+        pass
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def add_spikes(self, const spike_id_t[::1] spike_ids,
+                   const double[::1] spike_times):
+        """
+            Process the next chunk of spikes, which has to be sorted and must
+            not contain spikes before `current_time`.
+        """
+        cdef uint num_spikes = spike_ids.shape[0]
+        assert spike_times.shape[0] == num_spikes
+
+        if num_spikes == 0:
+            return
+
+        if spike_times[0] < self.ei.current_time:
+            raise ValueError("Spike at {} before the current time {}."
+                             .format(spike_times[0], self.ei.current_time))
+
+        cdef long max_id = np.asarray(spike_ids).max()
+        if max_id >= self.lut.shape[0]:
+            self.lut = get_selected_lut(np.array([max_id], dtype=np.int),
+                                        self.sampler_idx)
+            self.ei.lut = <long*> self.lut.data
+
+        self.prepare_until(spike_times[num_spikes - 1])
+
+        # process spikes only, inactivations after the last spike are
+        # handled once it is clear that no earlier spike follows
+        self.ei.duration = INFINITY
+        self.ei.spike_times = &spike_times[0]
+        self.ei.num_spikes = num_spikes
+
+        with nogil:
+            self.ei.i_spike = next_selected_spike(
+                    0, num_spikes, &spike_ids[0], self.ei.lut)
+            process_accumulator_events(self, &spike_ids[0], True)
+
+        self.ei.spike_times = NULL
+        self.ei.num_spikes = 0
+        self.ei.i_spike = 0
+
+        # account for the time until the last (possibly unselected) spike
+        self.advance(spike_times[num_spikes - 1])
+
+    def add_spike_chunks(self, chunks):
+        """
+            Process all (spike_ids, spike_times) tuples yielded by `chunks`.
+        """
+        for spike_ids, spike_times in chunks:
+            self.add_spikes(
+                    np.require(spike_ids, requirements=["C"]),
+                    np.require(spike_times, dtype=np.float64,
+                               requirements=["C"]))
+
+    def advance(self, double until):
+        """
+            Process all inactivations up to `until`, promising that there will
+            be no further spikes before that time.
+        """
+        if until < self.ei.current_time:
+            raise ValueError("Cannot go back in time from {} to {}.".format(
+                self.ei.current_time, until))
+
+        self.prepare_until(until)
+        self.ei.duration = until
+
+        cdef const long long* no_spikes = NULL
+        with nogil:
+            process_accumulator_events(self, no_spikes, False)
+
+    def finalize(self, until=None):
+        """
+            Return the result up to time `until` (default: current time).
+        """
+        if until is not None:
+            self.advance(until)
+        return self.get_result()
+
+    cdef object get_result(self):
+        """
+            Called by `finalize`, the plain accumulator only tracks the
+            current states of the selected samplers.
+        """
+        return self.state.copy()
+
+
+cdef inline void process_accumulator_events(
+        SpikeStreamAccumulator acc, const spike_id_t* spike_ids,
+        bint spikes_only) nogil:
+    """
+        Process all events up to the last spike of the current chunk (if
+        `spikes_only`) or up to `acc.ei.duration`.
+    """
+    cdef int kind
+    cdef double time_step
+
+    while (acc.ei.i_spike < acc.ei.num_spikes if spikes_only
+           else acc.ei.current_time < acc.ei.duration):
+        kind = next_event(&acc.ei, spike_ids, &time_step)
+        acc.handle_event(kind, acc.ei.unit, time_step)
+        if kind == EVENT_ON:
+            acc.state_ptr[acc.ei.unit] = 1
+        elif kind == EVENT_OFF:
+            acc.state_ptr[acc.ei.unit] = 0
+
+
+cdef class JointAccumulator(SpikeStreamAccumulator):
+    """
+        Streaming version of `get_bm_joint_sim`.
+    """
+    cdef np.ndarray joints
+    cdef double* joints_ptr
+    cdef uint current_state
+
+    def __init__(self, sampler_idx, tau_refrac_pss):
+        super(JointAccumulator, self).__init__(sampler_idx, tau_refrac_pss)
+        self.joints = np.zeros(((<uint> 1) << self.num_selected,),
+                               dtype=np.float64)
+        self.joints_ptr = <double*> self.joints.data
+        self.current_state = 0
+
+    cdef void handle_event(self, int kind, long unit,
+                           double time_step) nogil:
+        self.joints_ptr[self.current_state] += time_step
+        if kind == EVENT_ON or kind == EVENT_OFF:
+            self.current_state ^= (<uint> 1) << (self.num_selected - 1 - unit)
+
+    cdef object get_result(self):
+        if self.ei.current_time <= 0.:
+            raise ValueError("Cannot normalize the joint distribution before "
+                             "any time has been accumulated.")
+        return (self.joints / self.ei.current_time).reshape(
+                [2 for i in range(self.num_selected)])
+
+
+cdef class CorrelationAccumulator(SpikeStreamAccumulator):
+    """
+        Streaming version of `get_pairwise_correlations`.
+    """
+    cdef np.ndarray correlations
+    cdef np.ndarray starts
+    cdef np.ndarray active
+    cdef np.ndarray active_pos
+    cdef uint num_active
+    cdef readonly double ignore_until
+
+    def __init__(self, sampler_idx, tau_refrac_pss, double ignore_until=0.):
+        super(CorrelationAccumulator, self).__init__(sampler_idx,
+                                                     tau_refrac_pss)
+        cdef uint n = self.num_selected
+        self.correlations = np.zeros((n, n), dtype=np.float64)
+        self.starts = np.zeros((n, n), dtype=np.float64)
+        self.active = np.zeros((n,), dtype=np.int)
+        self.active_pos = -np.ones((n,), dtype=np.int)
+        self.num_active = 0
+        self.ignore_until = ignore_until
+
+    cdef inline double get_clock(self) nogil:
+        # correlations are only recorded after `ignore_until`
+        if self.ei.current_time < self.ignore_until:
+            return 0.
+        return self.ei.current_time - self.ignore_until
+
+    cdef void handle_event(self, int kind, long unit,
+                           double time_step) nogil:
+        if kind == EVENT_ON or kind == EVENT_OFF:
+            update_coactivations(
+                    unit, kind == EVENT_ON, self.get_clock(),
+                    self.num_selected, <long*> self.active.data,
+                    <long*> self.active_pos.data, &self.num_active,
+                    <double*> self.correlations.data,
+                    <double*> self.starts.data)
+
+    cdef object get_result(self):
+        if self.ei.current_time <= self.ignore_until:
+            raise ValueError("Cannot normalize the correlations before any "
+                             "time after {} ms has been accumulated.".format(
+                                 self.ignore_until))
+        correlations = self.correlations.copy()
+        clock = self.get_clock()
+
+        # close all intervals that are still open
+        active = np.sort(self.active[:self.num_active])
+        pre, post = np.triu_indices(len(active))
+        correlations[active[pre], active[post]] +=\
+            clock - self.starts[active[pre], active[post]]
+
+        correlations += np.triu(correlations, 1).T
+        return correlations / (self.ei.current_time - self.ignore_until)
+
+
+cdef class StateAccumulator(SpikeStreamAccumulator):
+    """
+        Streaming version of `generate_states`: The states of the selected
+        samplers are sampled every `time_per_sample` starting at t=0 (spikes
+        at the sampling time are taken into account).
+
+        The samples are stored bit-packed and only unpacked by `get_result`
+        unless `packed` is True.
+    """
+    cdef np.ndarray samples
+    cdef readonly double time_per_sample
+    cdef readonly uint num_samples
+    cdef readonly uint num_bytes
+    cdef readonly bint packed
+
+    def __init__(self, sampler_idx, tau_refrac_pss, double time_per_sample,
+                 bint packed=False):
+        super(StateAccumulator, self).__init__(sampler_idx, tau_refrac_pss)
+        self.time_per_sample = time_per_sample
+        self.packed = packed
+        self.num_samples = 0
+        self.num_bytes = (self.num_selected + 7) // 8
+        self.samples = np.zeros((0, self.num_bytes), dtype=np.uint8)
+
+    cdef void prepare_until(self, double until) except *:
+        cdef uint required = <uint> ceil(until / self.time_per_sample)
+        cdef uint capacity = self.samples.shape[0]
+        if required > capacity:
+            samples = np.zeros((max(required, 2 * capacity), self.num_bytes),
+                               dtype=np.uint8)
+            samples[:self.num_samples] = self.samples[:self.num_samples]
+            self.samples = samples
+
+    cdef void handle_event(self, int kind, long unit,
+                           double time_step) nogil:
+        cdef uint i, sample_start
+        cdef np.uint8_t* samples_ptr = <np.uint8_t*> self.samples.data
+
+        # record all samples taken strictly before the event
+        sample_start = self.num_samples
+        while self.num_samples * self.time_per_sample < self.ei.current_time:
+            self.num_samples += 1
+
+        if sample_start < self.num_samples:
+            for i in range(self.num_selected):
+                if self.state_ptr[i]:
+                    set_state_bits(samples_ptr, self.num_bytes, i,
+                                   sample_start, self.num_samples)
+
+    cdef object get_result(self):
+        num_samples = min(self.num_samples, int(
+            self.ei.current_time // self.time_per_sample))
+        samples = self.samples[:num_samples].copy()
+        if self.packed:
+            return samples
+        else:
+            return unpack_states(samples, self.num_selected, dtype=np.int)
+
+
+def unpack_states(np.ndarray[np.uint8_t, ndim=2] packed, uint num_samplers,
+                  dtype=bool):
+    """
+        Unpack bit-packed states (as returned by `generate_states` with
+        `packed=True`) into an array of shape (num_samples, num_samplers).
+
+        For dtype=bool the unpacked bits are only viewed as bool without a
+        further copy (the view is not C-contiguous unless num_samplers is a
+        multiple of 8).
+    """
+    unpacked = np.unpackbits(packed, axis=1)[:, :num_samplers]
+    if np.dtype(dtype) == np.bool_:
+        return unpacked.view(np.bool_)
+    return unpacked.astype(dtype)
+
+
 @cython.boundscheck(False)
+@cython.wraparound(False)
 def generate_states(
-        np.ndarray[np.int_t, ndim=1] spike_ids,
+        const spike_id_t[::1] spike_ids,
         np.ndarray[np.int_t, ndim=1] spike_times,
         np.ndarray[np.int_t, ndim=1] tau_refrac_pss, # per selected sampler
         uint num_samplers,
         uint steps_per_sample,
         uint duration,
+        bint packed=False,
         ):
+    """
+        Sample the states of all samplers every `steps_per_sample` time steps
+        (spike times and refractory times are given in time steps as well).
+
+        Every spike switches its sampler on for all samples in its refractory
+        period, so the cost is proportional to the number of spikes and the
+        number of active entries instead of the number of time steps.
+
+        Returns:
+            States of shape (num_samples, num_samplers) as np.int array or,
+            if `packed` is True, bit-packed along the sampler axis (uint8
+            array of shape (num_samples, ceil(num_samplers / 8)) in the
+            layout of np.packbits, see `unpack_states`).
+    """
     assert spike_ids.shape[0] == spike_times.shape[0]
+    assert tau_refrac_pss.shape[0] == num_samplers
 
     cdef uint num_samples = <uint>(duration / steps_per_sample)
-
-    cdef uint current_step = 0
-    cdef uint i_spike = 0
-    cdef uint i_sample = 0
-    cdef uint i
+    cdef uint num_bytes = (num_samplers + 7) // 8
     cdef uint num_spikes = spike_ids.shape[0]
 
-    cdef np.ndarray[np.int_t, ndim=1] last_spiketimes =\
-            np.zeros((num_samplers,), dtype=np.int) - 2147483647
+    cdef np.ndarray[np.uint8_t, ndim=2] samples = np.zeros(
+            (num_samples, num_bytes), dtype=np.uint8)
 
-    cdef np.ndarray[np.int_t, ndim=2] samples = np.zeros(
-            (num_samples, num_samplers), dtype=np.int)
+    # first sample not yet filled per sampler
+    cdef np.ndarray[np.int_t, ndim=1] filled_until = np.zeros(
+            (num_samplers,), dtype=np.int)
 
-    cdef np.ndarray[np.int_t, ndim=1] current_state = np.zeros((num_samplers,),
-            dtype=np.int)
+    cdef np.uint8_t* samples_ptr = <np.uint8_t*> samples.data
+    cdef long* filled_ptr = <long*> filled_until.data
+    cdef long* spike_times_ptr = <long*> spike_times.data
+    cdef long* tau_ptr = <long*> tau_refrac_pss.data
+
+    cdef uint i_spike, unit
+    cdef long sample_start, sample_stop
+
+    for i_spike in range(num_spikes):
+        if spike_ids[i_spike] < 0 or spike_ids[i_spike] >= num_samplers:
+            raise IndexError("Invalid sampler id {}".format(
+                spike_ids[i_spike]))
+
+    with nogil:
+        for i_spike in range(num_spikes):
+            unit = spike_ids[i_spike]
+
+            # samples taken at steps in [spike, spike + tau_refrac)
+            sample_start = (spike_times_ptr[i_spike] + steps_per_sample - 1)\
+                // steps_per_sample
+            sample_stop = (spike_times_ptr[i_spike] + tau_ptr[unit]
+                           + steps_per_sample - 1) // steps_per_sample
+
+            if sample_start < filled_ptr[unit]:
+                sample_start = filled_ptr[unit]
+            if sample_start < 0:
+                sample_start = 0
+            if sample_stop > num_samples:
+                sample_stop = num_samples
+
+            if sample_start < sample_stop:
+                set_state_bits(samples_ptr, num_bytes, unit, sample_start,
+                               sample_stop)
+                filled_ptr[unit] = sample_stop
 
-    while current_step <= duration-steps_per_sample:
+    if packed:
+        return samples
+    else:
+        return unpack_states(samples, num_samplers, dtype=np.int)
 
-        # print "Setting last spiketimes"
 
-        while i_spike < num_spikes and spike_times[i_spike] <= current_step:
-            last_spiketimes[spike_ids[i_spike]] = spike_times[i_spike]
-            i_spike += 1
+cdef inline uint varint_size(np.uint64_t value) nogil:
+    cdef uint size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
 
-        # print "Getting state"
 
-        for i in range(num_samplers):
-            current_state[i] = current_step - last_spiketimes[i]\
-                    < tau_refrac_pss[i]
+cdef inline uint varint_write(np.uint8_t* data, np.uint64_t value) nogil:
+    """
+        Write `value` as LEB128 varint (7 bits per byte, least significant
+        first) and return the number of bytes written.
+    """
+    cdef uint size = 0
+    while value >= 0x80:
+        data[size] = <np.uint8_t> ((value & 0x7f) | 0x80)
+        value >>= 7
+        size += 1
+    data[size] = <np.uint8_t> value
+    return size + 1
+
+
+cdef inline np.uint64_t varint_read(const np.uint8_t* data,
+                                    long* position) nogil:
+    cdef np.uint64_t value = 0
+    cdef uint shift = 0
+    cdef np.uint8_t byte
+    while True:
+        byte = data[position[0]]
+        position[0] += 1
+        value |= (<np.uint64_t> (byte & 0x7f)) << shift
+        if byte < 0x80:
+            return value
+        shift += 7
 
-        # print "Setting samples"
 
-        samples[i_sample] = current_state
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def encode_varint_deltas(np.int64_t[::1] steps, np.int64_t[::1] offsets,
+                         long block_size):
+    """
+        Encode the (sorted, non-negative) integer `steps` of each group
+        [offsets[i], offsets[i+1]) as varints of the differences between
+        consecutive steps (the first one relative to zero).
 
-        current_step += steps_per_sample
-        i_sample += 1
+        Every `block_size` values of a group, the current byte position and
+        the preceding step are recorded, which allows decoding to start in
+        the middle of a group (see `decode_varint_deltas_window`).
 
-    return samples
+        Returns (data, byte_offsets, block_bytes, block_steps, block_offsets)
+        with group i occupying data[byte_offsets[i]:byte_offsets[i+1]] and
+        its blocks being block_offsets[i]:block_offsets[i+1].
+    """
+    cdef long num_groups = offsets.shape[0] - 1
+    cdef long i_group, i, i_block
+    cdef np.int64_t previous
+    cdef bint invalid = False
+
+    counts = np.diff(np.asarray(offsets))
+    cdef np.ndarray[np.int64_t, ndim=1] block_offsets = np.r_[
+            0, np.cumsum((counts + block_size - 1) // block_size)].astype(
+                    np.int64)
+    cdef np.ndarray[np.int64_t, ndim=1] byte_offsets = np.zeros(
+            (num_groups + 1,), dtype=np.int64)
+
+    # first pass: determine the encoded size of each group
+    with nogil:
+        for i_group in range(num_groups):
+            previous = 0
+            byte_offsets[i_group + 1] = byte_offsets[i_group]
+            for i in range(offsets[i_group], offsets[i_group + 1]):
+                if steps[i] < previous:
+                    invalid = True
+                    break
+                byte_offsets[i_group + 1] += varint_size(steps[i] - previous)
+                previous = steps[i]
+            if invalid:
+                break
+
+    if invalid:
+        raise ValueError("Steps have to be non-negative and sorted within "
+                         "each group.")
+
+    cdef np.ndarray[np.uint8_t, ndim=1] data = np.empty(
+            (byte_offsets[num_groups],), dtype=np.uint8)
+    cdef np.ndarray[np.int64_t, ndim=1] block_bytes = np.empty(
+            (block_offsets[num_groups],), dtype=np.int64)
+    cdef np.ndarray[np.int64_t, ndim=1] block_steps = np.empty(
+            (block_offsets[num_groups],), dtype=np.int64)
+
+    cdef np.uint8_t* data_ptr = <np.uint8_t*> data.data
+    cdef long position
+
+    # second pass: write
+    with nogil:
+        for i_group in range(num_groups):
+            previous = 0
+            position = byte_offsets[i_group]
+            i_block = block_offsets[i_group]
+            for i in range(offsets[i_group], offsets[i_group + 1]):
+                if (i - offsets[i_group]) % block_size == 0:
+                    block_bytes[i_block] = position
+                    block_steps[i_block] = previous
+                    i_block += 1
+                position += varint_write(data_ptr + position,
+                                         steps[i] - previous)
+                previous = steps[i]
+
+    return data, byte_offsets, block_bytes, block_steps, block_offsets
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def decode_varint_deltas(const np.uint8_t[::1] data,
+                         const np.int64_t[::1] byte_offsets,
+                         const np.int64_t[::1] offsets):
+    """
+        Inverse of `encode_varint_deltas`, returns all steps (grouped).
+    """
+    cdef long num_groups = offsets.shape[0] - 1
+    cdef long i_group, i
+    cdef long position
+    cdef np.int64_t previous
+
+    cdef np.ndarray[np.int64_t, ndim=1] steps = np.empty(
+            (offsets[num_groups],), dtype=np.int64)
+
+    if data.shape[0] == 0:
+        return steps
+
+    cdef const np.uint8_t* data_ptr = &data[0]
+
+    with nogil:
+        for i_group in range(num_groups):
+            previous = 0
+            position = byte_offsets[i_group]
+            for i in range(offsets[i_group], offsets[i_group + 1]):
+                previous += varint_read(data_ptr, &position)
+                steps[i] = previous
+
+    return steps
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def decode_varint_deltas_window(
+        const np.uint8_t[::1] data, long position, long stop_position,
+        np.int64_t previous, np.int64_t step_start, np.int64_t step_stop):
+    """
+        Decode the steps in [step_start, step_stop) of a single group,
+        starting at byte `position` (following the step `previous`) and not
+        reading beyond `stop_position`.
+    """
+    cdef long start_position = position
+    cdef np.int64_t start_previous = previous
+    cdef long num_steps = 0
+    cdef long i = 0
+
+    if data.shape[0] == 0 or position >= stop_position:
+        return np.empty((0,), dtype=np.int64)
+
+    cdef const np.uint8_t* data_ptr = &data[0]
+
+    # first pass: count the steps inside the window
+    with nogil:
+        while position < stop_position:
+            previous += varint_read(data_ptr, &position)
+            if previous >= step_stop:
+                break
+            if previous >= step_start:
+                num_steps += 1
+
+    cdef np.ndarray[np.int64_t, ndim=1] steps = np.empty(
+            (num_steps,), dtype=np.int64)
+
+    # second pass: write
+    position = start_position
+    previous = start_previous
+    with nogil:
+        while i < num_steps:
+            previous += varint_read(data_ptr, &position)
+            if previous >= step_start:
+                steps[i] = previous
+                i += 1
+
+    return steps
@@ -24,6 +24,8 @@ from . import comm                  # noqa: E402
 from .logcfg import log             # noqa: E402
 from . import utils                 # noqa: E402
 from . import db                    # noqa: E402
+from . import io                    # noqa: E402
+from . import spikes                # noqa: E402
 from .samplers import LIFsampler    # noqa: E402
 from . import pynn_patches          # noqa: E402
 
@@ -91,11 +93,22 @@ def eta_from_burnin(t_start, burn_in, duration):
 
 # make a log function with ETA
 def make_log_time(duration, num_steps=10, offset=0):
+    """
+        The returned callback can be passed to several consecutive `sim.run`
+        calls (e.g. when running in chunks): It only logs once the next
+        scheduled time has been reached, so progress is reported against the
+        total `duration` throughout.
+    """
     increment = duration / num_steps
     duration = duration
     t_start = time.time()
+    next_log = [-np.inf]
 
     def log_time(time):
+        if time < next_log[0]:
+            # a new run segment started before the next scheduled log
+            return next_log[0]
+
         eta = utils.get_eta(t_start, time, duration + offset)
         if type(eta) is float:
             eta = utils.format_time(eta)
@@ -106,7 +119,8 @@ def make_log_time(duration, num_steps=10, offset=0):
             duration,
             elapsed,
             eta))
-        return time + increment
+        next_log[0] = time + increment
+        return next_log[0]
 
     return log_time
 
@@ -299,15 +313,26 @@ def gather_free_vmem_trace(
 # SAMPLING NETWORK HELPER FUNCTIONS #
 #####################################
 
+def _get_clean_spikes(ids, times, burn_in_time):
+    """
+        Remove the burn in time from the given spike columns and return them
+        sorted by time.
+    """
+    after_burn_in = times > burn_in_time
+    ids = ids[after_burn_in]
+    times = times[after_burn_in] - burn_in_time
+    order = np.argsort(times, kind="mergesort")
+    return ids[order], times[order]
+
+
 @comm.RunInSubprocess
-def gather_network_spikes(
+def _gather_network_spikes(
         network, duration, dt=0.1, burn_in_time=0.,
-        create_kwargs=None, sim_setup_kwargs=None, initial_vmem=None):
+        create_kwargs=None, sim_setup_kwargs=None, initial_vmem=None,
+        record_idx=None, chunk_duration=None, spike_directory=None):
     """
-        create_kwargs: Extra parameters for the networks creation routine.
-
-        sim_setup_kwargs: Extra parameters for the setup command (random seeds
-        etc.).
+        Subprocess part of `gather_network_spikes`, the spikes are returned
+        as `sbs.spikes.EncodedSpikeData` (if possible) for the transfer.
     """
 
     if sim_setup_kwargs is None:
@@ -323,16 +348,57 @@ def gather_network_spikes(
         duration=duration, **create_kwargs)
 
     if isinstance(population, sim.common.BasePopulation):
-        population.record("spikes")
-        if initial_vmem is not None:
-            population.initialize(v=initial_vmem)
+        populations = [population]
     else:
-        for pop in population:
+        populations = population
+
+    gids = np.concatenate([np.array(pop.all_cells, dtype=np.int)
+                           for pop in populations])
+    num_samplers = len(gids)
+    if record_idx is None:
+        record_idx = np.arange(num_samplers)
+    record_idx = np.array(record_idx, dtype=np.int).reshape(-1)
+
+    sim_is_nest = hasattr(sim, "nest")
+
+    if sim_is_nest:
+        spike_detector = sim.nest.Create("spike_detector")
+        sim.nest.Connect(gids[record_idx].tolist(), spike_detector,
+                         "all_to_all")
+
+        # map gids to sampler indices
+        gid_to_idx = np.empty((gids.max() + 1,), dtype=np.int32)
+        gid_to_idx[gids] = np.arange(num_samplers)
+    else:
+        for pop in populations:
             pop.record("spikes")
-        if initial_vmem is not None:
-            for pop, v in it.izip(population, initial_vmem):
-                pop.initialize(v=v)
 
+    def drain_spikes():
+        """
+            Return and clear the spikes recorded so far.
+        """
+        if sim_is_nest:
+            events = sim.nest.GetStatus(spike_detector, "events")[0]
+            ids = gid_to_idx[np.asarray(events["senders"], dtype=np.int)]
+            times = np.asarray(events["times"], dtype=np.float64)
+            sim.nest.SetStatus(spike_detector, {"n_events": 0})
+        else:
+            spiketrains = [
+                st for pop in populations
+                for st in pop.get_data("spikes", clear=True)
+                .segments[0].spiketrains]
+            spiketrains = [np.asarray(spiketrains[i]) for i in record_idx]
+            ids = np.repeat(record_idx, [len(st) for st in spiketrains])
+            times = np.concatenate(spiketrains + [np.zeros((0,))])
+        return _get_clean_spikes(ids, times, burn_in_time)
+
+    if initial_vmem is not None:
+        if len(populations) == 1:
+            initial_vmem = [initial_vmem]
+        for pop, v in it.izip(populations, initial_vmem):
+            pop.initialize(v=v)
+
+    # shared by all segments, progress is logged against the full duration
     callbacks = get_callbacks(sim, {
             "duration": duration,
             "offset": burn_in_time,
@@ -344,29 +410,89 @@ def gather_network_spikes(
         sim.run(burn_in_time)
         eta_from_burnin(t_start, burn_in_time, duration)
 
-    log.info("Starting data gathering run.")
-    sim.run(duration, callbacks=callbacks)
+        # we do not want to keep events that occured during burn-in
+        drain_spikes()
 
-    if isinstance(population, sim.common.BasePopulation):
-        spiketrains = population.get_data("spikes").segments[0].spiketrains
+    if chunk_duration is None:
+        chunk_duration = duration
+    num_chunks = int(np.ceil(duration / chunk_duration))
+    segments = np.diff(np.minimum(
+        np.arange(num_chunks + 1) * chunk_duration, duration))
+
+    if spike_directory is not None:
+        writer = io.SpikeStoreWriter(spike_directory, num_samplers, dt=dt)
     else:
-        spiketrains = np.vstack(
-            [pop.get_data("spikes").segments[0].spiketrains[0]
-             for pop in population])
+        chunks = []
 
-    # we need to ignore the burn in time
-    clean_spiketrains = []
-    for st in spiketrains:
-        clean_spiketrains.append(np.array(st[st > burn_in_time])-burn_in_time)
+    log.info("Starting data gathering run.")
+    for segment in segments:
+        sim.run(segment, callbacks=callbacks)
+        if spike_directory is not None:
+            writer.append(*drain_spikes())
+        else:
+            chunks.append(drain_spikes())
 
-    return_data = {
-            "spiketrains": clean_spiketrains,
-            "duration": duration,
-            "dt": dt,
-        }
     sim.end()
 
-    return return_data
+    if spike_directory is not None:
+        return writer.close(duration)
+
+    ids, times = zip(*chunks)
+    spike_data = spikes.SpikeData(np.concatenate(ids), np.concatenate(times),
+                                  duration, num_neurons=num_samplers, dt=dt)
+    try:
+        # much smaller to send back from the subprocess
+        return spikes.EncodedSpikeData.encode(spike_data)
+    except ValueError:
+        log.warn("Recorded spike times are not on the simulation time grid, "
+                 "returning them unencoded.")
+        return spike_data
+
+
+def gather_network_spikes(
+        network, duration, dt=0.1, burn_in_time=0.,
+        create_kwargs=None, sim_setup_kwargs=None, initial_vmem=None,
+        record_idx=None, chunk_duration=None, spike_directory=None):
+    """
+        create_kwargs: Extra parameters for the networks creation routine.
+
+        sim_setup_kwargs: Extra parameters for the setup command (random seeds
+        etc.).
+
+        record_idx: Indices of the samplers whose spikes should be recorded
+        (default: all). Spike ids still refer to the index of the sampler in
+        the network.
+
+        chunk_duration: If given, the simulation is run in segments of this
+        length after each of which the recorded spikes are drained from the
+        simulator. Note that without `spike_directory` all drained chunks are
+        still collected in memory, so only the simulator's own recording
+        buffers are bounded.
+
+        spike_directory: If given, the drained spikes are written to a
+        `sbs.io.SpikeStore` in this directory (which is returned instead of
+        the spikes), so that memory usage does not grow with the duration.
+        Only together with `chunk_duration` this bounds the memory needed.
+
+        With NEST, the spikes are read directly from a single spike detector
+        connected to the recorded samplers, otherwise via PyNN.
+
+        Returns the spikes as `sbs.spikes.SpikeData` (or the
+        `sbs.io.SpikeStore` if spike_directory is given).
+    """
+    if chunk_duration is not None and spike_directory is None:
+        log.warn("Spikes are drained in chunks but collected in memory, "
+                 "specify spike_directory to bound memory usage.")
+
+    result = _gather_network_spikes(
+            network, duration, dt=dt, burn_in_time=burn_in_time,
+            create_kwargs=create_kwargs, sim_setup_kwargs=sim_setup_kwargs,
+            initial_vmem=initial_vmem, record_idx=record_idx,
+            chunk_duration=chunk_duration, spike_directory=spike_directory)
+
+    if isinstance(result, spikes.EncodedSpikeData):
+        result = result.decode()
+    return result
 
 
 @comm.RunInSubprocess
@@ -0,0 +1,840 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+    Exact and approximate inference for Boltzmann machines that are too large
+    for the plain enumeration in `cutils`.
+"""
+
+import collections as c
+import numpy as np
+
+from .logcfg import log
+from . import cutils
+
+__all__ = [
+    "LogPartitionEstimate",
+    "ais_log_partition_bm",
+    "ais_log_partition_rbm",
+    "get_ais_betas",
+    "get_bm_joint_theo_batch",
+    "get_bm_log_partition_theo_batch",
+    "get_bm_moments_theo_batch",
+    "get_dense_weights",
+    "get_marginals_approx",
+    "get_marginals_loopy_bp",
+    "get_marginals_mean_field",
+    "get_rbm_joint_theo",
+    "get_rbm_log_likelihood",
+    "get_rbm_moments_theo",
+    "gibbs_sweep_bm",
+    "gibbs_sweep_rbm",
+    "sample_gibbs_bm",
+    "sample_gibbs_rbm",
+]
+
+LogPartitionEstimate = c.namedtuple("LogPartitionEstimate",
+                                    "log_partition lower upper".split())
+
+
+# number of states whose probabilities are computed at once
+DEFAULT_CHUNK_SIZE = 1 << 14
+
+
+def sigmoid(x):
+    return .5 * (1. + np.tanh(.5 * x))
+
+
+def softplus(x):
+    return np.logaddexp(0., x)
+
+
+def get_layer_weights(weights):
+    """
+        Return the list of theoretical weight matrices of shape
+        (n_layer_i, n_layer_i+1) for weights that are either in that format
+        already or in the layered format of `MixinRBM` (shape
+        (2, n_layer_i, n_layer_i+1)).
+    """
+    layer_weights = []
+    for w in weights:
+        w = np.asarray(w, dtype=np.float64)
+        if w.ndim == 3:
+            # theoretical weights are symmetric, both directions are the same
+            w = w[0]
+        layer_weights.append(w)
+    return layer_weights
+
+
+def get_dense_weights(weights, num_units_per_layer):
+    """
+        Convert layered weights (see `get_layer_weights`) into the symmetric
+        weight matrix of the equivalent fully connected Boltzmann machine.
+    """
+    weights = get_layer_weights(weights)
+    offsets = np.r_[0, np.cumsum(num_units_per_layer)]
+    dense = np.zeros((offsets[-1], offsets[-1]))
+    for i, w in enumerate(weights):
+        dense[offsets[i]:offsets[i+1], offsets[i+1]:offsets[i+2]] = w
+    return dense + dense.T
+
+
+def get_layer_biases(biases, num_units_per_layer):
+    """
+        Split the concatenated biases into one array per layer.
+    """
+    biases = np.asarray(biases, dtype=np.float64)
+    offsets = np.r_[0, np.cumsum(num_units_per_layer)]
+    assert biases.shape == (offsets[-1],),\
+        "Biases shape {}, expected {}".format(biases.shape, (offsets[-1],))
+    return [biases[offsets[i]:offsets[i+1]]
+            for i in xrange(len(num_units_per_layer))]
+
+
+def get_states_from_idx(state_idx, num_units):
+    """
+        Convert state indices to binary states (unit 0 being the most
+        significant bit).
+    """
+    shifts = np.arange(num_units - 1, -1, -1, dtype=np.int64)
+    return np.array((state_idx[:, None] >> shifts) & 1, dtype=np.float64)
+
+
+def _get_enumerated_layers(num_units_per_layer, include_first=False):
+    """
+        Return the layer indices of the parity class (even/odd layers) with
+        fewer units. In a layered network, all layers of the other class are
+        conditionally independent given this one and can be summed out
+        analytically.
+
+        If `include_first` is True, the even layers (containing layer 0) are
+        returned regardless of their size.
+    """
+    nupl = np.array(num_units_per_layer)
+    even = np.arange(0, len(nupl), 2)
+    odd = np.arange(1, len(nupl), 2)
+
+    if include_first or nupl[even].sum() <= nupl[odd].sum():
+        return even
+    else:
+        return odd
+
+
+def _iter_log_weights(weights, biases, num_units_per_layer,
+                      enumerated_layers, chunk_size):
+    """
+        Iterate over all states of the enumerated layers in chunks and yield
+        the states, the logarithm of their unnormalized probabilities (with
+        all other layers summed out) and the input to the summed out layers.
+    """
+    num_layers = len(num_units_per_layer)
+    is_enumerated = np.zeros(num_layers, dtype=bool)
+    is_enumerated[enumerated_layers] = True
+
+    nupl = np.array(num_units_per_layer)
+    num_enumerated = nupl[is_enumerated].sum()
+    offsets = np.r_[0, np.cumsum(nupl[is_enumerated])]
+
+    if num_enumerated > 62:
+        raise ValueError("Cannot enumerate {} units.".format(num_enumerated))
+
+    num_states = 1 << int(num_enumerated)
+
+    for chunk_start in xrange(0, num_states, chunk_size):
+        state_idx = np.arange(chunk_start, min(chunk_start + chunk_size,
+                                               num_states), dtype=np.int64)
+        states = get_states_from_idx(state_idx, num_enumerated)
+
+        layer_states = {}
+        for i_e, i_l in enumerate(enumerated_layers):
+            layer_states[i_l] = states[:, offsets[i_e]:offsets[i_e+1]]
+
+        log_weights = np.zeros(len(state_idx))
+        inputs = {}
+
+        for i_l in xrange(num_layers):
+            if is_enumerated[i_l]:
+                log_weights += layer_states[i_l].dot(biases[i_l])
+                continue
+
+            x = np.repeat(biases[i_l][None, :], len(state_idx), axis=0)
+            if i_l > 0:
+                x += layer_states[i_l-1].dot(weights[i_l-1])
+            if i_l < num_layers - 1:
+                x += layer_states[i_l+1].dot(weights[i_l].T)
+
+            inputs[i_l] = x
+            log_weights += softplus(x).sum(axis=1)
+
+        yield layer_states, log_weights, inputs
+
+
+def get_rbm_moments_theo(weights, biases, num_units_per_layer,
+                         chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+        Get the log partition function and the marginals of all units of a
+        layered (restricted) Boltzmann machine.
+
+        Only the layers of one parity class (every other layer, whichever has
+        fewer units) are enumerated, the remaining layers are summed out in
+        closed form. For a two-layer RBM this costs
+        2**min(n_v, n_h) * n_v * n_h operations.
+
+        weights: List of weight matrices between consecutive layers, either of
+                 shape (n_layer_i, n_layer_i+1) or in the layered format of
+                 `MixinRBM`.
+
+        biases: Concatenated biases of all layers.
+
+        Returns:
+            (log_partition, marginals)
+    """
+    weights = get_layer_weights(weights)
+    biases = get_layer_biases(biases, num_units_per_layer)
+
+    enumerated_layers = _get_enumerated_layers(num_units_per_layer)
+
+    log.debug("Enumerating layers {} of RBM with {} units per layer.".format(
+        enumerated_layers, num_units_per_layer))
+
+    log_reference = None
+    partition = 0.
+    moments = [np.zeros(n) for n in num_units_per_layer]
+
+    for layer_states, log_weights, inputs in _iter_log_weights(
+            weights, biases, num_units_per_layer, enumerated_layers,
+            chunk_size):
+
+        max_log_weight = log_weights.max()
+        if log_reference is None or max_log_weight > log_reference:
+            if log_reference is not None:
+                factor = np.exp(log_reference - max_log_weight)
+                partition *= factor
+                for m in moments:
+                    m *= factor
+            log_reference = max_log_weight
+
+        probs = np.exp(log_weights - log_reference)
+        partition += probs.sum()
+
+        for i_l, states in layer_states.iteritems():
+            moments[i_l] += probs.dot(states)
+        for i_l, x in inputs.iteritems():
+            moments[i_l] += probs.dot(sigmoid(x))
+
+    marginals = np.hstack(moments) / partition
+    return log_reference + np.log(partition), marginals
+
+
+def get_rbm_joint_theo(weights, biases, num_units_per_layer,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+        Get the joint distribution of the first (visible) layer of a layered
+        (restricted) Boltzmann machine.
+
+        All even layers are enumerated and all odd layers summed out in
+        closed form, the even layers other than the visible one are then
+        marginalized explicitly.
+
+        Returns:
+            Joint distribution of shape [2] * n_visible.
+    """
+    weights = get_layer_weights(weights)
+    biases = get_layer_biases(biases, num_units_per_layer)
+
+    enumerated_layers = _get_enumerated_layers(num_units_per_layer,
+                                               include_first=True)
+
+    num_visible = num_units_per_layer[0]
+    num_enumerated = sum(num_units_per_layer[i] for i in enumerated_layers)
+
+    all_log_weights = np.empty(1 << int(num_enumerated))
+
+    current = 0
+    for layer_states, log_weights, inputs in _iter_log_weights(
+            weights, biases, num_units_per_layer, enumerated_layers,
+            chunk_size):
+        all_log_weights[current:current+len(log_weights)] = log_weights
+        current += len(log_weights)
+
+    # the visible units are the most significant bits
+    all_log_weights = all_log_weights.reshape(1 << num_visible, -1)
+    max_log_weight = all_log_weights.max()
+
+    joint = np.exp(all_log_weights - max_log_weight).sum(axis=1)
+    joint /= joint.sum()
+
+    return joint.reshape([2 for i in xrange(num_visible)])
+
+
+###########################
+# BATCHED EXACT INFERENCE #
+###########################
+
+def get_bm_batch_parameters(weights, biases):
+    """
+        Flatten a stack of weight matrices (shape (num_sets, N, N)) and bias
+        vectors (shape (num_sets, N)) into one parameter vector per set so
+        that the exponents of a batch of states are given by a single matrix
+        product with `get_bm_batch_features`.
+
+        The first N entries are the effective biases, the remaining ones the
+        symmetrized weights of the upper triangle.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    biases = np.asarray(biases, dtype=np.float64)
+
+    if weights.ndim == 2:
+        weights = weights[None]
+    if biases.ndim == 1:
+        biases = biases[None]
+
+    num_sets, num_dims = biases.shape
+    assert weights.shape == (num_sets, num_dims, num_dims),\
+        "Weights shape {}, expected {}".format(
+            weights.shape, (num_sets, num_dims, num_dims))
+
+    idx_pre, idx_post = np.triu_indices(num_dims, k=1)
+    diag = np.arange(num_dims)
+
+    return np.hstack([
+        biases + .5 * weights[:, diag, diag],
+        .5 * (weights[:, idx_pre, idx_post] + weights[:, idx_post, idx_pre])])
+
+
+def get_bm_batch_features(states):
+    """
+        Return the states followed by all pairwise products s_i * s_j (i < j),
+        matching the layout of `get_bm_batch_parameters`.
+    """
+    idx_pre, idx_post = np.triu_indices(states.shape[1], k=1)
+    return np.hstack([states, states[:, idx_pre] * states[:, idx_post]])
+
+
+def _iter_bm_log_weights_batch(weights, biases, chunk_size):
+    """
+        Iterate over all states in chunks and yield the states and the
+        logarithm of their unnormalized probabilities under every parameter
+        set (shape (num_sets, chunk_size)).
+    """
+    parameters = get_bm_batch_parameters(weights, biases)
+    num_dims = np.asarray(biases).shape[-1]
+
+    if num_dims > 62:
+        raise ValueError("Cannot enumerate {} units.".format(num_dims))
+
+    num_states = 1 << int(num_dims)
+
+    for chunk_start in xrange(0, num_states, chunk_size):
+        state_idx = np.arange(chunk_start, min(chunk_start + chunk_size,
+                                               num_states), dtype=np.int64)
+        states = get_states_from_idx(state_idx, num_dims)
+        yield states, parameters.dot(get_bm_batch_features(states).T)
+
+
+def get_bm_moments_theo_batch(weights, biases, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+        Get the log partition functions and marginals of a whole stack of
+        Boltzmann machines in a single enumeration.
+
+        The state patterns are generated only once per chunk and the
+        exponents under all parameter sets are computed as one matrix
+        product.
+
+        weights: Array of shape (num_sets, N, N).
+
+        biases: Array of shape (num_sets, N).
+
+        Returns:
+            (log_partitions, marginals) of shapes (num_sets,) and
+            (num_sets, N).
+    """
+    log_reference = None
+
+    for states, log_weights in _iter_bm_log_weights_batch(
+            weights, biases, chunk_size):
+
+        max_log_weights = log_weights.max(axis=1)
+        if log_reference is None:
+            log_reference = max_log_weights
+            partitions = np.zeros(len(log_weights))
+            moments = np.zeros((len(log_weights), states.shape[1]))
+        else:
+            new_reference = np.maximum(log_reference, max_log_weights)
+            factors = np.exp(log_reference - new_reference)
+            partitions *= factors
+            moments *= factors[:, None]
+            log_reference = new_reference
+
+        probs = np.exp(log_weights - log_reference[:, None])
+        partitions += probs.sum(axis=1)
+        moments += probs.dot(states)
+
+    return (log_reference + np.log(partitions),
+            moments / partitions[:, None])
+
+
+def get_bm_log_partition_theo_batch(weights, biases,
+                                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+        Get the log partition functions of a stack of Boltzmann machines (see
+        `get_bm_moments_theo_batch`).
+    """
+    return get_bm_moments_theo_batch(weights, biases, chunk_size)[0]
+
+
+def get_bm_joint_theo_batch(weights, biases, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+        Get the joint distributions of a stack of Boltzmann machines in a
+        single enumeration.
+
+        Returns:
+            Array of shape [num_sets] + [2] * N.
+    """
+    all_log_weights = np.hstack([log_weights for states, log_weights in
+                                 _iter_bm_log_weights_batch(
+                                     weights, biases, chunk_size)])
+
+    joints = np.exp(all_log_weights
+                    - all_log_weights.max(axis=1)[:, None])
+    joints /= joints.sum(axis=1)[:, None]
+
+    num_dims = np.asarray(biases).shape[-1]
+    return joints.reshape([len(joints)] + [2] * num_dims)
+
+
+#############################
+# VECTORIZED GIBBS SAMPLING #
+#############################
+
+def sample_bernoulli(probs, rng=np.random):
+    return np.array(rng.rand(*probs.shape) < probs, dtype=np.float64)
+
+
+def gibbs_sweep_bm(states, weights, biases, rng=np.random):
+    """
+        Perform one sequential Gibbs sweep over all units for many chains at
+        once.
+
+        states: Array of shape (num_chains, num_units) that is updated
+                in-place.
+
+        weights/biases: Effective parameters (symmetric weights with zero
+                        diagonal, see `cutils.get_bm_effective_parameters`).
+    """
+    num_chains, num_units = states.shape
+    for i in xrange(num_units):
+        fields = states.dot(weights[:, i]) + biases[i]
+        states[:, i] = rng.rand(num_chains) < sigmoid(fields)
+    return states
+
+
+def gibbs_sweep_rbm(layer_states, weights, biases, rng=np.random,
+                    update_odd_first=True):
+    """
+        Perform one block Gibbs sweep for a layered network for many chains at
+        once: All odd layers are sampled given the even ones and vice versa.
+
+        layer_states: List of arrays of shape (num_chains, n_layer_i) that
+                      are updated in-place.
+
+        weights/biases: Per-layer weight matrices (n_layer_i, n_layer_i+1) and
+                        biases.
+    """
+    num_layers = len(layer_states)
+
+    parities = [1, 0] if update_odd_first else [0, 1]
+
+    for parity in parities:
+        for i_l in xrange(parity, num_layers, 2):
+            fields = np.repeat(biases[i_l][None, :], len(layer_states[i_l]),
+                               axis=0)
+            if i_l > 0:
+                fields += layer_states[i_l-1].dot(weights[i_l-1])
+            if i_l < num_layers - 1:
+                fields += layer_states[i_l+1].dot(weights[i_l].T)
+            layer_states[i_l][:] = sample_bernoulli(sigmoid(fields), rng=rng)
+
+    return layer_states
+
+
+def _collect_gibbs_samples(sweep, get_states, num_samples, num_burn_in,
+                           sweeps_per_sample, selected_idx):
+    for i in xrange(num_burn_in):
+        sweep()
+
+    samples = None
+    for i_sample in xrange(num_samples):
+        for i in xrange(sweeps_per_sample):
+            sweep()
+        states = get_states()
+        if selected_idx is not None:
+            states = states[:, selected_idx]
+        if samples is None:
+            samples = np.zeros((states.shape[0], num_samples,
+                                states.shape[1]), dtype=np.int)
+        samples[:, i_sample] = states
+
+    return samples
+
+
+def sample_gibbs_bm(weights, biases, num_samples, num_chains=1,
+                    num_burn_in=100, sweeps_per_sample=1, selected_idx=None,
+                    rng=np.random):
+    """
+        Sample from a fully connected Boltzmann machine with `num_chains`
+        independent Gibbs chains that are updated in parallel.
+
+        After `num_burn_in` sweeps, the states are recorded every
+        `sweeps_per_sample` sweeps.
+
+        selected_idx: Only record the states of these units (default: all).
+
+        Returns:
+            Array of shape (num_chains, num_samples, num_selected); each entry
+            along the first axis has the layout of
+            `ThoroughBM.get_sample_states`.
+    """
+    weights = np.require(weights, dtype=np.float64, requirements=["C"])
+    biases = np.require(biases, dtype=np.float64, requirements=["C"])
+
+    weights, biases = cutils.get_bm_effective_parameters(weights, biases)
+
+    states = sample_bernoulli(.5 * np.ones((num_chains, len(biases))),
+                              rng=rng)
+
+    log.debug("Gibbs sampling {} units with {} chains.".format(
+        len(biases), num_chains))
+
+    return _collect_gibbs_samples(
+            lambda: gibbs_sweep_bm(states, weights, biases, rng=rng),
+            lambda: states, num_samples, num_burn_in, sweeps_per_sample,
+            selected_idx)
+
+
+def sample_gibbs_rbm(weights, biases, num_units_per_layer, num_samples,
+                     num_chains=1, num_burn_in=100, sweeps_per_sample=1,
+                     selected_idx=None, rng=np.random):
+    """
+        Sample from a layered (restricted) Boltzmann machine with
+        `num_chains` independent block Gibbs chains that are updated in
+        parallel.
+
+        weights: List of weight matrices between consecutive layers, either of
+                 shape (n_layer_i, n_layer_i+1) or in the layered format of
+                 `MixinRBM`.
+
+        biases: Concatenated biases of all layers.
+
+        selected_idx: Only record the states of these units (indices into the
+                      concatenation of all layers, default: all).
+
+        Returns:
+            Array of shape (num_chains, num_samples, num_selected).
+    """
+    weights = get_layer_weights(weights)
+    biases = get_layer_biases(biases, num_units_per_layer)
+
+    layer_states = [sample_bernoulli(.5 * np.ones((num_chains, n)), rng=rng)
+                    for n in num_units_per_layer]
+
+    log.debug("Gibbs sampling RBM with {} units per layer with {} "
+              "chains.".format(num_units_per_layer, num_chains))
+
+    return _collect_gibbs_samples(
+            lambda: gibbs_sweep_rbm(layer_states, weights, biases, rng=rng),
+            lambda: np.hstack(layer_states), num_samples, num_burn_in,
+            sweeps_per_sample, selected_idx)
+
+
+################################
+# ANNEALED IMPORTANCE SAMPLING #
+################################
+
+def get_ais_betas(num_betas=10000):
+    """
+        Default annealing schedule: Coarse steps for low inverse temperatures
+        and increasingly fine steps towards the target distribution.
+    """
+    num_steps = np.array([.05, .25, .7]) * num_betas
+    num_steps = np.array(np.maximum(num_steps, 2), dtype=int)
+    return np.r_[np.linspace(0., .5, num_steps[0], endpoint=False),
+                 np.linspace(.5, .9, num_steps[1], endpoint=False),
+                 np.linspace(.9, 1., num_steps[2])]
+
+
+def get_log_partition_estimate(log_weights, log_partition_base,
+                               num_sigma=3.):
+    """
+        Combine the AIS log importance weights of all chains into an estimate
+        of the log partition function together with an error band of
+        `num_sigma` standard errors of the mean importance weight.
+    """
+    max_log_weight = log_weights.max()
+    weights = np.exp(log_weights - max_log_weight)
+
+    mean = weights.mean()
+    error = num_sigma * weights.std() / np.sqrt(len(weights))
+
+    offset = log_partition_base + max_log_weight
+
+    with np.errstate(divide="ignore"):
+        return LogPartitionEstimate(
+                log_partition=offset + np.log(mean),
+                lower=offset + np.log(max(mean - error, 0.)),
+                upper=offset + np.log(mean + error))
+
+
+def ais_log_partition_bm(weights, biases, num_chains=100, betas=None,
+                         base_biases=None, num_sigma=3., rng=np.random):
+    """
+        Estimate the log partition function of a fully connected Boltzmann
+        machine via annealed importance sampling.
+
+        The chains are annealed from a distribution of independent units with
+        biases `base_biases` (default: `biases`), whose partition function is
+        known in closed form, to the target distribution. Each intermediate
+        distribution is visited with one sequential Gibbs sweep, vectorized
+        over all chains.
+
+        betas: Increasing inverse temperatures from 0 to 1 (default:
+               `get_ais_betas()`).
+
+        Returns:
+            LogPartitionEstimate with the estimate as well as lower and upper
+            bound of `num_sigma` standard errors.
+    """
+    weights = np.require(weights, dtype=np.float64, requirements=["C"])
+    biases = np.require(biases, dtype=np.float64, requirements=["C"])
+
+    weights, biases = cutils.get_bm_effective_parameters(weights, biases)
+
+    if base_biases is None:
+        base_biases = biases
+    base_biases = np.asarray(base_biases, dtype=np.float64)
+
+    if betas is None:
+        betas = get_ais_betas()
+
+    num_units = len(biases)
+
+    def get_exponent_difference(states):
+        # target minus base exponent
+        return .5 * np.einsum("ci,ij,cj->c", states, weights, states)\
+            + states.dot(biases - base_biases)
+
+    states = sample_bernoulli(np.repeat(sigmoid(base_biases)[None, :],
+                                        num_chains, axis=0), rng=rng)
+    log_weights = np.zeros(num_chains)
+
+    for beta_prev, beta in zip(betas[:-1], betas[1:]):
+        log_weights += (beta - beta_prev) * get_exponent_difference(states)
+        gibbs_sweep_bm(states, beta * weights,
+                       beta * biases + (1. - beta) * base_biases, rng=rng)
+
+    log.debug("AIS for {} units with {} chains and {} temperatures.".format(
+        num_units, num_chains, len(betas)))
+
+    return get_log_partition_estimate(
+            log_weights, softplus(base_biases).sum(), num_sigma=num_sigma)
+
+
+def ais_log_partition_rbm(weights, biases, num_units_per_layer,
+                          num_chains=100, betas=None, base_biases=None,
+                          num_sigma=3., rng=np.random):
+    """
+        Estimate the log partition function of a layered (restricted)
+        Boltzmann machine via annealed importance sampling.
+
+        The odd layers are summed out analytically, the chains run over the
+        even layers (including the visible one). The base distribution has no
+        connections, biases `base_biases` (default: the target biases) on the
+        even layers and uniform odd layers.
+
+        weights: List of weight matrices between consecutive layers, either of
+                 shape (n_layer_i, n_layer_i+1) or in the layered format of
+                 `MixinRBM`.
+
+        biases: Concatenated biases of all layers.
+
+        Returns:
+            LogPartitionEstimate with the estimate as well as lower and upper
+            bound of `num_sigma` standard errors.
+    """
+    weights = get_layer_weights(weights)
+    biases = get_layer_biases(biases, num_units_per_layer)
+    num_layers = len(num_units_per_layer)
+
+    if base_biases is None:
+        base_biases = biases
+    else:
+        base_biases = get_layer_biases(base_biases, num_units_per_layer)
+
+    if betas is None:
+        betas = get_ais_betas()
+
+    even_layers = range(0, num_layers, 2)
+    odd_layers = range(1, num_layers, 2)
+
+    def get_log_unnormalized(layer_states, beta):
+        log_prob = np.zeros(num_chains)
+        for i_l in even_layers:
+            log_prob += layer_states[i_l].dot(
+                    beta * biases[i_l] + (1. - beta) * base_biases[i_l])
+        for i_l in odd_layers:
+            fields = np.repeat(biases[i_l][None, :], num_chains, axis=0)
+            fields += layer_states[i_l-1].dot(weights[i_l-1])
+            if i_l < num_layers - 1:
+                fields += layer_states[i_l+1].dot(weights[i_l].T)
+            log_prob += softplus(beta * fields).sum(axis=1)
+        return log_prob
+
+    layer_states = []
+    for i_l, n in enumerate(num_units_per_layer):
+        probs = sigmoid(base_biases[i_l]) if i_l % 2 == 0\
+            else .5 * np.ones(n)
+        layer_states.append(sample_bernoulli(
+            np.repeat(probs[None, :], num_chains, axis=0), rng=rng))
+
+    log_weights = np.zeros(num_chains)
+
+    for beta_prev, beta in zip(betas[:-1], betas[1:]):
+        log_weights += get_log_unnormalized(layer_states, beta)\
+            - get_log_unnormalized(layer_states, beta_prev)
+
+        # scaling the weights and mixing the biases of the even layers yields
+        # the intermediate distribution
+        gibbs_sweep_rbm(
+            layer_states, [beta * w for w in weights],
+            [beta * b + (1. - beta) * bb if i_l % 2 == 0 else beta * b
+             for i_l, (b, bb) in enumerate(zip(biases, base_biases))],
+            rng=rng)
+
+    log.debug("AIS for RBM with {} units per layer, {} chains and {} "
+              "temperatures.".format(num_units_per_layer, num_chains,
+                                     len(betas)))
+
+    log_partition_base = sum(softplus(base_biases[i_l]).sum()
+                             for i_l in even_layers)\
+        + sum(num_units_per_layer[i_l] for i_l in odd_layers) * np.log(2.)
+
+    return get_log_partition_estimate(
+            log_weights, log_partition_base, num_sigma=num_sigma)
+
+
+def get_rbm_log_likelihood(weights, biases, num_units_per_layer,
+                           visible_states, log_partition):
+    """
+        Average log-likelihood of `visible_states` (shape (num_states,
+        n_visible)) under a two-layer RBM with the given (estimated) log
+        partition function.
+    """
+    if len(num_units_per_layer) != 2:
+        raise ValueError("The log-likelihood can only be computed in closed "
+                         "form for two-layer RBMs.")
+
+    weights = get_layer_weights(weights)
+    biases = get_layer_biases(biases, num_units_per_layer)
+
+    visible_states = np.asarray(visible_states, dtype=np.float64)
+
+    log_unnormalized = visible_states.dot(biases[0]) + softplus(
+            visible_states.dot(weights[0]) + biases[1]).sum(axis=1)
+
+    return log_unnormalized.mean() - log_partition
+
+
+#########################
+# APPROXIMATE MARGINALS #
+#########################
+
+def _iterate_fixed_point(update, initial, damping, max_iter, tol, name):
+    """
+        Iterate `value <- (1 - damping) * update(value) + damping * value`
+        until the maximum change drops below `tol`.
+    """
+    value = initial
+    for i in xrange(max_iter):
+        new_value = (1. - damping) * update(value) + damping * value
+        change = np.abs(new_value - value).max() if value.size > 0 else 0.
+        value = new_value
+        if change < tol:
+            log.debug("{} converged after {} iterations.".format(name, i+1))
+            break
+    else:
+        log.warn("{} did not converge after {} iterations (last change: "
+                 "{:.3e}).".format(name, max_iter, change))
+    return value
+
+
+def get_marginals_mean_field(weights, biases, tap=False, damping=.5,
+                             max_iter=1000, tol=1e-8):
+    """
+        Approximate the marginals of a Boltzmann machine with naive mean field
+        or, if `tap` is True, the second-order TAP (Thouless-Anderson-Palmer)
+        equations that include the Onsager reaction term.
+
+        All units are updated in parallel, `damping` mixes in the previous
+        estimate to avoid oscillations.
+    """
+    weights = np.require(weights, dtype=np.float64, requirements=["C"])
+    biases = np.require(biases, dtype=np.float64, requirements=["C"])
+    weights, biases = cutils.get_bm_effective_parameters(weights, biases)
+    weights_sq = weights ** 2
+
+    def update(marginals):
+        fields = biases + weights.dot(marginals)
+        if tap:
+            fields -= (marginals - .5)\
+                * weights_sq.dot(marginals * (1. - marginals))
+        return sigmoid(fields)
+
+    return _iterate_fixed_point(
+            update, sigmoid(biases), damping, max_iter, tol,
+            "TAP" if tap else "Mean field")
+
+
+def get_marginals_loopy_bp(weights, biases, damping=.5, max_iter=1000,
+                           tol=1e-8):
+    """
+        Approximate the marginals of a Boltzmann machine with loopy belief
+        propagation.
+
+        Messages are stored as log-odds in a matrix (entry [j, i] being the
+        message from unit j to unit i) and all of them are updated in
+        parallel.
+    """
+    weights = np.require(weights, dtype=np.float64, requirements=["C"])
+    biases = np.require(biases, dtype=np.float64, requirements=["C"])
+    weights, biases = cutils.get_bm_effective_parameters(weights, biases)
+
+    def update(messages):
+        # field of unit j without the message it received from unit i
+        cavity = (biases + messages.sum(axis=0))[:, None] - messages.T
+        return softplus(weights + cavity) - softplus(cavity)
+
+    messages = _iterate_fixed_point(
+            update, np.zeros_like(weights), damping, max_iter, tol,
+            "Loopy BP")
+
+    return sigmoid(biases + messages.sum(axis=0))
+
+
+APPROX_METHODS = {
+    "mf": lambda w, b, **kw: get_marginals_mean_field(w, b, tap=False, **kw),
+    "tap": lambda w, b, **kw: get_marginals_mean_field(w, b, tap=True, **kw),
+    "bp": get_marginals_loopy_bp,
+}
+
+
+def get_marginals_approx(weights, biases, method="tap", **kwargs):
+    """
+        Approximate the marginals of a Boltzmann machine.
+
+        method: "mf" (naive mean field), "tap" (TAP equations) or "bp" (loopy
+                belief propagation).
+    """
+    if method not in APPROX_METHODS:
+        raise ValueError("Unknown approximation method {}, choose from "
+                         "{}.".format(method, sorted(APPROX_METHODS.keys())))
+    return APPROX_METHODS[method](weights, biases, **kwargs)
@@ -3,10 +3,15 @@
 
 import numpy as np
 import atexit
+import errno
+import json
 import os
+import os.path as osp
 
 from .logcfg import log
+from . import spikes
 from . import utils
+from .version import __version__
 
 
 class UpdateParamsCD(object):
@@ -197,3 +202,477 @@ class UpdateParamsCD(object):
 
     def _get_size_snapshot_header(self):
         return 1
+
+
+class TheoCache(object):
+    """
+        Persistent on-disk cache for theoretical distributions.
+
+        Entries are stored as .npy files named by a SHA1 hash over the kind of
+        the entry, the library version and all (C-contiguous) input arrays,
+        so several processes can share the same directory. If the total size
+        of the cache exceeds `max_size` bytes, the least recently used entries
+        are evicted.
+
+        Caching is opt-in: networks only use a cache by default if
+        $SBS_CACHE_DIR is set (see `get_default_theo_cache`).
+    """
+    extension = ".npy"
+
+    def __init__(self, directory=None, max_size=1 << 30):
+        if directory is None:
+            directory = os.environ.get(
+                    "SBS_CACHE_DIR", osp.expanduser("~/.cache/sbs"))
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_key(self, kind, *arrays):
+        """
+            Compute the key of an entry of `kind` for the given input arrays.
+        """
+        hashes = [kind, ".".join(map(str, __version__))]
+        for array in arrays:
+            array = np.require(array, requirements=["C"])
+            hashes.extend([str(array.dtype), str(array.shape),
+                           utils.get_sha1(array)])
+        return utils.get_sha1(np.frombuffer("|".join(hashes), dtype=np.uint8))
+
+    def get_filepath(self, key):
+        return osp.join(self.directory, key + self.extension)
+
+    def get(self, key):
+        """
+            Return the cached array for `key` or None if there is none.
+        """
+        filepath = self.get_filepath(key)
+        try:
+            value = np.load(filepath, allow_pickle=False)
+        except (IOError, ValueError):
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(filepath, None)
+        except OSError:
+            pass
+
+        log.debug("Loaded {} from cache.".format(key))
+        return value
+
+    def set(self, key, value):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                log.warn("Could not create cache directory {}.".format(
+                    self.directory))
+                return
+
+        # write to a temporary file first so that concurrent readers never
+        # see incomplete entries
+        filepath = self.get_filepath(key)
+        tmp_filepath = "{}.{}.tmp".format(filepath,
+                                          utils.get_random_string(8))
+        try:
+            with open(tmp_filepath, "wb") as f:
+                np.save(f, np.asarray(value), allow_pickle=False)
+            os.rename(tmp_filepath, filepath)
+        except (IOError, OSError):
+            log.warn("Could not write cache entry {}.".format(filepath))
+            return
+
+        self.evict()
+
+    def get_or_compute(self, kind, arrays, compute):
+        """
+            Look up the entry of `kind` for `arrays` and call `compute()` to
+            create it if it is missing.
+        """
+        key = self.get_key(kind, *arrays)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def evict(self):
+        """
+            Remove least recently used entries until the cache is no larger
+            than `max_size`.
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(self.extension):
+                continue
+            filepath = osp.join(self.directory, filename)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filepath))
+
+        total_size = sum(e[1] for e in entries)
+
+        for mtime, size, filepath in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        if not osp.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.extension):
+                os.remove(osp.join(self.directory, filename))
+
+
+class SpikeStore(object):
+    """
+        Directory-based on-disk storage of `sbs.spikes.SpikeData`.
+
+        The spike columns are stored as raw .npy files (ids.npy/times.npy)
+        that are memory-mapped when loading, so that even huge recordings
+        open instantly and only the pages actually accessed (e.g. by
+        `SpikeData.get_time_window`) are read. Metadata is kept as JSON.
+
+        Alternatively, the spikes can be stored compressed, which cannot be
+        memory-mapped but still allows loading only the parts overlapping a
+        time window:
+
+        "zlib": The columns are stored in compressed chunks of `chunk_size`
+                spikes.
+
+        "varint": Spike times on the grid of `dt` are stored delta-encoded
+                  per neuron (see `sbs.spikes.EncodedSpikeData`).
+    """
+    metadata_filename = "meta.json"
+    format_version = 1
+    compressions = ["none", "zlib", "varint"]
+    encoded_arrays = ["data", "byte_offsets", "spike_offsets", "block_bytes",
+                      "block_steps", "block_offsets"]
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(osp.join(directory, self.metadata_filename)) as f:
+            self.metadata = json.load(f)
+
+        if self.metadata["format_version"] > self.format_version:
+            raise IOError("Spike store {} has unsupported format version {}."
+                          .format(directory, self.metadata["format_version"]))
+
+    @classmethod
+    def write(cls, spike_data, directory, compress=False, chunk_size=1 << 22):
+        """
+            Write `spike_data` (SpikeData or spike data dictionary) to
+            `directory` and return the store.
+
+            compress: False, "zlib" (or True) or "varint".
+        """
+        if compress is True:
+            compress = "zlib"
+        elif compress is False:
+            compress = "none"
+        if compress not in cls.compressions:
+            raise ValueError("Unknown compression: {}".format(compress))
+
+        spike_data = spikes.as_spike_data(spike_data)
+
+        if compress == "zlib":
+            writer = SpikeStoreWriter(
+                    directory, spike_data.num_neurons, dt=spike_data.dt,
+                    t_start=spike_data.t_start, compress=compress)
+            for chunk in utils.iter_spike_chunks(
+                    spike_data.ids, spike_data.times, chunk_size=chunk_size):
+                writer.append(*chunk)
+            return writer.close(spike_data.duration)
+
+        cls._prepare_directory(directory)
+
+        metadata = {
+            "format_version": cls.format_version,
+            "num_spikes": int(spike_data.num_spikes),
+            "num_neurons": int(spike_data.num_neurons),
+            "duration": float(spike_data.duration),
+            "t_start": float(spike_data.t_start),
+            "dt": spike_data.dt if spike_data.dt is None
+            else float(spike_data.dt),
+            "compression": compress,
+        }
+
+        if compress == "varint":
+            encoded = spikes.EncodedSpikeData.encode(spike_data)
+            for name in cls.encoded_arrays:
+                np.save(osp.join(directory, name + ".npy"),
+                        getattr(encoded, name), allow_pickle=False)
+            metadata["dt"] = encoded.dt
+        else:
+            np.save(osp.join(directory, "ids.npy"), spike_data.ids,
+                    allow_pickle=False)
+            np.save(osp.join(directory, "times.npy"), spike_data.times,
+                    allow_pickle=False)
+
+        return cls._write_metadata(directory, metadata)
+
+    @classmethod
+    def _prepare_directory(cls, directory):
+        """
+            Create `directory` or remove a store previously written to it,
+            starting with its metadata so that it cannot be opened while
+            being overwritten.
+        """
+        _makedirs(directory)
+
+        filenames = os.listdir(directory)
+        if cls.metadata_filename in filenames:
+            os.remove(osp.join(directory, cls.metadata_filename))
+
+        store_filenames = set(
+                [name + ".npy" for name in ["ids", "times"]
+                 + cls.encoded_arrays] + ["ids.tmp", "times.tmp"])
+        for filename in filenames:
+            if filename in store_filenames or (
+                    filename.startswith("chunk-")
+                    and filename.endswith(".npz")):
+                os.remove(osp.join(directory, filename))
+
+    @classmethod
+    def _write_metadata(cls, directory, metadata):
+        # metadata is written last so that incomplete stores cannot be opened
+        with open(osp.join(directory, cls.metadata_filename), "w") as f:
+            json.dump(metadata, f, indent=2)
+
+        return cls(directory)
+
+    @property
+    def compression(self):
+        return self.metadata["compression"]
+
+    def load_encoded(self):
+        """
+            Return the `EncodedSpikeData` of a "varint"-compressed store.
+        """
+        assert self.compression == "varint"
+        arrays = {name: np.load(osp.join(self.directory, name + ".npy"),
+                                allow_pickle=False)
+                  for name in self.encoded_arrays}
+        return spikes.EncodedSpikeData(
+                duration=self.metadata["duration"], dt=self.metadata["dt"],
+                t_start=self.metadata["t_start"], **arrays)
+
+    def _create_spike_data(self, ids, times, **kwargs):
+        kwargs.setdefault("duration", self.metadata["duration"])
+        kwargs.setdefault("t_start", self.metadata["t_start"])
+        return spikes.SpikeData(ids, times,
+                                num_neurons=self.metadata["num_neurons"],
+                                dt=self.metadata["dt"], **kwargs)
+
+    def _load_chunk(self, chunk):
+        with np.load(osp.join(self.directory, chunk["filename"]),
+                     allow_pickle=False) as data:
+            return data["ids"], data["times"]
+
+    def _load_chunks(self, chunks):
+        if len(chunks) == 0:
+            return np.zeros((0,), dtype=np.int32), np.zeros((0,))
+        ids, times = zip(*[self._load_chunk(chunk) for chunk in chunks])
+        return np.concatenate(ids), np.concatenate(times)
+
+    def load(self, mmap_mode="r"):
+        """
+            Return the stored spikes as `SpikeData` whose columns are
+            memory-mapped with `mmap_mode` (unless the store is compressed).
+        """
+        if self.compression == "zlib":
+            ids, times = self._load_chunks(self.metadata["chunks"])
+        elif self.compression == "varint":
+            return self.load_encoded().decode()
+        else:
+            ids = np.load(osp.join(self.directory, "ids.npy"),
+                          mmap_mode=mmap_mode, allow_pickle=False)
+            times = np.load(osp.join(self.directory, "times.npy"),
+                            mmap_mode=mmap_mode, allow_pickle=False)
+        return self._create_spike_data(ids, times)
+
+    def load_time_window(self, t_start, t_stop):
+        """
+            Return the spikes in [t_start, t_stop), only reading the parts of
+            the store overlapping the window.
+        """
+        if self.compression == "none":
+            return self.load().get_time_window(t_start, t_stop)
+        elif self.compression == "varint":
+            return self.load_encoded().get_time_window(t_start, t_stop)
+
+        chunks = [c for c in self.metadata["chunks"]
+                  if c["t_last"] >= t_start and c["t_first"] < t_stop]
+        ids, times = self._load_chunks(chunks)
+        spike_data = self._create_spike_data(ids, times)
+        return spike_data.get_time_window(t_start, t_stop)
+
+    def iter_chunks(self, chunk_size=1 << 22, relative=True):
+        """
+            Iterate over (spike_ids, spike_times) chunks, e.g. for the
+            streaming accumulators in `cutils`.
+
+            relative: If True, spike times are relative to the start of the
+                      recording (as expected by the accumulators).
+        """
+        t_start = self.metadata["t_start"] if relative else 0.
+
+        if self.compression == "zlib":
+            chunks = (self._load_chunk(chunk)
+                      for chunk in self.metadata["chunks"])
+        elif self.compression == "varint":
+            chunks = self.load_encoded().iter_chunks(relative=False)
+        else:
+            spike_data = self.load()
+            chunks = utils.iter_spike_chunks(
+                    spike_data.ids, spike_data.times, chunk_size=chunk_size)
+
+        for ids, times in chunks:
+            if t_start != 0.:
+                times = times - t_start
+            yield ids, times
+
+
+class SpikeStoreWriter(object):
+    """
+        Incrementally write a `SpikeStore` from consecutive chunks of spikes,
+        e.g. while draining the spike detectors during a long simulation, so
+        that the full recording never has to be held in memory.
+
+        Uncompressed chunks are appended to temporary files that are copied
+        into memory-mappable columns on `close`, compressed chunks are
+        stored as they are.
+    """
+
+    def __init__(self, directory, num_neurons, dt=None, t_start=0.,
+                 compress=False):
+        """
+            compress: False or "zlib" (or True), see `SpikeStore`.
+        """
+        if compress is True:
+            compress = "zlib"
+        elif compress is False:
+            compress = "none"
+        if compress not in ["none", "zlib"]:
+            raise ValueError("Cannot write chunks with compression: {}"
+                             .format(compress))
+
+        SpikeStore._prepare_directory(directory)
+
+        self.directory = directory
+        self.metadata = {
+            "format_version": SpikeStore.format_version,
+            "num_spikes": 0,
+            "num_neurons": int(num_neurons),
+            "t_start": float(t_start),
+            "dt": dt if dt is None else float(dt),
+            "compression": compress,
+        }
+
+        if compress == "zlib":
+            self.metadata["chunks"] = []
+        else:
+            self._files = {name: open(self._get_tmp_filename(name), "wb")
+                           for name in ["ids", "times"]}
+
+        self._t_last = -np.inf
+
+    @property
+    def num_spikes(self):
+        return self.metadata["num_spikes"]
+
+    def _get_tmp_filename(self, name):
+        return osp.join(self.directory, name + ".tmp")
+
+    def append(self, ids, times):
+        """
+            Append spikes sorted by time that all occur after the spikes
+            appended previously.
+        """
+        if len(times) == 0:
+            return
+        ids = np.require(ids, dtype=np.int32, requirements=["C"])
+        times = np.require(times, dtype=np.float64, requirements=["C"])
+        if times[0] < self._t_last:
+            raise ValueError("Spikes need to be appended in order.")
+        self._t_last = times[-1]
+
+        if self.metadata["compression"] == "zlib":
+            chunks = self.metadata["chunks"]
+            filename = "chunk-{:06d}.npz".format(len(chunks))
+            np.savez_compressed(osp.join(self.directory, filename),
+                                ids=ids, times=times)
+            chunks.append({
+                "filename": filename,
+                "num_spikes": len(ids),
+                "t_first": float(times[0]),
+                "t_last": float(times[-1]),
+            })
+        else:
+            ids.tofile(self._files["ids"])
+            times.tofile(self._files["times"])
+
+        self.metadata["num_spikes"] += len(ids)
+
+    def close(self, duration, block_size=1 << 22):
+        """
+            Finish writing and return the `SpikeStore`.
+        """
+        self.metadata["duration"] = float(duration)
+
+        if self.metadata["compression"] == "none":
+            for name, dtype in [("ids", np.int32), ("times", np.float64)]:
+                self._files[name].close()
+                tmp_filename = self._get_tmp_filename(name)
+                column = np.lib.format.open_memmap(
+                        osp.join(self.directory, name + ".npy"), mode="w+",
+                        dtype=dtype, shape=(self.num_spikes,))
+                if self.num_spikes > 0:
+                    tmp = np.memmap(tmp_filename, mode="r", dtype=dtype)
+                    for start in xrange(0, self.num_spikes, block_size):
+                        column[start:start+block_size] =\
+                            tmp[start:start+block_size]
+                    del tmp
+                column.flush()
+                del column
+                os.remove(tmp_filename)
+
+        return SpikeStore._write_metadata(self.directory, self.metadata)
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def save_spike_data(spike_data, directory, **kwargs):
+    """
+        Store spike data in `directory`, see `SpikeStore.write`.
+    """
+    return SpikeStore.write(spike_data, directory, **kwargs)
+
+
+def load_spike_data(directory, mmap_mode="r"):
+    """
+        Load (memory-mapped) `SpikeData` from `directory`, see `SpikeStore`.
+    """
+    return SpikeStore(directory).load(mmap_mode=mmap_mode)
+
+
+def get_default_theo_cache():
+    """
+        Return the default cache for theoretical distributions in
+        $SBS_CACHE_DIR or None if it is not set.
+    """
+    if "SBS_CACHE_DIR" not in os.environ:
+        return None
+    return TheoCache(os.environ["SBS_CACHE_DIR"])
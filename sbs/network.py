@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import copy
 import importlib
 import itertools as it
 import pylab as p
@@ -13,10 +14,12 @@ from . import conversion as conv
 from . import cutils
 from . import db
 from . import gather_data
+from . import inference
 from . import io
 from . import meta
 from . import pynn_patches
 from . import samplers
+from . import spikes
 from . import utils
 from .logcfg import log
 
@@ -27,6 +30,10 @@ class BoltzmannMachineBase(object):
         A set of samplers connected as Boltzmann machine.
     """
 
+    # persistent on-disk cache for theoretical distributions (None: look up
+    # $SBS_CACHE_DIR on use, see `io.get_default_theo_cache`; False: disabled)
+    theo_cache = None
+
     def __init__(self, num_samplers, sim_name="pyNN.nest",
                  sampler_config=None, sampler_kwargs={"silent": True}):
         """
@@ -262,6 +269,26 @@ class BoltzmannMachineBase(object):
                    type(self.samplers[0].neuron_parameters))
                    for sampler in self.samplers)
 
+    @meta.DependsOn()
+    def approx_inference_method(self, method="tap"):
+        """
+            Method used to compute `dist_marginal_approx`: "mf" (naive mean
+            field), "tap" (TAP equations) or "bp" (loopy belief propagation).
+        """
+        assert method in inference.APPROX_METHODS,\
+            "Unknown approximation method {}".format(method)
+        return method
+
+    @meta.DependsOn("approx_inference_method", "biases_theo", "weights_theo")
+    def dist_marginal_approx(self):
+        """
+            Approximate marginals of all samplers for networks too large to
+            compute `dist_marginal_theo` exactly.
+        """
+        return inference.get_marginals_approx(
+                self.weights_theo, self.biases_theo,
+                method=self.approx_inference_method)
+
     @property
     def is_created(self):
         return self.population is not None
@@ -386,6 +413,63 @@ class BoltzmannMachineBase(object):
             for s in self.samplers:
                 s.sync_bias_to_pynn()
 
+    def estimate_log_partition(self, num_chains=100, betas=None,
+                               **kwargs):
+        """
+            Estimate the log partition function of the theoretical
+            distribution via annealed importance sampling.
+
+            Returns a `sbs.inference.LogPartitionEstimate` containing the
+            estimate as well as lower and upper error bounds.
+
+            See `sbs.inference.ais_log_partition_bm` for further keyword
+            arguments.
+        """
+        return inference.ais_log_partition_bm(
+                self.weights_theo, self.biases_theo, num_chains=num_chains,
+                betas=betas, **kwargs)
+
+    def get_gibbs_sample_states(self, num_samples, num_chains=None,
+                                selected_idx=None, **kwargs):
+        """
+            Sample states from the theoretical distribution with a software
+            Gibbs sampler instead of the simulated network.
+
+            num_chains: Number of independent chains updated in parallel. If
+                        None, a single chain is run and the states are
+                        returned in the same layout as `get_sample_states`,
+                        otherwise as array of shape
+                        (num_chains, num_samples, num_selected).
+
+            selected_idx: Samplers whose states are returned (default: all).
+
+            See `sbs.inference.sample_gibbs_bm` for further keyword arguments.
+        """
+        samples = self._sample_gibbs(
+                num_samples, 1 if num_chains is None else num_chains,
+                selected_idx=selected_idx, **kwargs)
+        if num_chains is None:
+            return samples[0]
+        else:
+            return samples
+
+    def _sample_gibbs(self, num_samples, num_chains, **kwargs):
+        return inference.sample_gibbs_bm(
+                self.weights_theo, self.biases_theo, num_samples,
+                num_chains=num_chains, **kwargs)
+
+    def _get_theo_cached(self, kind, arrays, compute):
+        """
+            Look up the theoretical quantity `kind` for the given input arrays
+            in `theo_cache` and only call `compute()` if it is not cached yet.
+        """
+        theo_cache = self.theo_cache
+        if theo_cache is None:
+            theo_cache = io.get_default_theo_cache()
+        if theo_cache is None or theo_cache is False:
+            return compute()
+        return theo_cache.get_or_compute(kind, arrays, compute)
+
     def _check_weight_matrix(self, weights):
         weights = np.array(weights)
 
@@ -424,10 +508,21 @@ class ThoroughBM(BoltzmannMachineBase):
         probability distributions.
     """
 
+    # number of threads used to compute theoretical distributions (None for
+    # all available cores)
+    num_threads_theo = 1
+
     def __init__(self, *args, **kwargs):
         super(ThoroughBM, self).__init__(*args, **kwargs)
         self.selected_sampler_idx = range(self.num_samplers)
 
+    def __setstate__(self, state):
+        # networks pickled before the introduction of `sbs.spikes.SpikeData`
+        # hold spike data dictionaries
+        if state.get("_spike_data", None) is not None:
+            state["_spike_data"] = spikes.as_spike_data(state["_spike_data"])
+        self.__dict__.update(state)
+
     ################
     # PyNN methods #
     ################
@@ -549,39 +644,83 @@ class ThoroughBM(BoltzmannMachineBase):
     @meta.DependsOn()
     def spike_data(self, spike_data=None):
         """
-            The spike data from which to compute distributions.
+            The spike data from which to compute distributions as
+            `sbs.spikes.SpikeData`.
+
+            Dictionaries with keys "spiketrains", "duration" and (optionally)
+            "dt" are converted.
         """
         if spike_data is not None:
-            assert "spiketrains" in spike_data
-            assert "duration" in spike_data
-            return spike_data
+            return spikes.as_spike_data(spike_data)
         else:
             # We are requesting data when there is None
             return None
 
     def gather_spikes(self,
                       duration, dt=0.1, burn_in_time=100., create_kwargs=None,
-                      sim_setup_kwargs=None, initial_vmem=None):
+                      sim_setup_kwargs=None, initial_vmem=None,
+                      record_selected_only=False, chunk_duration=None,
+                      spike_directory=None):
         """
             sim_setup_kwargs are the kwargs for the simulator (random seeds).
 
             initial_vmem are the initialized voltages for all samplers.
+
+            If record_selected_only is True, only the spikes of the samplers in
+            `selected_sampler_idx` are recorded (the other samplers will have
+            no spikes in `spike_data`).
+
+            For long runs, the spikes can be drained from the simulator every
+            chunk_duration ms and written to spike_directory (see
+            `gather_data.gather_network_spikes`), from where they are
+            memory-mapped afterwards.
         """
         log.info("Gathering spike data in subprocess..")
-        self.spike_data = gather_data.gather_network_spikes(
+        spike_data = gather_data.gather_network_spikes(
                 self, duration=duration, dt=dt, burn_in_time=burn_in_time,
                 create_kwargs=create_kwargs,
                 sim_setup_kwargs=sim_setup_kwargs,
-                initial_vmem=initial_vmem)
+                initial_vmem=initial_vmem,
+                record_idx=self.selected_sampler_idx
+                if record_selected_only else None,
+                chunk_duration=chunk_duration,
+                spike_directory=spike_directory)
+
+        if spike_directory is not None:
+            self.load_spike_data(spike_directory)
+        else:
+            self.spike_data = spike_data
+
+    def get_gibbs_sample_states(self, num_samples, num_chains=None,
+                                selected_idx=None, **kwargs):
+        """
+            Same as `BoltzmannMachineBase.get_gibbs_sample_states` but only
+            returns the selected samplers by default.
+        """
+        if selected_idx is None:
+            selected_idx = self.selected_sampler_idx
+        return super(ThoroughBM, self).get_gibbs_sample_states(
+                num_samples, num_chains=num_chains, selected_idx=selected_idx,
+                **kwargs)
 
-    def get_sample_states(self, time_per_sample=10.):
+    def get_sample_states(self, time_per_sample=10., packed=False):
+        """
+            Sample the states of the selected samplers every
+            `time_per_sample` ms.
+
+            If `packed` is True, the states are returned bit-packed along the
+            sampler axis (see `cutils.unpack_states`), which needs 64 times
+            less memory.
+        """
         dt = self.spike_data.get("dt", 0.1)
 
         steps_per_sample = int(time_per_sample / dt)
 
+        selected_spikes = self.selected_sampler_spike_data
+
         return cutils.generate_states(
-                spike_ids=self.selected_sampler_spikes["id"],
-                spike_times=np.array(self.selected_sampler_spikes["t"] / dt,
+                spike_ids=selected_spikes.ids,
+                spike_times=np.array(selected_spikes.relative_times / dt,
                                      dtype=int),
                 tau_refrac_pss=np.array(
                     [int(self.samplers[
@@ -589,33 +728,39 @@ class ThoroughBM(BoltzmannMachineBase):
                      for i in self.selected_sampler_idx]),
                 num_samplers=len(self.selected_sampler_idx),
                 steps_per_sample=steps_per_sample,
-                duration=np.array(self.spike_data["duration"] / dt, dtype=int)
+                duration=np.array(self.spike_data.duration / dt, dtype=int),
+                packed=packed,
             )
 
-    @meta.DependsOn("spike_data")
-    def selected_sampler_spikes(self):
+    @meta.DependsOn("spike_data", "selected_sampler_idx")
+    def selected_sampler_spike_data(self):
+        """
+            `SpikeData` of the selected samplers only, with ids replaced by
+            the position of the sampler in `selected_sampler_idx`.
+        """
         log.info("Getting ordered spikes for selected samplers.")
-        spikes = self.ordered_spikes
-
-        selected_idx = np.zeros(spikes.size, dtype=bool)
-
-        for idx in self.selected_sampler_idx:
-            selected_idx += spikes["id"] == idx
-
-        spikes = spikes[selected_idx].copy()
-        new_idx = np.zeros_like(spikes["id"])
-
-        for i, idx in enumerate(self.selected_sampler_idx):
-            new_idx[spikes["id"] == idx] = i
+        return self.spike_data.select_neurons(self.selected_sampler_idx)
 
-        spikes["id"] = new_idx
-
-        return spikes
+    @meta.DependsOn("spike_data", "selected_sampler_idx")
+    def selected_sampler_spikes(self):
+        """
+            Spikes of the selected samplers as (num_spikes,) record array
+            with fields 'id' and 't' sorted by time, see
+            `selected_sampler_spike_data` for the columns without this copy.
+        """
+        return self.selected_sampler_spike_data.to_record_array()
 
     @meta.DependsOn("spike_data")
     def ordered_spikes(self):
+        """
+            All spikes as (num_spikes,) record array with fields 'id' and 't'
+            sorted by time.
+
+            Note: The columns of `spike_data` can be used directly without
+            this copy.
+        """
         log.info("Getting ordered spikes")
-        return utils.get_ordered_spike_idx(self.spike_data["spiketrains"])
+        return self.spike_data.to_record_array()
 
     @meta.DependsOn()
     def selected_sampler_idx(self, selected_sampler_idx=None):
@@ -628,11 +773,35 @@ class ThoroughBM(BoltzmannMachineBase):
     # MISC methods #
     ################
 
-    def save(self, filename):
+    def save(self, filename, include_spike_data=True):
         """
             Save the current Boltzmann network in zipped-pickle form.
+
+            For long recordings, pass `include_spike_data=False` and store the
+            spikes via `save_spike_data` instead.
+        """
+        if include_spike_data:
+            utils.save_pickle(self, filename)
+        else:
+            # resetting the spike data on a shallow copy also drops all
+            # quantities derived from it
+            bm = copy.copy(self)
+            bm.spike_data = None
+            utils.save_pickle(bm, filename)
+
+    def save_spike_data(self, directory, compress=False, **kwargs):
+        """
+            Store the spike data in `directory` as `sbs.io.SpikeStore`
+            (uncompressed stores are loaded memory-mapped).
+        """
+        io.save_spike_data(self.spike_data, directory, compress=compress,
+                           **kwargs)
+
+    def load_spike_data(self, directory, mmap_mode="r"):
         """
-        utils.save_pickle(self, filename)
+            Set the spike data from a `sbs.io.SpikeStore` in `directory`.
+        """
+        self.spike_data = io.load_spike_data(directory, mmap_mode=mmap_mode)
 
     @classmethod
     def load(cls, filename):
@@ -658,15 +827,14 @@ class ThoroughBM(BoltzmannMachineBase):
         log.info("Calculating marginal probability distribution for {} "
                  "samplers.".format(len(self.selected_sampler_idx)))
 
-        marginals = np.zeros((len(self.selected_sampler_idx),))
+        tau_refrac_pss = np.array(
+            [self.samplers[i].neuron_parameters.tau_refrac_calibration
+             for i in self.selected_sampler_idx])
 
-        for i, idx in enumerate(self.selected_sampler_idx):
-            sampler = self.samplers[idx]
-            spikes = self.spike_data["spiketrains"][idx]
-            marginals[i] = len(spikes)\
-                * sampler.neuron_parameters.tau_refrac_calibration
+        marginals = self.spike_data.spike_counts[self.selected_sampler_idx]\
+            * tau_refrac_pss
 
-        marginals /= self.spike_data["duration"]
+        marginals /= self.spike_data.duration
 
         return marginals
 
@@ -677,25 +845,159 @@ class ThoroughBM(BoltzmannMachineBase):
             [self.samplers[i].neuron_parameters.tau_refrac_calibration
              for i in self.selected_sampler_idx])
 
-        spike_ids = np.require(self.ordered_spikes["id"], requirements=["C"])
-        spike_times = np.require(self.ordered_spikes["t"], requirements=["C"])
+        spike_ids = self.spike_data.ids
+        spike_times = self.spike_data.relative_times
 
         return cutils.get_bm_joint_sim(
                 spike_ids, spike_times, self.selected_sampler_idx,
-                tau_refrac_pss, self.spike_data["duration"])
+                tau_refrac_pss, self.spike_data.duration)
+
+    @meta.DependsOn("spike_data", "selected_sampler_idx")
+    def dist_joint_sim_sparse(self):
+        """
+            Joint distribution computed from spike data containing only the
+            visited states, feasible for many more selected samplers than
+            `dist_joint_sim`.
+
+            Returns a tuple (states, probabilities), see
+            `cutils.get_bm_joint_sim_sparse`.
+        """
+        log.info("Calculating sparse joint distribution for {} samplers."
+                 .format(len(self.selected_sampler_idx)))
+
+        tau_refrac_pss = np.array(
+            [self.samplers[i].neuron_parameters.tau_refrac_calibration
+             for i in self.selected_sampler_idx])
+
+        spike_ids = self.spike_data.ids
+        spike_times = self.spike_data.relative_times
+
+        return cutils.get_bm_joint_sim_sparse(
+                spike_ids, spike_times, self.selected_sampler_idx,
+                tau_refrac_pss, self.spike_data.duration)
+
+    def get_dist_joint_sim_subsets(self, subsets):
+        """
+            Joint distributions computed from spike data for each of the given
+            subsets of sampler indices (e.g. `it.combinations(range(n), 2)`
+            for all pairs), all filled in a single pass over the spikes.
+
+            Unlike `dist_joint_sim`, the axes of each joint are ordered as
+            the samplers in the subset.
+        """
+        subsets = list(subsets)
+        log.info("Calculating joint distributions for {} subsets.".format(
+                 len(subsets)))
+
+        tau_refracs = np.array(
+            [s.neuron_parameters.tau_refrac_calibration
+             for s in self.samplers], dtype=np.float64)
+
+        spike_ids = self.spike_data.ids
+        spike_times = self.spike_data.relative_times
+
+        return cutils.get_bm_joint_sim_subsets(
+                spike_ids, spike_times, subsets, tau_refracs,
+                self.spike_data.duration)
+
+    def get_dkl_convergence(self, checkpoints=None, num_checkpoints=20,
+                            joint=True):
+        """
+            DKL between theoretical and sampled distributions of the selected
+            samplers for the spike data up to each of the given checkpoint
+            times, all computed in a single pass over the spikes.
+
+            checkpoints: Sorted times (ms) at which to evaluate the DKLs. By
+                         default, `num_checkpoints` log-spaced times spanning
+                         the last three decades of the recording.
+
+            joint: Whether to also compute the DKL of the joint distribution
+                   (which requires `dist_joint_theo`).
+
+            Returns a tuple (checkpoints, dkl_marginal, dkl_joint) with
+            dkl_joint being None if `joint` is False.
+        """
+        duration = self.spike_data.duration
+        if checkpoints is None:
+            checkpoints = np.logspace(np.log10(duration) - 3,
+                                      np.log10(duration), num_checkpoints)
+        checkpoints = np.require(checkpoints, dtype=np.float64,
+                                 requirements=["C"])
+
+        log.info("Calculating DKL convergence for {} samplers at {} "
+                 "checkpoints.".format(len(self.selected_sampler_idx),
+                                       len(checkpoints)))
+
+        sampler_idx = np.sort(self.selected_sampler_idx)
+        tau_refrac_pss = np.array(
+            [self.samplers[i].neuron_parameters.tau_refrac_calibration
+             for i in sampler_idx])
+
+        spike_ids = self.spike_data.ids
+        spike_times = self.spike_data.relative_times
+
+        marginals, joints = cutils.get_bm_sim_checkpoints(
+                spike_ids, spike_times, sampler_idx, tau_refrac_pss,
+                checkpoints, joint=joint)
+
+        # marginals are returned ordered by sampler index
+        marginals_theo = self._get_moments_theo()[1][sampler_idx]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dkl_marginal = np.array([
+                utils.dkl_sum_marginals(marginals_theo, m)
+                for m in marginals])
+
+            if joint:
+                joint_theo = self.dist_joint_theo.flatten()
+                dkl_joint = np.array([
+                    utils.dkl(joint_theo, j.flatten()) for j in joints])
+            else:
+                dkl_joint = None
+
+        return checkpoints, dkl_marginal, dkl_joint
+
+    def _get_moments_theo(self):
+        """
+            Log partition function and marginals of all samplers.
+        """
+        lc_biases = np.require(self.biases_theo, requirements=["C"])
+        lc_weights = np.require(self.weights_theo, requirements=["C"])
+
+        def compute():
+            log_partition, marginals = cutils.get_bm_moments_theo(
+                    lc_weights, lc_biases, num_threads=self.num_threads_theo)
+            return np.r_[log_partition, marginals]
+
+        moments = self._get_theo_cached(
+                "bm_moments", [lc_weights, lc_biases], compute)
+        return moments[0], moments[1:]
+
+    @meta.DependsOn("biases_theo", "weights_theo")
+    def log_partition_theo(self):
+        """
+            Logarithm of the partition function of the theoretical
+            distribution.
+        """
+        return self._get_moments_theo()[0]
 
     @meta.DependsOn("selected_sampler_idx", "biases_theo", "weights_theo")
     def dist_marginal_theo(self):
         """
             Marginal distribution
         """
-        lc_biases = self.biases_theo
-        lc_weights = self.weights_theo
-        lc_biases = np.require(lc_biases, requirements=["C"])
-        lc_weights = np.require(lc_weights, requirements=["C"])
+        return self._get_moments_theo()[1][self.selected_sampler_idx]
 
-        return cutils.get_bm_marginal_theo(
-                lc_weights, lc_biases, self.selected_sampler_idx)
+    @meta.DependsOn("selected_sampler_idx", "approx_inference_method",
+                    "biases_theo", "weights_theo")
+    def dist_marginal_approx(self):
+        """
+            Approximate marginals of the selected samplers (see
+            `BoltzmannMachineBase.dist_marginal_approx`).
+        """
+        return inference.get_marginals_approx(
+                self.weights_theo, self.biases_theo,
+                method=self.approx_inference_method)[self.selected_sampler_idx]
 
     @meta.DependsOn("selected_sampler_idx", "biases_theo", "weights_theo")
     def dist_joint_theo(self):
@@ -711,21 +1013,60 @@ class ThoroughBM(BoltzmannMachineBase):
         lc_biases = np.require(lc_biases, requirements=["C"])
         lc_weights = np.require(lc_weights, requirements=["C"])
 
-        joint = cutils.get_bm_joint_theo(lc_weights, lc_biases)
-
         ssi = self.selected_sampler_idx
 
         if len(ssi) == self.num_samplers\
                 and np.all(ssi == np.arange(self.num_samplers)):
-            return joint
+            return self._get_theo_cached(
+                "bm_joint", [lc_weights, lc_biases],
+                lambda: cutils.get_bm_joint_theo(
+                    lc_weights, lc_biases, num_threads=self.num_threads_theo))
 
         else:
-            for idx in xrange(self.num_samplers):
-                if idx in self.selected_sampler_idx:
-                    continue
-                joint = joint.sum(axis=idx, keepdims=True)
+            # axes are ordered by sampler index
+            selected_idx = np.require(np.unique(ssi), dtype=np.int)
+            return self._get_theo_cached(
+                "bm_joint_selected", [lc_weights, lc_biases, selected_idx],
+                lambda: cutils.get_bm_joint_theo_selected(
+                    lc_weights, lc_biases, selected_idx,
+                    num_threads=self.num_threads_theo)).squeeze()
+
+    @meta.DependsOn("spike_data", "selected_sampler_idx")
+    def correlations_sim(self):
+        """
+            Pairwise correlations <s_i s_j> of the selected samplers computed
+            from spike data (marginals on the diagonal).
+        """
+        log.info("Calculating pairwise correlations for {} samplers.".format(
+                 len(self.selected_sampler_idx)))
 
-            return joint.squeeze()
+        return utils.get_pairwise_correlations(
+                self.selected_sampler_spike_data,
+                self.tau_refracs[self.selected_sampler_idx],
+                self.spike_data.duration)
+
+    @meta.DependsOn("selected_sampler_idx", "biases_theo", "weights_theo")
+    def correlations_theo(self):
+        """
+            Theoretical pairwise correlations <s_i s_j> of the selected
+            samplers (marginals on the diagonal).
+
+            Computed in the same enumeration as the partition function.
+        """
+        log.info("Calculating theoretical pairwise correlations for {} "
+                 "samplers.".format(len(self.selected_sampler_idx)))
+
+        lc_biases = np.require(self.biases_theo, requirements=["C"])
+        lc_weights = np.require(self.weights_theo, requirements=["C"])
+
+        correlations = self._get_theo_cached(
+                "bm_correlations", [lc_weights, lc_biases],
+                lambda: cutils.get_bm_moments_theo(
+                    lc_weights, lc_biases, second_moments=True,
+                    num_threads=self.num_threads_theo)[2])
+
+        ssi = self.selected_sampler_idx
+        return correlations[np.ix_(ssi, ssi)]
 
     ################
     # PLOT methods #
@@ -1592,6 +1933,25 @@ class MixinRBM(object):
             "Setting biological weights directly is currently not supported.")
         return None
 
+    def _sample_gibbs(self, num_samples, num_chains, **kwargs):
+        return inference.sample_gibbs_rbm(
+                self.weights_theo, self.biases_theo, self.num_units_per_layer,
+                num_samples, num_chains=num_chains, **kwargs)
+
+    def estimate_log_partition(self, num_chains=100, betas=None,
+                               **kwargs):
+        """
+            Estimate the log partition function of the theoretical
+            distribution via annealed importance sampling with every other
+            layer summed out analytically.
+
+            See `sbs.inference.ais_log_partition_rbm` for further keyword
+            arguments.
+        """
+        return inference.ais_log_partition_rbm(
+                self.weights_theo, self.biases_theo, self.num_units_per_layer,
+                num_chains=num_chains, betas=betas, **kwargs)
+
     def update_weights_bio(self):
         log.info("Converting and loading weights…")
         # we need to make sure to obey the order in nest,
@@ -1825,12 +2185,77 @@ class ThoroughRBM(MixinRBM, BoltzmannMachineBase):
 
         Still, the only supported backend is nest for the time being.
 
-        Distributions cannot be calculated. Currently only useful to generate
-        snapshots of the distribution.
+        Theoretical distributions are computed by summing out every other
+        layer analytically, hence they are feasible as long as the smaller
+        set of alternating layers is small enough to be enumerated.
     """
 
     nest_synapse_type = "static_synapse"
 
+    #######################
+    # PROBABILITY methdos #
+    #######################
+
+    def _get_moments_theo(self):
+        """
+            Log partition function and marginals of all samplers.
+        """
+        log.info("Calculating marginal theoretical distribution for RBM with "
+                 "{} units per layer.".format(self.num_units_per_layer))
+
+        def compute():
+            log_partition, marginals = inference.get_rbm_moments_theo(
+                self.weights_theo, self.biases_theo, self.num_units_per_layer)
+            return np.r_[log_partition, marginals]
+
+        moments = self._get_theo_cached(
+                "rbm_moments", self._get_theo_cache_arrays(), compute)
+        return moments[0], moments[1:]
+
+    def _get_theo_cache_arrays(self):
+        return [np.array(self.num_units_per_layer), self.biases_theo]\
+            + list(self.weights_theo)
+
+    @meta.DependsOn("biases_theo", "weights_theo")
+    def log_partition_theo(self):
+        """
+            Logarithm of the partition function of the theoretical
+            distribution.
+        """
+        return self._get_moments_theo()[0]
+
+    @meta.DependsOn("biases_theo", "weights_theo")
+    def dist_marginal_theo(self):
+        """
+            Marginal distribution of all samplers.
+        """
+        return self._get_moments_theo()[1]
+
+    @meta.DependsOn("approx_inference_method", "biases_theo", "weights_theo")
+    def dist_marginal_approx(self):
+        """
+            Approximate marginals of all samplers (see
+            `BoltzmannMachineBase.dist_marginal_approx`).
+        """
+        return inference.get_marginals_approx(
+                inference.get_dense_weights(self.weights_theo,
+                                            self.num_units_per_layer),
+                self.biases_theo, method=self.approx_inference_method)
+
+    @meta.DependsOn("biases_theo", "weights_theo")
+    def dist_joint_theo(self):
+        """
+            Joint distribution of the visible (first) layer.
+        """
+        log.info("Calculating joint theoretical distribution for {} visible "
+                 "samplers.".format(self.num_units_per_layer[0]))
+
+        return self._get_theo_cached(
+            "rbm_joint", self._get_theo_cache_arrays(),
+            lambda: inference.get_rbm_joint_theo(
+                self.weights_theo, self.biases_theo,
+                self.num_units_per_layer))
+
     def create_population(self, **kwargs):
         population = super(ThoroughRBM, self).create_population(**kwargs)
         self._sampler_gids = population.all_cells.tolist()
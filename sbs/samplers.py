@@ -6,7 +6,6 @@ from . import utils
 from . import db
 from . import fit
 from . import meta
-from . import cutils
 
 import logging
 import importlib
@@ -640,7 +639,8 @@ class LIFsampler(object):
                            the autocorrelation should be calculated.
         """
         assert self.has_free_vmem_trace
-        autocorr = cutils.autocorr(self.free_vmem["trace"], max_step_diff)
+        autocorr = utils.get_autocorrelation(self.free_vmem["trace"],
+                                             max_lag=max_step_diff)
 
         ax.plot(np.arange(1, max_step_diff+1)
                 * self.free_vmem["dt"], autocorr)
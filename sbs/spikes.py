@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+    Columnar storage of recorded spikes.
+"""
+
+import numpy as np
+
+from . import cutils
+
+__all__ = [
+    "EncodedSpikeData",
+    "SpikeData",
+    "as_spike_data",
+]
+
+
+class SpikeData(object):
+    """
+        Spikes of `num_neurons` neurons recorded in the interval
+        [t_start, t_start + duration).
+
+        All spikes are stored once in two columns sorted by time: `ids`
+        (int32) and `times` (float64), which can be passed to the `cutils`
+        kernels as they are. Per-neuron spike trains are zero-copy views into
+        the spike times grouped by neuron, located via a CSR offset index
+        that is built on first use.
+
+        For compatibility with the spike data dictionaries used previously,
+        "spiketrains", "duration" and "dt" can be accessed as keys.
+    """
+
+    def __init__(self, ids, times, duration, num_neurons=None, dt=None,
+                 t_start=0., is_sorted=True):
+        """
+            ids/times: Neuron id and time of every spike. If `is_sorted` is
+                       False, they are sorted by time first.
+
+            num_neurons: Number of recorded neurons (default: highest id + 1).
+        """
+        ids = np.asanyarray(ids)
+        times = np.asanyarray(times)
+        if ids.shape != times.shape or ids.ndim != 1:
+            raise ValueError("ids and times need to be 1-d arrays of the "
+                             "same length.")
+
+        if not is_sorted:
+            order = np.argsort(times, kind="mergesort")
+            ids = ids[order]
+            times = times[order]
+
+        self.ids = np.require(ids, dtype=np.int32, requirements=["C"])
+        self.times = np.require(times, dtype=np.float64, requirements=["C"])
+
+        if num_neurons is None:
+            num_neurons = self.ids.max() + 1 if len(self.ids) > 0 else 0
+        self.num_neurons = int(num_neurons)
+        self.duration = float(duration)
+        self.dt = dt
+        self.t_start = float(t_start)
+
+        self._neuron_offsets = None
+        self._neuron_times = None
+
+    @classmethod
+    def from_spiketrains(cls, spiketrains, duration, dt=None, t_start=0.):
+        """
+            Create from one array of (sorted) spike times per neuron.
+        """
+        num_spikes = sum(len(st) for st in spiketrains)
+        ids = np.empty((num_spikes,), dtype=np.int32)
+        times = np.empty((num_spikes,), dtype=np.float64)
+        cutils.merge_spike_trains(spiketrains, ids, times)
+        return cls(ids, times, duration, num_neurons=len(spiketrains), dt=dt,
+                   t_start=t_start)
+
+    @classmethod
+    def from_dict(cls, spike_data):
+        """
+            Create from a dictionary with keys "spiketrains", "duration" and
+            (optionally) "dt".
+        """
+        return cls.from_spiketrains(spike_data["spiketrains"],
+                                    spike_data["duration"],
+                                    dt=spike_data.get("dt", None))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_spikes(self):
+        return len(self.ids)
+
+    @property
+    def t_stop(self):
+        return self.t_start + self.duration
+
+    @property
+    def relative_times(self):
+        """
+            Spike times relative to `t_start` (a copy only if t_start != 0).
+        """
+        if self.t_start == 0.:
+            return self.times
+        else:
+            return self.times - self.t_start
+
+    @property
+    def spike_counts(self):
+        """
+            Number of spikes per neuron.
+        """
+        return np.bincount(self.ids, minlength=self.num_neurons)
+
+    @property
+    def neuron_offsets(self):
+        """
+            CSR index: the spikes of neuron i are located at
+            [neuron_offsets[i], neuron_offsets[i+1]) in `neuron_times`.
+        """
+        if self._neuron_offsets is None:
+            self._build_neuron_index()
+        return self._neuron_offsets
+
+    @property
+    def neuron_times(self):
+        """
+            Spike times grouped by neuron (each group sorted by time).
+        """
+        if self._neuron_times is None:
+            self._build_neuron_index()
+        return self._neuron_times
+
+    def _build_neuron_index(self):
+        # a stable sort keeps the spikes of each neuron sorted by time
+        order = np.argsort(self.ids, kind="mergesort")
+        self._neuron_times = self.times[order]
+        self._neuron_offsets = np.r_[0, np.cumsum(self.spike_counts)]
+
+    def get_spiketrain(self, neuron_id):
+        """
+            Spike times of a single neuron (as view).
+        """
+        offsets = self.neuron_offsets
+        return self.neuron_times[offsets[neuron_id]:offsets[neuron_id+1]]
+
+    @property
+    def spiketrains(self):
+        return [self.get_spiketrain(i) for i in xrange(self.num_neurons)]
+
+    def get_time_window(self, t_start, t_stop):
+        """
+            Spikes in [t_start, t_stop) as `SpikeData` sharing the columns
+            with this instance (spike times are not shifted, see
+            `relative_times`).
+        """
+        t_start = max(t_start, self.t_start)
+        t_stop = min(t_stop, self.t_stop)
+        if t_stop < t_start:
+            raise ValueError("Empty time window [{}, {}).".format(
+                t_start, t_stop))
+
+        start, stop = np.searchsorted(self.times, [t_start, t_stop])
+        return SpikeData(self.ids[start:stop], self.times[start:stop],
+                         duration=t_stop - t_start,
+                         num_neurons=self.num_neurons, dt=self.dt,
+                         t_start=t_start)
+
+    def select_neurons(self, neuron_idx):
+        """
+            Spikes of the given neurons only, with ids replaced by the
+            position of the neuron in `neuron_idx`.
+        """
+        neuron_idx = np.require(neuron_idx, dtype=np.int).reshape(-1)
+
+        # map every neuron id to its selected index (-1 if not selected) so
+        # that all spikes are remapped in a single gather
+        lut = cutils.get_selected_lut(self.ids, neuron_idx)
+        new_ids = lut[self.ids]
+        selected = new_ids >= 0
+
+        return SpikeData(new_ids[selected], self.times[selected],
+                         duration=self.duration,
+                         num_neurons=len(neuron_idx), dt=self.dt,
+                         t_start=self.t_start)
+
+    def to_record_array(self):
+        """
+            Return a copy as (num_spikes,) record array with fields 'id' and
+            't' (relative to `t_start`) sorted by time.
+        """
+        spikes = np.zeros((self.num_spikes,),
+                          dtype=[("id", int), ("t", float)])
+        spikes["id"] = self.ids
+        spikes["t"] = self.relative_times
+        return spikes
+
+    def to_dict(self):
+        return {
+            "spiketrains": self.spiketrains,
+            "duration": self.duration,
+            "dt": self.dt,
+        }
+
+    # dictionary interface for backwards compatibility
+
+    def __getitem__(self, key):
+        if key == "spiketrains":
+            return self.spiketrains
+        elif key == "duration":
+            return self.duration
+        elif key == "dt" and self.dt is not None:
+            return self.dt
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getstate__(self):
+        # the neuron index is rebuilt when needed
+        state = self.__dict__.copy()
+        state["_neuron_offsets"] = None
+        state["_neuron_times"] = None
+        return state
+
+    def __repr__(self):
+        return "SpikeData({} spikes of {} neurons in [{}, {}))".format(
+            self.num_spikes, self.num_neurons, self.t_start, self.t_stop)
+
+
+class EncodedSpikeData(object):
+    """
+        Compact encoding of spikes whose times lie on the grid of the
+        simulation time step `dt` (as recorded by NEST).
+
+        The spike times of each neuron are converted to integer step counts
+        and stored as varints of the differences between consecutive spikes
+        (see `cutils.encode_varint_deltas`), which typically needs one or two
+        bytes per spike instead of twelve. A block index allows decoding the
+        spikes of a time window without decoding everything before it.
+    """
+
+    def __init__(self, data, byte_offsets, spike_offsets, block_bytes,
+                 block_steps, block_offsets, duration, dt, t_start=0.):
+        self.data = data
+        self.byte_offsets = byte_offsets
+        self.spike_offsets = spike_offsets
+        self.block_bytes = block_bytes
+        self.block_steps = block_steps
+        self.block_offsets = block_offsets
+        self.duration = float(duration)
+        self.dt = float(dt)
+        self.t_start = float(t_start)
+
+    @classmethod
+    def encode(cls, spike_data, dt=None, block_size=256, tolerance=1e-3):
+        """
+            Encode `spike_data` (SpikeData or spike data dictionary).
+
+            dt: Time step of the grid (default: `spike_data.dt`).
+
+            tolerance: Maximum deviation of spike times from the grid (in
+                       steps), a ValueError is raised otherwise.
+        """
+        spike_data = as_spike_data(spike_data)
+        if dt is None:
+            dt = spike_data.dt
+        if dt is None:
+            raise ValueError("Need the time step to encode spike data.")
+
+        steps = (spike_data.neuron_times - spike_data.t_start) / dt
+        rounded = np.require(np.round(steps), dtype=np.int64,
+                             requirements=["C"])
+        if len(steps) > 0 and np.abs(steps - rounded).max() > tolerance:
+            raise ValueError("Spike times are not on the grid of dt={}."
+                             .format(dt))
+
+        spike_offsets = np.require(spike_data.neuron_offsets,
+                                   dtype=np.int64, requirements=["C"])
+        (data, byte_offsets, block_bytes, block_steps,
+         block_offsets) = cutils.encode_varint_deltas(
+                 rounded, spike_offsets, block_size)
+
+        return cls(data, byte_offsets, spike_offsets, block_bytes,
+                   block_steps, block_offsets, duration=spike_data.duration,
+                   dt=dt, t_start=spike_data.t_start)
+
+    @property
+    def num_neurons(self):
+        return len(self.spike_offsets) - 1
+
+    @property
+    def num_spikes(self):
+        return int(self.spike_offsets[-1])
+
+    @property
+    def t_stop(self):
+        return self.t_start + self.duration
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in [
+            self.data, self.byte_offsets, self.spike_offsets,
+            self.block_bytes, self.block_steps, self.block_offsets])
+
+    def _get_step(self, t):
+        # first step at or after time t
+        return int(np.ceil((t - self.t_start) / self.dt - 1e-6))
+
+    def _decode_steps(self, neuron_id, step_start, step_stop):
+        blocks = slice(self.block_offsets[neuron_id],
+                       self.block_offsets[neuron_id+1])
+        block_steps = self.block_steps[blocks]
+        if len(block_steps) == 0:
+            return np.zeros((0,), dtype=np.int64)
+
+        # start in the last block whose preceding spike lies before the window
+        i_block = max(np.searchsorted(block_steps, step_start) - 1, 0)
+        return cutils.decode_varint_deltas_window(
+                self.data, self.block_bytes[blocks][i_block],
+                self.byte_offsets[neuron_id+1], block_steps[i_block],
+                step_start, step_stop)
+
+    def get_spiketrain(self, neuron_id, t_start=None, t_stop=None):
+        """
+            Spike times of a single neuron (in [t_start, t_stop) if given).
+        """
+        step_start = 0 if t_start is None else self._get_step(t_start)
+        step_stop = np.iinfo(np.int64).max if t_stop is None\
+            else self._get_step(t_stop)
+        return self._decode_steps(neuron_id, step_start, step_stop)\
+            * self.dt + self.t_start
+
+    def get_time_window(self, t_start, t_stop):
+        """
+            Decode only the spikes in [t_start, t_stop) into `SpikeData`.
+        """
+        t_start = max(t_start, self.t_start)
+        t_stop = min(t_stop, self.t_stop)
+        if t_stop < t_start:
+            raise ValueError("Empty time window [{}, {}).".format(
+                t_start, t_stop))
+
+        return SpikeData.from_spiketrains(
+                [self.get_spiketrain(i, t_start, t_stop)
+                 for i in xrange(self.num_neurons)],
+                t_stop - t_start, dt=self.dt, t_start=t_start)
+
+    def iter_chunks(self, chunk_duration=10000., relative=True):
+        """
+            Iterate over (spike_ids, spike_times) of consecutive time windows,
+            e.g. for the streaming accumulators in `cutils`.
+
+            relative: If True, spike times are relative to `t_start` (as
+                      expected by the accumulators).
+        """
+        t_start = self.t_start
+        while t_start < self.t_stop:
+            window = self.get_time_window(t_start, t_start + chunk_duration)
+            if relative and self.t_start != 0.:
+                yield window.ids, window.times - self.t_start
+            else:
+                yield window.ids, window.times
+            t_start += chunk_duration
+
+    def decode(self):
+        """
+            Return all spikes as `SpikeData`.
+        """
+        times = cutils.decode_varint_deltas(
+                self.data, self.byte_offsets, self.spike_offsets)\
+            * self.dt + self.t_start
+        offsets = self.spike_offsets
+        return SpikeData.from_spiketrains(
+                [times[offsets[i]:offsets[i+1]]
+                 for i in xrange(self.num_neurons)],
+                self.duration, dt=self.dt, t_start=self.t_start)
+
+    def __repr__(self):
+        return "EncodedSpikeData({} spikes of {} neurons in {} bytes)".format(
+            self.num_spikes, self.num_neurons, self.nbytes)
+
+
+def as_spike_data(spike_data):
+    """
+        Return `spike_data` as `SpikeData`, decoding `EncodedSpikeData` and
+        converting spike data dictionaries (see `SpikeData.from_dict`).
+    """
+    if spike_data is None or isinstance(spike_data, SpikeData):
+        return spike_data
+    elif isinstance(spike_data, EncodedSpikeData):
+        return spike_data.decode()
+    return SpikeData.from_dict(spike_data)
@@ -25,6 +25,7 @@ except ImportError:
 from .logcfg import log
 
 from . import cutils
+from . import spikes
 
 __all__ = [
     "IF_cond_exp_distribution",
@@ -38,6 +39,8 @@ __all__ = [
     "filter_dict",
     "format_time",
     "gauss",
+    "get_autocorrelation",
+    "get_crosscorrelation",
     "get_default_setup_kwargs",
     "get_eta",
     "get_elapsed_str",
@@ -47,6 +50,7 @@ __all__ = [
     "get_sha1",
     "get_time_tuple",
     "group_identical_parameters",
+    "iter_spike_chunks",
     "load_pickle",
     "nest_change_poisson_rate",
     "nest_copy_model",
@@ -312,7 +316,7 @@ def get_pairwise_correlations(
     """Simple wrapper around cutils.get_pairwise_correlations.
 
     Args:
-        spike_times ([np.arrays]): Spike times of each neuron.
+        spike_times ([np.arrays] or SpikeData): Spike times of each neuron.
 
         tau_refs ([float]): List/numpy array of refractory  periods of each
                             neuron. Can also be a scalar.
@@ -329,19 +333,14 @@ def get_pairwise_correlations(
     Returns:
         np.array of shape (N, N) containing the pairwise correlations.
     """
-    spike_ids = []
-
-    for i, spikes in enumerate(spike_times):
-        spike_ids.append(np.ones(len(spikes), dtype=np.int) * i)
-
-    num_neurons = len(spike_times)
-
-    spike_ids = np.hstack(spike_ids)
-    spike_times = np.hstack(spike_times)
+    if isinstance(spike_times, spikes.SpikeData):
+        spike_data = spike_times
+    else:
+        spike_data = spikes.SpikeData.from_spiketrains(spike_times, duration)
 
-    idx = np.argsort(spike_times)
-    spike_ids = spike_ids[idx]
-    spike_times = spike_times[idx]
+    num_neurons = spike_data.num_neurons
+    spike_ids = spike_data.ids
+    spike_times = spike_data.relative_times
 
     if np.isscalar(tau_refs):
         tau_refs = np.ones(num_neurons, dtype=np.float64) * tau_refs
@@ -351,14 +350,106 @@ def get_pairwise_correlations(
 
     # ensure correct alignment for cython code
     tau_refs = np.require(tau_refs, dtype=np.float64, requirements="C")
-    spike_ids = np.require(spike_ids, dtype=np.int, requirements="C")
-    spike_times = np.require(spike_times, dtype=np.float64, requirements="C")
 
     return cutils.get_pairwise_correlations(spike_ids, spike_times,
                                             np.arange(num_neurons),
                                             tau_refs, duration, ignore_until)
 
 
+def iter_spike_chunks(spike_ids, spike_times, chunk_size=1 << 20):
+    """
+        Iterate over (spike_ids, spike_times) in chunks of `chunk_size` spikes
+        for the streaming accumulators in `cutils` (e.g.
+        `cutils.JointAccumulator`).
+
+        The arrays can be memory-mapped (e.g. via np.load(..., mmap_mode="r"))
+        so that only one chunk at a time has to be held in memory.
+    """
+    assert len(spike_ids) == len(spike_times)
+    for start in xrange(0, len(spike_ids), chunk_size):
+        yield (np.require(spike_ids[start:start+chunk_size],
+                          requirements=["C"]),
+               np.require(spike_times[start:start+chunk_size],
+                          dtype=np.float64, requirements=["C"]))
+
+
+def get_crosscorrelation(x, y, max_lag=None):
+    """
+        Pearson correlation between x[t] and y[t + lag] for lag = 0, ...,
+        max_lag - 1 (default: all lags) along the first axis.
+
+        x and y can be 1-d traces (e.g. a free membrane potential) or 2-d
+        arrays of shape (num_steps, num_units) (e.g. the state matrices from
+        `ThoroughBM.get_sample_states`), in which case each column of x is
+        correlated with the corresponding column of y.
+
+        For every lag only the overlapping part of both sequences is used
+        (i.e. the same as np.corrcoef(x[:-lag], y[lag:])), but all lagged
+        products are computed at once via FFT (Wiener-Khinchin) in
+        O(n log n) instead of O(n * max_lag).
+
+        Lags for which one of the overlapping segments is constant yield NaN.
+
+        Returns an array of shape (max_lag,) + x.shape[1:].
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape:
+        raise ValueError("Shapes of x {} and y {} differ.".format(
+            x.shape, y.shape))
+
+    num_steps = x.shape[0]
+    if max_lag is None:
+        max_lag = num_steps
+    if not 0 < max_lag <= num_steps:
+        raise ValueError("max_lag has to be in [1, {}].".format(num_steps))
+
+    # removing the global mean does not change the correlation coefficients
+    # but avoids cancellation errors for traces with a large offset
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+
+    # zero-padding to at least num_steps + max_lag - 1 prevents the circular
+    # correlation from wrapping around for the requested lags
+    nfft = 1 << int(np.ceil(np.log2(num_steps + max_lag - 1)))
+    lagged_products = np.fft.irfft(
+            np.conj(np.fft.rfft(x, nfft, axis=0))
+            * np.fft.rfft(y, nfft, axis=0), nfft, axis=0)[:max_lag]
+
+    lags = np.arange(max_lag)
+    counts = (num_steps - lags).reshape((-1,) + (1,) * (x.ndim - 1))
+
+    def segment_sums(a):
+        # sums over a[:n-lag] and a[lag:] for all lags
+        cumsum = np.concatenate([np.zeros((1,) + a.shape[1:]),
+                                 np.cumsum(a, axis=0)])
+        return (cumsum[num_steps - lags],
+                cumsum[num_steps] - cumsum[lags])
+
+    sum_x, _ = segment_sums(x)
+    sum_xx, _ = segment_sums(x * x)
+    _, sum_y = segment_sums(y)
+    _, sum_yy = segment_sums(y * y)
+
+    covariance = lagged_products - sum_x * sum_y / counts
+    variance_x = np.maximum(sum_xx - sum_x * sum_x / counts, 0.)
+    variance_y = np.maximum(sum_yy - sum_y * sum_y / counts, 0.)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = covariance / np.sqrt(variance_x * variance_y)
+        corr[~(variance_x * variance_y > 0.)] = np.nan
+
+    return np.clip(corr, -1., 1.)
+
+
+def get_autocorrelation(array, max_lag=None):
+    """
+        Autocorrelation of `array` along the first axis for lag = 0, ...,
+        max_lag - 1, see `get_crosscorrelation` for details.
+    """
+    return get_crosscorrelation(array, array, max_lag=max_lag)
+
+
 def get_urandom_num(n=1, BYTE_LEN=8):
     rand_bytes = os.urandom(BYTE_LEN*n)
     return (struct.unpack("L", rand_bytes[i*BYTE_LEN:(i+1)*BYTE_LEN])[0]
@@ -488,22 +579,21 @@ def get_ordered_spike_idx(spiketrains):
         position. The spike times are sorted in ascending order.
     """
     num_spikes = sum((len(st) for st in spiketrains))
-    spikes = np.zeros((num_spikes,), dtype=[("id", int), ("t", float)])
-
-    current = 0
 
-    for i, st in enumerate(spiketrains):
-        if log.getEffectiveLevel() <= logging.DEBUG:
+    if log.getEffectiveLevel() <= logging.DEBUG:
+        for i, st in enumerate(spiketrains):
             log.debug("Raw spikes for #{}: {}".format(i, pf(st)))
-        spikes["id"][current:current+len(st)] = i
-        spikes["t"][current:current+len(st)] = np.array(st)
 
-        current += len(st)
+    # the spike trains are sorted already, so a k-way merge into contiguous
+    # columns suffices
+    ids = np.empty((num_spikes,), dtype=np.int32)
+    times = np.empty((num_spikes,), dtype=np.float64)
+    cutils.merge_spike_trains(spiketrains, ids, times)
 
-    sort_idx = np.argsort(spikes["t"])
-    sorted_spikes = spikes[sort_idx].copy()
-
-    return sorted_spikes
+    spikes = np.zeros((num_spikes,), dtype=[("id", int), ("t", float)])
+    spikes["id"] = ids
+    spikes["t"] = times
+    return spikes
 
 
 def check_list_array(obj):
@@ -0,0 +1,294 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+#
+from __future__ import print_function
+
+import unittest
+import numpy as np
+
+import sbs
+
+from test_theo_distributions import (get_bm_theo_brute_force,
+                                     get_dense_parameters)
+
+
+class TestAIS(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def assertEstimate(self, estimate, log_partition, tolerance=.1):
+        self.assertTrue(estimate.lower <= estimate.log_partition
+                        <= estimate.upper)
+        self.assertTrue(abs(estimate.log_partition - log_partition)
+                        < tolerance, "{} vs {}".format(estimate,
+                                                       log_partition))
+
+    def test_gibbs_sweep_bm(self):
+        weights = np.random.randn(4, 4)
+        weights = (weights + weights.T) / 2.
+        np.fill_diagonal(weights, 0.)
+        biases = np.random.randn(4)
+
+        joint = get_bm_theo_brute_force(weights, biases)[0]
+
+        states = np.zeros((20000, 4))
+        for i in xrange(20):
+            sbs.inference.gibbs_sweep_bm(states, weights, biases)
+
+        state_idx = states.dot(1 << np.arange(3, -1, -1)).astype(int)
+        joint_sampled = np.bincount(state_idx, minlength=16) / 20000.
+
+        self.assertTrue(np.abs(joint_sampled - joint.reshape(-1)).max()
+                        < .02)
+
+    def test_bm(self):
+        weights = np.random.randn(10, 10)
+        weights = (weights + weights.T) / 2.
+        np.fill_diagonal(weights, 0.)
+        biases = np.random.randn(10)
+
+        log_partition = sbs.cutils.get_bm_log_partition_theo(weights, biases)
+
+        self.assertEstimate(sbs.inference.ais_log_partition_bm(
+            weights, biases, num_chains=100,
+            betas=sbs.inference.get_ais_betas(1000)), log_partition)
+
+    def test_rbm(self):
+        for num_units_per_layer in [[8, 6], [3, 4, 5]]:
+            layer_weights = [
+                np.random.randn(n_pre, n_post)
+                for n_pre, n_post in zip(num_units_per_layer[:-1],
+                                         num_units_per_layer[1:])]
+            biases = np.random.randn(sum(num_units_per_layer))
+
+            log_partition = get_bm_theo_brute_force(
+                    get_dense_parameters(layer_weights, num_units_per_layer),
+                    biases)[1]
+
+            self.assertEstimate(sbs.inference.ais_log_partition_rbm(
+                layer_weights, biases, num_units_per_layer, num_chains=100,
+                betas=sbs.inference.get_ais_betas(1000)), log_partition)
+
+    def test_rbm_log_likelihood(self):
+        num_units_per_layer = [4, 3]
+        layer_weights = [np.random.randn(4, 3)]
+        biases = np.random.randn(7)
+
+        joint, log_partition, _ = get_bm_theo_brute_force(
+                get_dense_parameters(layer_weights, num_units_per_layer),
+                biases)
+        joint_visible = joint.reshape(16, -1).sum(axis=1)
+
+        visible_states = sbs.inference.get_states_from_idx(
+                np.arange(16), 4)
+
+        self.assertTrue(np.allclose(
+            [sbs.inference.get_rbm_log_likelihood(
+                layer_weights, biases, num_units_per_layer, vs[None, :],
+                log_partition) for vs in visible_states],
+            np.log(joint_visible)))
+
+    def test_network(self):
+        nparams = sbs.db.NeuronParametersConductanceExponential()
+
+        bm = sbs.network.ThoroughBM(num_samplers=6,
+                                    sampler_config=[nparams] * 6)
+        weights = np.random.randn(6, 6)
+        bm.weights_theo = (weights + weights.T) / 2.
+        bm.biases_theo = np.random.randn(6)
+
+        self.assertEstimate(
+            bm.estimate_log_partition(
+                betas=sbs.inference.get_ais_betas(1000)),
+            sbs.cutils.get_bm_log_partition_theo(bm.weights_theo,
+                                                 bm.biases_theo))
+
+        rbm = sbs.network.ThoroughRBM(num_units_per_layer=[3, 4],
+                                      sampler_config=[nparams] * 7)
+        layer_weights = [np.random.randn(3, 4)]
+        rbm.weights_theo = list(layer_weights)
+        rbm.biases_theo = np.random.randn(7)
+
+        self.assertEstimate(
+            rbm.estimate_log_partition(
+                betas=sbs.inference.get_ais_betas(1000)),
+            sbs.inference.get_rbm_moments_theo(
+                layer_weights, rbm.biases_theo, [3, 4])[0])
+
+
+class TestGibbsSampling(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def get_joint_sampled(self, samples):
+        num_units = samples.shape[-1]
+        state_idx = samples.reshape(-1, num_units).dot(
+                1 << np.arange(num_units - 1, -1, -1))
+        return np.bincount(state_idx, minlength=1 << num_units)\
+            / float(len(state_idx))
+
+    def test_bm(self):
+        weights = np.random.randn(5, 5)
+        weights = (weights + weights.T) / 2.
+        biases = np.random.randn(5)
+
+        joint = sbs.cutils.get_bm_joint_theo(weights, biases)
+
+        samples = sbs.inference.sample_gibbs_bm(
+                weights, biases, num_samples=20, num_chains=1000,
+                num_burn_in=20, sweeps_per_sample=2,
+                selected_idx=np.array([3, 1]))
+
+        self.assertEqual(samples.shape, (1000, 20, 2))
+        self.assertEqual(samples.dtype, np.int)
+        self.assertTrue(np.abs(self.get_joint_sampled(samples)
+                               - joint.sum(axis=(0, 2, 4)).T.reshape(-1)
+                               ).max() < .02)
+
+    def test_rbm(self):
+        num_units_per_layer = [3, 4, 2]
+        layer_weights = [np.random.randn(3, 4), np.random.randn(4, 2)]
+        biases = np.random.randn(9)
+
+        joint = get_bm_theo_brute_force(
+                get_dense_parameters(layer_weights, num_units_per_layer),
+                biases)[0]
+
+        samples = sbs.inference.sample_gibbs_rbm(
+                layer_weights, biases, num_units_per_layer, num_samples=20,
+                num_chains=1000, num_burn_in=20)
+
+        self.assertEqual(samples.shape, (1000, 20, 9))
+        self.assertTrue(np.abs(
+            self.get_joint_sampled(samples[:, :, :3])
+            - joint.reshape(8, -1).sum(axis=1)).max() < .02)
+
+    def test_network(self):
+        nparams = sbs.db.NeuronParametersConductanceExponential()
+
+        bm = sbs.network.ThoroughBM(num_samplers=4,
+                                    sampler_config=[nparams] * 4)
+        weights = np.random.randn(4, 4)
+        bm.weights_theo = (weights + weights.T) / 2.
+        bm.biases_theo = np.random.randn(4)
+        bm.selected_sampler_idx = np.array([0, 2])
+
+        states = bm.get_gibbs_sample_states(20000, num_burn_in=10)
+        self.assertEqual(states.shape, (20000, 2))
+        self.assertTrue(np.abs(states.mean(axis=0) - bm.dist_marginal_theo)
+                        .max() < .03)
+
+        samples = bm.get_gibbs_sample_states(10, num_chains=5)
+        self.assertEqual(samples.shape, (5, 10, 2))
+
+        rbm = sbs.network.ThoroughRBM(num_units_per_layer=[3, 4],
+                                      sampler_config=[nparams] * 7)
+        rbm.weights_theo = [np.random.randn(3, 4)]
+        rbm.biases_theo = np.random.randn(7)
+
+        samples = rbm.get_gibbs_sample_states(10, num_chains=2000,
+                                              num_burn_in=20)
+        self.assertEqual(samples.shape, (2000, 10, 7))
+        self.assertTrue(np.abs(samples.mean(axis=(0, 1))
+                               - rbm.dist_marginal_theo).max() < .03)
+
+
+class TestApproximateMarginals(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def get_random_parameters(self, num_dims, scale):
+        weights = np.random.randn(num_dims, num_dims) * scale
+        weights = (weights + weights.T) / 2.
+        np.fill_diagonal(weights, 0.)
+        biases = np.random.randn(num_dims)
+        return weights, biases
+
+    def test_weak_coupling(self):
+        weights, biases = self.get_random_parameters(10, scale=.1)
+        marginals = sbs.cutils.get_bm_marginal_theo(weights, biases,
+                                                    np.arange(10))
+
+        errors = {}
+        for method in ["mf", "tap", "bp"]:
+            approx = sbs.inference.get_marginals_approx(weights, biases,
+                                                        method=method)
+            errors[method] = np.abs(approx - marginals).max()
+            self.assertTrue(errors[method] < 1e-2)
+
+        # TAP corrects mean field to second order
+        self.assertTrue(errors["tap"] < errors["mf"])
+
+    def test_tree(self):
+        # belief propagation is exact on trees
+        num_units_per_layer = [1, 3, 5]
+        layer_weights = [np.random.randn(1, 3), np.zeros((3, 5))]
+        for i in range(5):
+            layer_weights[1][i % 3, i] = np.random.randn()
+        biases = np.random.randn(9)
+
+        weights = sbs.inference.get_dense_weights(layer_weights,
+                                                  num_units_per_layer)
+        marginals = get_bm_theo_brute_force(weights, biases)[2]
+
+        self.assertTrue(np.allclose(sbs.inference.get_marginals_loopy_bp(
+            weights, biases), marginals))
+
+    def test_network(self):
+        nparams = sbs.db.NeuronParametersConductanceExponential()
+
+        bm = sbs.network.ThoroughBM(num_samplers=8,
+                                    sampler_config=[nparams] * 8)
+        bm.weights_theo, bm.biases_theo = self.get_random_parameters(8, .1)
+        bm.selected_sampler_idx = np.array([1, 5])
+
+        self.assertTrue(np.abs(bm.dist_marginal_approx
+                               - bm.dist_marginal_theo).max() < 1e-2)
+
+        approx_tap = bm.dist_marginal_approx
+        bm.approx_inference_method = "mf"
+        self.assertFalse(np.all(approx_tap == bm.dist_marginal_approx))
+
+        rbm = sbs.network.ThoroughRBM(num_units_per_layer=[3, 4],
+                                      sampler_config=[nparams] * 7)
+        rbm.weights_theo = [np.random.randn(3, 4) * .1]
+        rbm.biases_theo = np.random.randn(7)
+
+        self.assertTrue(np.abs(rbm.dist_marginal_approx
+                               - rbm.dist_marginal_theo).max() < 1e-2)
+
+
+class TestBatchedTheoDistributions(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def test_batch(self):
+        num_sets, num_dims = 5, 6
+        # asymmetric weights with diagonal and one set with huge exponents
+        weights = np.random.randn(num_sets, num_dims, num_dims)
+        biases = np.random.randn(num_sets, num_dims)
+        weights[-1] *= 300.
+        biases[-1] *= 300.
+
+        log_partitions, marginals = sbs.inference.get_bm_moments_theo_batch(
+                weights, biases, chunk_size=16)
+        joints = sbs.inference.get_bm_joint_theo_batch(weights, biases,
+                                                       chunk_size=16)
+
+        self.assertEqual(joints.shape, (num_sets,) + (2,) * num_dims)
+
+        for i in xrange(num_sets):
+            joint, log_partition, marg = get_bm_theo_brute_force(
+                    weights[i], biases[i])
+            self.assertTrue(np.isclose(log_partitions[i], log_partition))
+            self.assertTrue(np.allclose(marginals[i], marg))
+            self.assertTrue(np.allclose(joints[i], joint))
+
+        self.assertTrue(np.allclose(
+            sbs.inference.get_bm_log_partition_theo_batch(weights[0],
+                                                          biases[0]),
+            log_partitions[:1]))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+
+from __future__ import print_function
+
+import unittest
+import numpy as np
+
+import sbs
+
+
+def get_bm_joint_sim_brute_force(spike_ids, spike_times, sampler_idx,
+                                 tau_refrac_pss, duration):
+    """
+        Reference implementation evaluating the state of the selected samplers
+        in between any two consecutive events.
+    """
+    num_selected = len(sampler_idx)
+    selected = np.in1d(spike_ids, sampler_idx)
+    spike_ids, spike_times = spike_ids[selected], spike_times[selected]
+    tau = tau_refrac_pss[np.searchsorted(sampler_idx, spike_ids)]
+
+    events = np.unique(np.r_[0., spike_times, spike_times + tau, duration])
+    events = events[events <= duration]
+
+    joint = np.zeros(1 << num_selected)
+    for t_start, t_stop in zip(events[:-1], events[1:]):
+        t_mid = .5 * (t_start + t_stop)
+        active = (spike_times <= t_mid) & (t_mid < spike_times + tau)
+        state = np.zeros(num_selected, dtype=int)
+        state[np.searchsorted(sampler_idx, spike_ids[active])] = 1
+        joint[state.dot(1 << np.arange(num_selected - 1, -1, -1))] +=\
+            t_stop - t_start
+
+    return joint.reshape([2] * num_selected) / duration
+
+
+class TestJointSim(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def get_random_spikes(self, num_samplers, num_spikes, duration,
+                          round_times=False):
+        spike_times = np.sort(np.random.rand(num_spikes) * duration)
+        if round_times:
+            # provoke simultaneous events
+            spike_times = np.round(spike_times)
+        spike_ids = np.random.randint(0, num_samplers, num_spikes)
+        return spike_ids, spike_times
+
+    def test_random(self):
+        for round_times in [False, True]:
+            spike_ids, spike_times = self.get_random_spikes(
+                    10, 200, 100., round_times=round_times)
+            sampler_idx = np.array([1, 4, 5, 8])
+            tau_refrac_pss = np.array([3., 10., 5., 7.])
+
+            expected = get_bm_joint_sim_brute_force(
+                    spike_ids, spike_times, sampler_idx, tau_refrac_pss,
+                    100.)
+
+            for dtype in [np.int32, np.int64]:
+                joint = sbs.cutils.get_bm_joint_sim(
+                        spike_ids.astype(dtype), spike_times, sampler_idx,
+                        tau_refrac_pss, 100.)
+                self.assertTrue(np.allclose(joint, expected))
+
+    def test_spikes_after_duration(self):
+        spike_ids = np.array([0, 1, 0])
+        spike_times = np.array([10., 95., 150.])
+
+        joint = sbs.cutils.get_bm_joint_sim(
+                spike_ids, spike_times, np.array([0, 1]), np.array([20., 20.]),
+                100.)
+        self.assertTrue(np.allclose(joint, [[.75, .05], [.2, 0.]]))
+
+    def test_no_spikes(self):
+        joint = sbs.cutils.get_bm_joint_sim(
+                np.array([], dtype=int), np.array([]), np.array([0, 1]),
+                np.array([1., 1.]), 10.)
+        self.assertTrue(np.allclose(joint, [[1., 0.], [0., 0.]]))
+
+    def test_sparse(self):
+        spike_ids, spike_times = self.get_random_spikes(100, 2000, 1000.,
+                                                        round_times=True)
+
+        sampler_idx = np.array([3, 17, 42, 64, 99])
+        tau_refrac_pss = np.random.rand(5) * 10. + 1.
+
+        joint = sbs.cutils.get_bm_joint_sim(
+                spike_ids, spike_times, sampler_idx, tau_refrac_pss, 1000.)
+        states, probs = sbs.cutils.get_bm_joint_sim_sparse(
+                spike_ids, spike_times, sampler_idx, tau_refrac_pss, 1000.)
+
+        self.assertTrue(np.all(np.diff(probs) <= 0.))
+        self.assertTrue(np.all(probs > 0.))
+
+        state_idx = states.astype(int).dot(1 << np.arange(4, -1, -1))
+        self.assertEqual(len(np.unique(state_idx)), len(state_idx))
+
+        joint_sparse = np.zeros(32)
+        joint_sparse[state_idx] = probs
+        self.assertTrue(np.allclose(joint_sparse, joint.reshape(-1)))
+
+    def test_sparse_many_samplers(self):
+        # more selected samplers than fit into a single word
+        spike_ids, spike_times = self.get_random_spikes(150, 5000, 1000.)
+        sampler_idx = np.arange(150)
+        tau_refrac_pss = np.ones(150) * 20.
+
+        states, probs = sbs.cutils.get_bm_joint_sim_sparse(
+                spike_ids, spike_times, sampler_idx, tau_refrac_pss, 1000.)
+
+        self.assertEqual(states.shape[1], 150)
+        self.assertTrue(np.isclose(probs.sum(), 1.))
+
+        # the marginals follow from the time spent in the refractory period
+        marginals = probs.dot(states)
+        for i in [0, 70, 149]:
+            expected = get_bm_joint_sim_brute_force(
+                    spike_ids, spike_times, np.array([i]),
+                    tau_refrac_pss[:1], 1000.)[1]
+            self.assertTrue(np.isclose(marginals[i], expected))
+
+    def test_checkpoints(self):
+        spike_ids, spike_times = self.get_random_spikes(10, 500, 300.,
+                                                        round_times=True)
+        sampler_idx = np.array([0, 3, 6, 9])
+        tau_refrac_pss = np.array([4., 10., 5., 7.])
+        checkpoints = np.array([.5, 10., 10., 57.3, 100., 299.])
+
+        marginals, joints = sbs.cutils.get_bm_sim_checkpoints(
+                spike_ids, spike_times, sampler_idx, tau_refrac_pss,
+                checkpoints)
+        self.assertEqual(marginals.shape, (6, 4))
+        self.assertEqual(joints.shape, (6, 2, 2, 2, 2))
+
+        for cp, marginal, joint in zip(checkpoints, marginals, joints):
+            expected = sbs.cutils.get_bm_joint_sim(
+                    spike_ids, spike_times, sampler_idx, tau_refrac_pss, cp)
+            self.assertTrue(np.allclose(joint, expected))
+            self.assertTrue(np.allclose(marginal, [
+                expected.sum(axis=tuple(j for j in xrange(4) if j != i))[1]
+                for i in xrange(4)]))
+
+        marginals_only, no_joints = sbs.cutils.get_bm_sim_checkpoints(
+                spike_ids, spike_times, sampler_idx, tau_refrac_pss,
+                checkpoints, joint=False)
+        self.assertIsNone(no_joints)
+        self.assertTrue(np.allclose(marginals_only, marginals))
+
+    def test_subsets(self):
+        spike_ids, spike_times = self.get_random_spikes(8, 400, 200.,
+                                                        round_times=True)
+        tau_refracs = np.random.rand(8) * 10. + 1.
+        subsets = [[0, 1], [5, 2], [7], [3, 6, 1, 4], [2, 5]]
+
+        joints = sbs.cutils.get_bm_joint_sim_subsets(
+                spike_ids, spike_times, subsets, tau_refracs, 200.)
+        self.assertEqual(len(joints), len(subsets))
+
+        for subset, joint in zip(subsets, joints):
+            sampler_idx = np.sort(subset)
+            expected = sbs.cutils.get_bm_joint_sim(
+                    spike_ids, spike_times, sampler_idx,
+                    tau_refracs[sampler_idx], 200.)
+            # axes follow the order within the subset
+            expected = expected.transpose(np.argsort(np.argsort(subset)))
+            self.assertTrue(np.allclose(joint, expected))
+
+        self.assertEqual(sbs.cutils.get_bm_joint_sim_subsets(
+            spike_ids, spike_times, [], tau_refracs, 200.), [])
+
+    def test_dkl_convergence(self):
+        num_samplers = 3
+        bm = sbs.network.ThoroughBM(
+                num_samplers=num_samplers,
+                sampler_config=[sbs.db.NeuronParametersConductanceExponential(
+                    tau_refrac=10.)] * num_samplers)
+        bm.weights_theo = np.zeros((num_samplers, num_samplers))
+        bm.biases_theo = np.zeros(num_samplers)
+
+        # independent samplers with p_on = 1/2 (one refractory period on,
+        # one off)
+        spike_times = np.arange(0., 10000., 20.)
+        bm.spike_data = {
+            "spiketrains": [spike_times + offset
+                            for offset in [0., 5., 10.]],
+            "duration": 10000.,
+        }
+
+        checkpoints, dkl_marginal, dkl_joint = bm.get_dkl_convergence(
+                checkpoints=[100., 1000., 10000.])
+
+        self.assertTrue(np.allclose(dkl_marginal, 0.))
+        self.assertTrue(np.isclose(dkl_joint[-1], sbs.utils.dkl(
+            bm.dist_joint_theo.flatten(), bm.dist_joint_sim.flatten())))
+
+        pair_joints = bm.get_dist_joint_sim_subsets([[0, 1], [2, 0]])
+        self.assertTrue(np.allclose(pair_joints[0], [[.25, .25], [.25, .25]]))
+        # samplers 0 and 2 take turns
+        self.assertTrue(np.allclose(pair_joints[1], [[0., .5], [.5, 0.]]))
+
+        checkpoints, dkl_marginal, dkl_joint = bm.get_dkl_convergence(
+                num_checkpoints=5, joint=False)
+        self.assertEqual(len(checkpoints), 5)
+        self.assertTrue(np.isclose(checkpoints[-1], 10000.))
+        self.assertIsNone(dkl_joint)
@@ -81,3 +81,35 @@ class TestPairwiseCorrelations(unittest.TestCase):
                              [0.5, 0.5, 0.5]])
 
         self.assertTrue(np.allclose(result, expected))
+
+    def test_against_joint(self):
+        # correlations have to match the second moments of the joint
+        np.random.seed(42)
+        duration = 500.
+        tau = np.array([10., 25., 5., 17.])
+        spike_times = [np.sort(np.round(np.random.rand(40) * duration))
+                       for i in range(4)]
+
+        for ignore_until in [0., 120.]:
+            result = sbs.utils.get_pairwise_correlations(
+                    spike_times, tau, duration, ignore_until=ignore_until)
+
+            spikes = sbs.utils.get_ordered_spike_idx(spike_times)
+            joint_all = sbs.cutils.get_bm_joint_sim(
+                    np.require(spikes["id"], requirements=["C"]),
+                    np.require(spikes["t"], requirements=["C"]),
+                    np.arange(4), tau, duration)
+            joint_before = sbs.cutils.get_bm_joint_sim(
+                    np.require(spikes["id"], requirements=["C"]),
+                    np.require(spikes["t"], requirements=["C"]),
+                    np.arange(4), tau, ignore_until)\
+                if ignore_until > 0. else np.zeros_like(joint_all)
+
+            joint = (joint_all * duration - joint_before * ignore_until)\
+                / (duration - ignore_until)
+
+            states = np.array(list(np.ndindex(*joint.shape)))
+            expected = np.einsum("s,si,sj->ij", joint.reshape(-1),
+                                 states, states)
+
+            self.assertTrue(np.allclose(result, expected))
@@ -6,6 +6,8 @@
     Some tests based on tutorial functions
 """
 
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
@@ -133,3 +135,63 @@ class TestBasics(unittest.TestCase):
         spikes2 = bm.ordered_spikes
 
         self.assertTrue(spikes1 != spikes2)
+
+    def _create_network(self):
+        """
+            Random network of calibrated samplers (see test_01_calibration).
+        """
+        np.random.seed(4215123)
+        sampler_config = sbs.db.SamplerConfiguration.load(
+                "test-calibration-cond.json")
+        bm = sbs.network.ThoroughBM(
+                num_samplers=5, sim_name=sim_name,
+                sampler_config=sampler_config)
+        weights = np.random.randn(bm.num_samplers, bm.num_samplers)
+        bm.weights_theo = (weights + weights.T) / 2.
+        bm.biases_theo = np.random.randn(bm.num_samplers)
+        return bm
+
+    def test_record_selected(self):
+        """
+            Recording only the selected samplers yields the same spikes for
+            them as recording all samplers.
+        """
+        bm = self._create_network()
+
+        bm.gather_spikes(duration=1e4, dt=0.1, burn_in_time=500.,
+                         sim_setup_kwargs={"rng_seeds": [42424242]})
+        bm.selected_sampler_idx = [1, 3]
+        selected = bm.selected_sampler_spike_data
+
+        bm.gather_spikes(duration=1e4, dt=0.1, burn_in_time=500.,
+                         sim_setup_kwargs={"rng_seeds": [42424242]},
+                         record_selected_only=True)
+        self.assertTrue(np.all(bm.spike_data.spike_counts[[0, 2, 4]] == 0))
+        recorded = bm.selected_sampler_spike_data
+        self.assertTrue(np.all(recorded.ids == selected.ids))
+        self.assertTrue(np.allclose(recorded.times, selected.times))
+
+    def test_chunked_gathering(self):
+        """
+            Draining the spikes in chunks does not change them.
+        """
+        bm = self._create_network()
+
+        bm.gather_spikes(duration=1e4, dt=0.1, burn_in_time=500.,
+                         sim_setup_kwargs={"rng_seeds": [42424242]})
+        spike_data = bm.spike_data
+        joint = bm.dist_joint_sim
+
+        directory = tempfile.mkdtemp()
+        try:
+            bm.gather_spikes(duration=1e4, dt=0.1, burn_in_time=500.,
+                             sim_setup_kwargs={"rng_seeds": [42424242]},
+                             chunk_duration=3e3, spike_directory=directory)
+            self.assertIsInstance(bm.spike_data.times, np.memmap)
+            self.assertTrue(np.all(bm.spike_data.spike_counts
+                                   == spike_data.spike_counts))
+            self.assertTrue(np.allclose(bm.spike_data.times, spike_data.times))
+            # the memory-mapped spikes can be analysed as usual
+            self.assertTrue(np.allclose(bm.dist_joint_sim, joint))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+
+from __future__ import print_function
+
+import unittest
+import numpy as np
+
+import sbs
+
+
+def generate_states_reference(spike_ids, spike_times, tau_refrac_pss,
+                              num_samplers, steps_per_sample, duration):
+    """
+        Reference implementation stepping through all sampling times.
+    """
+    num_samples = duration // steps_per_sample
+    last_spiketimes = np.zeros(num_samplers, dtype=int) - 2147483647
+    samples = np.zeros((num_samples, num_samplers), dtype=int)
+
+    i_spike = 0
+    for i_sample in range(num_samples):
+        current_step = i_sample * steps_per_sample
+        while i_spike < len(spike_ids)\
+                and spike_times[i_spike] <= current_step:
+            last_spiketimes[spike_ids[i_spike]] = spike_times[i_spike]
+            i_spike += 1
+        samples[i_sample] = current_step - last_spiketimes < tau_refrac_pss
+
+    return samples
+
+
+class TestSampleStates(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def test_generate_states(self):
+        num_samplers = 13
+        spike_times = np.sort(np.random.randint(0, 5000, 2000))
+        spike_ids = np.random.randint(0, num_samplers, 2000)
+        tau_refrac_pss = np.random.randint(1, 100, num_samplers)
+
+        for steps_per_sample in [1, 7, 100]:
+            expected = generate_states_reference(
+                    spike_ids, spike_times, tau_refrac_pss, num_samplers,
+                    steps_per_sample, 5000)
+
+            states = sbs.cutils.generate_states(
+                    spike_ids, spike_times, tau_refrac_pss, num_samplers,
+                    steps_per_sample, 5000)
+            self.assertEqual(states.dtype, np.int)
+            self.assertTrue(np.all(states == expected))
+
+            packed = sbs.cutils.generate_states(
+                    spike_ids, spike_times, tau_refrac_pss, num_samplers,
+                    steps_per_sample, 5000, packed=True)
+            self.assertEqual(packed.dtype, np.uint8)
+            self.assertEqual(packed.shape, (len(expected), 2))
+            self.assertTrue(np.all(packed == np.packbits(expected, axis=1)))
+
+            unpacked = sbs.cutils.unpack_states(packed, num_samplers)
+            self.assertEqual(unpacked.dtype, np.bool_)
+            self.assertTrue(np.all(unpacked == expected))
+
+    def test_accumulator(self):
+        spike_times = np.sort(np.random.randint(0, 1000, 500))
+        spike_ids = np.random.randint(0, 20, 500)
+        tau_refrac_pss = np.random.randint(1, 30, 20)
+
+        expected = sbs.cutils.generate_states(
+                spike_ids, spike_times, tau_refrac_pss, 20, 4, 1000,
+                packed=True)
+
+        acc = sbs.cutils.StateAccumulator(
+                np.arange(20), tau_refrac_pss.astype(float), 4., packed=True)
+        acc.add_spikes(spike_ids, spike_times.astype(float))
+        self.assertTrue(np.all(acc.finalize(1000.) == expected))
+
+    def test_selected_sampler_spikes(self):
+        num_samplers = 6
+        bm = sbs.network.ThoroughBM(
+                num_samplers=num_samplers,
+                sampler_config=[sbs.db.NeuronParametersConductanceExponential(
+                    tau_refrac=10.)] * num_samplers)
+        bm.spike_data = {
+            "spiketrains": [np.sort(np.random.rand(50) * 1000.)
+                            for i in xrange(num_samplers)],
+            "duration": 1000.,
+        }
+
+        for selected_idx in [[4, 1], range(num_samplers), [5]]:
+            bm.selected_sampler_idx = selected_idx
+            spikes = bm.selected_sampler_spike_data
+            ssi = bm.selected_sampler_idx
+
+            self.assertEqual(len(spikes), 50 * len(ssi))
+            self.assertTrue(np.all(np.diff(spikes.times) >= 0.))
+            records = bm.selected_sampler_spikes
+            self.assertTrue(np.all(records["id"] == spikes.ids))
+            self.assertTrue(np.all(records["t"] == spikes.times))
+            for i, idx in enumerate(ssi):
+                self.assertTrue(np.all(spikes.times[spikes.ids == i]
+                                       == bm.spike_data["spiketrains"][idx]))
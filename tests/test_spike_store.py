@@ -0,0 +1,191 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+
+from __future__ import print_function
+
+import json
+import os
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import sbs
+
+
+class TestSpikeStore(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.directory = tempfile.mkdtemp()
+        self.spike_data = sbs.spikes.SpikeData.from_spiketrains(
+                [np.sort(np.random.rand(n) * 1000.) for n in [300, 0, 500]],
+                1000., dt=.1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSpikeDataEqual(self, first, second):
+        self.assertTrue(np.all(first.ids == second.ids))
+        self.assertTrue(np.all(first.times == second.times))
+        self.assertEqual(first.num_neurons, second.num_neurons)
+        self.assertEqual(first.duration, second.duration)
+        self.assertEqual(first.dt, second.dt)
+
+    def test_memory_mapped(self):
+        sbs.io.save_spike_data(self.spike_data, self.directory)
+        loaded = sbs.io.load_spike_data(self.directory)
+
+        self.assertIsInstance(loaded.times, np.memmap)
+        self.assertSpikeDataEqual(loaded, self.spike_data)
+
+        window = sbs.io.SpikeStore(self.directory).load_time_window(
+                200., 300.)
+        self.assertIsInstance(window.times, np.memmap)
+        self.assertSpikeDataEqual(
+                window, self.spike_data.get_time_window(200., 300.))
+
+    def test_read_only_analysis(self):
+        store = sbs.io.SpikeStore.write(self.spike_data, self.directory)
+
+        bm = sbs.network.ThoroughBM(
+                num_samplers=3,
+                sampler_config=[sbs.db.NeuronParametersConductanceExponential(
+                    tau_refrac=10.)] * 3)
+        bm.spike_data = self.spike_data
+        joint = bm.dist_joint_sim
+        correlations = bm.correlations_sim
+
+        bm.load_spike_data(self.directory, mmap_mode="r")
+        self.assertFalse(bm.spike_data.times.flags.writeable)
+        self.assertTrue(np.allclose(bm.dist_joint_sim, joint))
+        self.assertTrue(np.allclose(bm.correlations_sim, correlations))
+
+        acc = sbs.cutils.JointAccumulator(np.array([0, 2]),
+                                          np.array([10., 10.]))
+        acc.add_spike_chunks(store.iter_chunks(chunk_size=100))
+        self.assertTrue(np.allclose(acc.finalize(1000.),
+                                    joint.sum(axis=1)))
+
+    def test_compressed(self):
+        store = sbs.io.SpikeStore.write(self.spike_data, self.directory,
+                                        compress=True, chunk_size=100)
+        self.assertEqual(len(store.metadata["chunks"]), 8)
+        self.assertFalse(osp.exists(osp.join(self.directory, "times.npy")))
+
+        self.assertSpikeDataEqual(store.load(), self.spike_data)
+        self.assertSpikeDataEqual(
+                store.load_time_window(200., 300.),
+                self.spike_data.get_time_window(200., 300.))
+
+        acc = sbs.cutils.JointAccumulator(np.array([0, 2]),
+                                          np.array([5., 5.]))
+        acc.add_spike_chunks(store.iter_chunks())
+        self.assertTrue(np.allclose(
+            acc.finalize(1000.),
+            sbs.cutils.get_bm_joint_sim(
+                self.spike_data.ids, self.spike_data.times, np.array([0, 2]),
+                np.array([5., 5.]), 1000.)))
+
+    def test_chunks_t_start(self):
+        # spike times on the grid of dt so that they can be varint-encoded
+        spike_data = sbs.spikes.SpikeData.from_spiketrains(
+                [np.unique(np.random.randint(0, 10000, n)) * .1
+                 for n in [300, 0, 500]], 1000., dt=.1)
+        window = spike_data.get_time_window(200., 1000.)
+        expected = sbs.cutils.get_bm_joint_sim(
+                window.ids, window.relative_times, np.array([0, 2]),
+                np.array([5., 5.]), 800.)
+
+        for compress in [False, "zlib", "varint"]:
+            store = sbs.io.SpikeStore.write(
+                    window, osp.join(self.directory, str(compress)),
+                    compress=compress, chunk_size=100)
+            acc = sbs.cutils.JointAccumulator(np.array([0, 2]),
+                                              np.array([5., 5.]))
+            acc.add_spike_chunks(store.iter_chunks(chunk_size=100))
+            self.assertTrue(np.allclose(acc.finalize(800.), expected))
+
+    def test_network(self):
+        bm = sbs.network.ThoroughBM(
+                num_samplers=3,
+                sampler_config=[sbs.db.NeuronParametersConductanceExponential(
+                    tau_refrac=10.)] * 3)
+        bm.spike_data = self.spike_data
+        marginals = bm.dist_marginal_sim
+
+        bm.save_spike_data(self.directory)
+        bm.save(osp.join(self.directory, "bm.pkl"), include_spike_data=False)
+
+        # the original network keeps its spikes
+        self.assertTrue(np.all(bm.dist_marginal_sim == marginals))
+
+        loaded = sbs.network.ThoroughBM.load(
+                osp.join(self.directory, "bm.pkl"))
+        self.assertIsNone(loaded.spike_data)
+
+        loaded.load_spike_data(self.directory)
+        self.assertTrue(np.allclose(loaded.dist_marginal_sim, marginals))
+
+    def test_varint(self):
+        spike_data = sbs.spikes.SpikeData.from_spiketrains(
+                [np.sort(np.random.choice(10000, n, replace=False)) * .1
+                 for n in [300, 0, 500]], 1000., dt=.1)
+        store = sbs.io.SpikeStore.write(spike_data, self.directory,
+                                        compress="varint")
+        self.assertEqual(store.compression, "varint")
+
+        loaded = store.load()
+        self.assertTrue(np.all(loaded.ids == spike_data.ids))
+        self.assertTrue(np.allclose(loaded.times, spike_data.times))
+
+        window = store.load_time_window(200., 300.)
+        self.assertTrue(np.allclose(
+            window.times, spike_data.get_time_window(200., 300.).times))
+
+        with self.assertRaises(ValueError):
+            sbs.io.SpikeStore.write(spike_data, self.directory,
+                                    compress="lzma")
+
+    def test_writer(self):
+        for compress in [False, True]:
+            directory = osp.join(self.directory, "writer-{}".format(compress))
+            writer = sbs.io.SpikeStoreWriter(directory, 3, dt=.1,
+                                             compress=compress)
+            for t_start in np.arange(0., 1000., 150.):
+                window = self.spike_data.get_time_window(t_start,
+                                                         t_start + 150.)
+                writer.append(window.ids, window.times)
+
+            with self.assertRaises(ValueError):
+                writer.append(np.array([0]), np.array([10.]))
+
+            store = writer.close(1000.)
+            self.assertEqual(store.compression,
+                             "zlib" if compress else "none")
+            self.assertFalse(osp.exists(osp.join(directory, "ids.tmp")))
+            self.assertSpikeDataEqual(store.load(), self.spike_data)
+
+    def test_overwrite(self):
+        sbs.io.SpikeStore.write(self.spike_data, self.directory,
+                                compress=True, chunk_size=100)
+
+        # numpy scalars that are not float64 are serialised as well
+        self.spike_data.dt = np.float32(.1)
+        store = sbs.io.SpikeStore.write(self.spike_data, self.directory)
+        self.assertEqual(store.compression, "none")
+        self.assertFalse(any(filename.startswith("chunk-")
+                             for filename in os.listdir(self.directory)))
+        self.assertTrue(np.all(store.load().times == self.spike_data.times))
+
+    def test_format_version(self):
+        directory = osp.join(self.directory, "version")
+        store = sbs.io.SpikeStore.write(self.spike_data, directory)
+
+        metadata = dict(store.metadata,
+                        format_version=sbs.io.SpikeStore.format_version + 1)
+        with open(osp.join(directory, "meta.json"), "w") as f:
+            json.dump(metadata, f)
+        with self.assertRaises(IOError):
+            sbs.io.SpikeStore(directory)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+
+from __future__ import print_function
+
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import sbs
+
+
+class TestSpikeStreamAccumulators(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+        self.duration = 1000.
+        num_spikes = 1000
+        self.spike_times = np.sort(np.round(
+            np.random.rand(num_spikes) * self.duration))
+        self.spike_ids = np.random.randint(0, 10, num_spikes)
+        self.sampler_idx = np.array([1, 3, 4, 8])
+        self.tau_refrac_pss = np.array([10., 20., 5., 13.])
+
+    def iter_chunks(self, num_chunks=7):
+        bounds = np.r_[0, np.sort(np.random.randint(
+            0, len(self.spike_ids), num_chunks - 1)), len(self.spike_ids)]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            yield self.spike_ids[start:stop], self.spike_times[start:stop]
+
+    def test_joint(self):
+        expected = sbs.cutils.get_bm_joint_sim(
+                self.spike_ids, self.spike_times, self.sampler_idx.copy(),
+                self.tau_refrac_pss, self.duration)
+
+        acc = sbs.cutils.JointAccumulator(self.sampler_idx,
+                                          self.tau_refrac_pss)
+        acc.add_spike_chunks(self.iter_chunks())
+        self.assertTrue(np.allclose(acc.finalize(self.duration), expected))
+
+        # intermediate results
+        acc = sbs.cutils.JointAccumulator(self.sampler_idx,
+                                          self.tau_refrac_pss)
+        split = np.searchsorted(self.spike_times, 500.)
+        acc.add_spikes(self.spike_ids[:split], self.spike_times[:split])
+        self.assertTrue(np.allclose(acc.finalize(500.),
+                        sbs.cutils.get_bm_joint_sim(
+                            self.spike_ids, self.spike_times,
+                            self.sampler_idx.copy(), self.tau_refrac_pss,
+                            500.)))
+        acc.add_spikes(self.spike_ids[split:], self.spike_times[split:])
+        self.assertTrue(np.allclose(acc.finalize(self.duration), expected))
+
+        with self.assertRaises(ValueError):
+            acc.add_spikes(self.spike_ids[:1], self.spike_times[:1])
+
+    def test_correlations(self):
+        for ignore_until in [0., 200.]:
+            expected = sbs.cutils.get_pairwise_correlations(
+                    self.spike_ids, self.spike_times, self.sampler_idx.copy(),
+                    self.tau_refrac_pss, self.duration, ignore_until)
+
+            acc = sbs.cutils.CorrelationAccumulator(
+                    self.sampler_idx, self.tau_refrac_pss,
+                    ignore_until=ignore_until)
+            acc.add_spike_chunks(self.iter_chunks())
+
+            self.assertTrue(np.allclose(acc.finalize(self.duration),
+                                        expected))
+
+    def test_states(self):
+        lut = -np.ones(10, dtype=int)
+        lut[self.sampler_idx] = np.arange(4)
+        selected = lut[self.spike_ids] >= 0
+
+        expected = sbs.cutils.generate_states(
+                spike_ids=lut[self.spike_ids[selected]],
+                spike_times=self.spike_times[selected].astype(int),
+                tau_refrac_pss=self.tau_refrac_pss.astype(int),
+                num_samplers=4, steps_per_sample=3,
+                duration=int(self.duration))
+
+        acc = sbs.cutils.StateAccumulator(self.sampler_idx,
+                                          self.tau_refrac_pss, 3.)
+        acc.add_spike_chunks(self.iter_chunks())
+
+        self.assertTrue(np.all(acc.finalize(self.duration) == expected))
+
+    def test_current_states(self):
+        acc = sbs.cutils.SpikeStreamAccumulator(self.sampler_idx,
+                                                self.tau_refrac_pss)
+        acc.add_spikes(np.array([3, 2, 8]), np.array([0., 1., 2.]))
+        self.assertTrue(np.all(acc.finalize(10.) == [0, 1, 0, 1]))
+        self.assertTrue(np.all(acc.finalize(20.) == [0, 0, 0, 0]))
+
+    def test_memmap(self):
+        expected = sbs.cutils.get_bm_joint_sim(
+                self.spike_ids, self.spike_times, self.sampler_idx.copy(),
+                self.tau_refrac_pss, self.duration)
+
+        directory = tempfile.mkdtemp()
+        try:
+            ids_filename = osp.join(directory, "ids.bin")
+            times_filename = osp.join(directory, "times.bin")
+            self.spike_ids.tofile(ids_filename)
+            self.spike_times.tofile(times_filename)
+            spike_ids = np.memmap(ids_filename, mode="r",
+                                  dtype=self.spike_ids.dtype)
+            spike_times = np.memmap(times_filename, mode="r",
+                                    dtype=self.spike_times.dtype)
+
+            acc = sbs.cutils.JointAccumulator(self.sampler_idx,
+                                              self.tau_refrac_pss)
+            acc.add_spike_chunks(sbs.utils.iter_spike_chunks(
+                spike_ids, spike_times, chunk_size=100))
+            result = acc.finalize(self.duration)
+            del spike_ids, spike_times
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertTrue(np.allclose(result, expected))
+
+    def test_empty(self):
+        acc = sbs.cutils.JointAccumulator(self.sampler_idx,
+                                          self.tau_refrac_pss)
+        with self.assertRaises(ValueError):
+            acc.finalize()
+        self.assertTrue(np.allclose(acc.finalize(10.).ravel(),
+                                    np.r_[1., np.zeros(15)]))
+
+        acc = sbs.cutils.CorrelationAccumulator(
+                self.sampler_idx, self.tau_refrac_pss, ignore_until=200.)
+        with self.assertRaises(ValueError):
+            acc.finalize(100.)
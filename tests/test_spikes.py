@@ -0,0 +1,185 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+
+from __future__ import print_function
+
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import sbs
+
+
+class TestSpikeData(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.spiketrains = [np.sort(np.random.rand(n) * 100.)
+                            for n in [10, 0, 25, 3]]
+        self.spike_data = sbs.spikes.SpikeData.from_spiketrains(
+                self.spiketrains, 100., dt=.1)
+
+    def test_columns(self):
+        sd = self.spike_data
+        self.assertEqual(sd.num_spikes, 38)
+        self.assertEqual(sd.num_neurons, 4)
+        self.assertEqual(sd.ids.dtype, np.int32)
+        self.assertEqual(sd.times.dtype, np.float64)
+        self.assertTrue(np.all(np.diff(sd.times) >= 0.))
+        self.assertTrue(np.all(sd.spike_counts == [10, 0, 25, 3]))
+
+        unsorted = sbs.spikes.SpikeData(
+                sd.ids[::-1], sd.times[::-1], 100., is_sorted=False)
+        self.assertTrue(np.all(unsorted.times == sd.times))
+
+    def test_spiketrains(self):
+        sd = self.spike_data
+        for st, st_sd in zip(self.spiketrains, sd.spiketrains):
+            self.assertTrue(np.all(st == st_sd))
+
+        # per-neuron trains are views into the CSR columns
+        self.assertTrue(sd.get_spiketrain(2).base is sd.neuron_times)
+
+        # dictionary interface
+        self.assertEqual(sd["duration"], 100.)
+        self.assertEqual(sd.get("dt", 1.), .1)
+        self.assertTrue("spiketrains" in sd)
+        self.assertFalse("foo" in sd)
+
+        converted = sbs.spikes.as_spike_data(
+                {"spiketrains": self.spiketrains, "duration": 100.})
+        self.assertTrue(np.all(converted.ids == sd.ids))
+        self.assertIsNone(converted.get("dt"))
+
+    def test_time_window(self):
+        sd = self.spike_data
+        window = sd.get_time_window(20., 50.)
+
+        self.assertEqual(window.duration, 30.)
+        self.assertTrue(np.may_share_memory(window.times, sd.times))
+        self.assertTrue(np.all((window.times >= 20.) & (window.times < 50.)))
+        self.assertEqual(window.num_spikes,
+                         np.sum((sd.times >= 20.) & (sd.times < 50.)))
+        self.assertTrue(np.all(window.relative_times == window.times - 20.))
+
+    def test_select_neurons(self):
+        selected = self.spike_data.select_neurons([3, 0])
+
+        self.assertEqual(selected.num_neurons, 2)
+        self.assertTrue(np.all(selected.spiketrains[0] == self.spiketrains[3]))
+        self.assertTrue(np.all(selected.spiketrains[1] == self.spiketrains[0]))
+
+    def test_pairwise_correlations(self):
+        tau_refs = np.array([5., 2., 7., 3.])
+        self.assertTrue(np.allclose(
+            sbs.utils.get_pairwise_correlations(
+                self.spike_data, tau_refs, 100.),
+            sbs.utils.get_pairwise_correlations(
+                self.spiketrains, tau_refs, 100.)))
+
+
+class TestEncodedSpikeData(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        # spike times on the grid of dt as recorded by NEST
+        self.spiketrains = [
+                np.sort(np.random.choice(100000, n, replace=False)) * .1
+                for n in [1000, 0, 2500, 30]]
+        self.spike_data = sbs.spikes.SpikeData.from_spiketrains(
+                self.spiketrains, 10000., dt=.1)
+        self.encoded = sbs.spikes.EncodedSpikeData.encode(
+                self.spike_data, block_size=64)
+
+    def assertSpikeDataClose(self, first, second):
+        self.assertTrue(np.all(first.spike_counts == second.spike_counts))
+        for st, st_other in zip(first.spiketrains, second.spiketrains):
+            self.assertTrue(np.allclose(st, st_other))
+        self.assertEqual(first.duration, second.duration)
+
+    def test_roundtrip(self):
+        encoded = self.encoded
+        self.assertEqual(encoded.num_spikes, self.spike_data.num_spikes)
+        self.assertEqual(encoded.num_neurons, 4)
+        # two bytes per spike at most for ISIs below 1638.4 ms
+        self.assertLessEqual(len(encoded.data), 2 * encoded.num_spikes)
+        self.assertLess(encoded.nbytes, self.spike_data.ids.nbytes
+                        + self.spike_data.times.nbytes)
+
+        self.assertSpikeDataClose(encoded.decode(), self.spike_data)
+        self.assertSpikeDataClose(sbs.spikes.as_spike_data(encoded),
+                                  self.spike_data)
+
+        for i, st in enumerate(self.spiketrains):
+            self.assertTrue(np.allclose(encoded.get_spiketrain(i), st))
+
+    def test_time_window(self):
+        for t_start, t_stop in [(0., 10000.), (1234.5, 1300.), (5000., 5000.1),
+                                (9999.9, 20000.)]:
+            self.assertSpikeDataClose(
+                    self.encoded.get_time_window(t_start, t_stop),
+                    self.spike_data.get_time_window(t_start, t_stop))
+
+        st = self.encoded.get_spiketrain(2, 3000., 3500.)
+        self.assertTrue(np.allclose(
+            st, self.spiketrains[2][(self.spiketrains[2] >= 3000.)
+                                    & (self.spiketrains[2] < 3500.)]))
+
+    def test_chunks(self):
+        acc = sbs.cutils.JointAccumulator(np.array([0, 2, 3]),
+                                          np.array([5., 5., 5.]))
+        acc.add_spike_chunks(self.encoded.iter_chunks(chunk_duration=700.))
+        self.assertTrue(np.allclose(
+            acc.finalize(10000.),
+            sbs.cutils.get_bm_joint_sim(
+                self.spike_data.ids, self.spike_data.times,
+                np.array([0, 2, 3]), np.array([5., 5., 5.]), 10000.)))
+
+        # chunk times are relative to the start of the recording
+        window = self.spike_data.get_time_window(2000., 10000.)
+        encoded = sbs.spikes.EncodedSpikeData.encode(window)
+        acc = sbs.cutils.JointAccumulator(np.array([0, 2, 3]),
+                                          np.array([5., 5., 5.]))
+        acc.add_spike_chunks(encoded.iter_chunks(chunk_duration=700.))
+        self.assertTrue(np.allclose(
+            acc.finalize(8000.),
+            sbs.cutils.get_bm_joint_sim(
+                window.ids, window.relative_times,
+                np.array([0, 2, 3]), np.array([5., 5., 5.]), 8000.)))
+
+    def test_off_grid(self):
+        spike_data = sbs.spikes.SpikeData.from_spiketrains(
+                [np.array([1., 2.55])], 10., dt=.1)
+        with self.assertRaises(ValueError):
+            sbs.spikes.EncodedSpikeData.encode(spike_data)
+
+
+class TestLegacySpikeData(unittest.TestCase):
+
+    def test_pickled_dictionary(self):
+        spike_data = sbs.spikes.SpikeData.from_spiketrains(
+                [np.sort(np.random.rand(n) * 100.) for n in [10, 0, 25]],
+                100., dt=.1)
+        bm = sbs.network.ThoroughBM(
+                num_samplers=3,
+                sampler_config=[sbs.db.NeuronParametersConductanceExponential(
+                    tau_refrac=10.)] * 3)
+        bm.spike_data = spike_data
+        marginals = bm.dist_marginal_sim
+
+        # networks used to store spike data dictionaries
+        bm.spike_data = None
+        bm._spike_data = spike_data.to_dict()
+
+        directory = tempfile.mkdtemp()
+        try:
+            filename = osp.join(directory, "bm.pkl")
+            sbs.utils.save_pickle(bm, filename)
+            loaded = sbs.network.ThoroughBM.load(filename)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertIsInstance(loaded.spike_data, sbs.spikes.SpikeData)
+        self.assertTrue(np.allclose(loaded.dist_marginal_sim, marginals))
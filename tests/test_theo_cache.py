@@ -0,0 +1,129 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+
+from __future__ import print_function
+
+import os
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import sbs
+
+
+class TestTheoCache(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.directory = tempfile.mkdtemp()
+        self.cache = sbs.io.TheoCache(directory=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_keys(self):
+        weights = np.random.randn(4, 4)
+        biases = np.random.randn(4)
+
+        key = self.cache.get_key("joint", weights, biases)
+        self.assertEqual(key, self.cache.get_key(
+            "joint", weights.copy(), biases.copy()))
+        self.assertEqual(key, self.cache.get_key(
+            "joint", np.asfortranarray(weights), biases))
+
+        self.assertNotEqual(key, self.cache.get_key("marginal", weights,
+                                                    biases))
+        self.assertNotEqual(key, self.cache.get_key("joint", weights.T,
+                                                    biases))
+        self.assertNotEqual(key, self.cache.get_key(
+            "joint", weights.reshape(2, 8), biases))
+
+    def test_get_or_compute(self):
+        value = np.random.randn(3, 2)
+        calls = []
+
+        def compute():
+            calls.append(None)
+            return value
+
+        for i in range(3):
+            self.assertTrue(np.all(value == self.cache.get_or_compute(
+                "test", [np.arange(3)], compute)))
+        self.assertEqual(len(calls), 1)
+
+        # shared between instances
+        other_cache = sbs.io.TheoCache(directory=self.directory)
+        self.assertTrue(np.all(value == other_cache.get(
+            self.cache.get_key("test", np.arange(3)))))
+
+    def test_eviction(self):
+        value = np.zeros(1000)
+        self.cache.set("first", value)
+        self.cache.set("second", value)
+
+        # make "first" the least recently used entry
+        os.utime(self.cache.get_filepath("first"), (0, 0))
+        self.cache.get("second")
+
+        entry_size = os.stat(self.cache.get_filepath("first")).st_size
+        self.cache.max_size = 2 * entry_size
+        self.cache.set("third", value)
+
+        self.assertFalse(osp.exists(self.cache.get_filepath("first")))
+        self.assertTrue(osp.exists(self.cache.get_filepath("second")))
+        self.assertTrue(osp.exists(self.cache.get_filepath("third")))
+
+    def test_network(self):
+        nparams = sbs.db.NeuronParametersConductanceExponential()
+        weights = np.random.randn(6, 6)
+        weights = (weights + weights.T) / 2.
+        biases = np.random.randn(6)
+
+        def get_bm():
+            bm = sbs.network.ThoroughBM(num_samplers=6,
+                                        sampler_config=[nparams] * 6)
+            bm.theo_cache = self.cache
+            bm.weights_theo = weights
+            bm.biases_theo = biases
+            bm.selected_sampler_idx = np.array([0, 2, 3])
+            return bm
+
+        bm = get_bm()
+        joint, marginals = bm.dist_joint_theo, bm.dist_marginal_theo
+        log_partition = bm.log_partition_theo
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+        bm = get_bm()
+        self.assertTrue(np.all(joint == bm.dist_joint_theo))
+        self.assertTrue(np.all(marginals == bm.dist_marginal_theo))
+        self.assertEqual(log_partition, bm.log_partition_theo)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+        self.assertTrue(np.isclose(
+            log_partition,
+            sbs.cutils.get_bm_log_partition_theo(bm.weights_theo, biases)))
+
+    def test_default_cache(self):
+        previous = os.environ.pop("SBS_CACHE_DIR", None)
+        try:
+            self.assertIsNone(sbs.io.get_default_theo_cache())
+
+            os.environ["SBS_CACHE_DIR"] = self.directory
+            self.assertEqual(sbs.io.get_default_theo_cache().directory,
+                             self.directory)
+
+            # the default cache is looked up on use, not on import
+            bm = sbs.network.ThoroughBM(
+                num_samplers=3,
+                sampler_config=[
+                    sbs.db.NeuronParametersConductanceExponential()] * 3)
+            bm.weights_theo = np.zeros((3, 3))
+            bm.biases_theo = np.zeros(3)
+            bm.dist_joint_theo
+            self.assertGreater(len(os.listdir(self.directory)), 0)
+        finally:
+            os.environ.pop("SBS_CACHE_DIR", None)
+            if previous is not None:
+                os.environ["SBS_CACHE_DIR"] = previous
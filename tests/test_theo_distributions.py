@@ -0,0 +1,214 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+#
+from __future__ import print_function
+
+import itertools as it
+import unittest
+import numpy as np
+
+import sbs
+
+
+def get_bm_theo_brute_force(weights, biases):
+    """
+        Reference implementation evaluating every state explicitly.
+
+        Returns joint distribution, log partition function and marginals.
+    """
+    num_dims = len(biases)
+    states = np.array(list(it.product([0, 1], repeat=num_dims)))
+    exponents = .5 * np.einsum("si,ij,sj->s", states, weights, states)\
+        + states.dot(biases)
+    probs = np.exp(exponents - exponents.max())
+    partition = probs.sum()
+    probs /= partition
+    return (probs.reshape([2] * num_dims),
+            np.log(partition) + exponents.max(),
+            states.T.dot(probs))
+
+
+class TestTheoDistributions(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def get_random_parameters(self, num_dims, scale=1.):
+        weights = np.random.randn(num_dims, num_dims) * scale
+        weights = (weights + weights.T) / 2.
+        np.fill_diagonal(weights, 0.)
+        biases = np.random.randn(num_dims) * scale
+        return weights, biases
+
+    def test_joint(self):
+        for num_dims in [1, 2, 5, 9]:
+            weights, biases = self.get_random_parameters(num_dims)
+            joint, log_partition, marginals = get_bm_theo_brute_force(
+                    weights, biases)
+
+            self.assertTrue(np.allclose(
+                sbs.cutils.get_bm_joint_theo(weights, biases), joint))
+            self.assertTrue(np.isclose(
+                sbs.cutils.get_bm_log_partition_theo(weights, biases),
+                log_partition))
+            self.assertTrue(np.isclose(
+                sbs.cutils.get_bm_partition_theo(weights, biases),
+                np.exp(log_partition)))
+
+    def test_marginal(self):
+        weights, biases = self.get_random_parameters(8)
+        joint, log_partition, marginals = get_bm_theo_brute_force(
+                weights, biases)
+
+        selected_idx = np.array([1, 4, 7])
+        self.assertTrue(np.allclose(
+            sbs.cutils.get_bm_marginal_theo(weights, biases, selected_idx),
+            marginals[selected_idx]))
+
+    def test_asymmetric_weights(self):
+        # the energy is defined via the full quadratic form
+        weights = np.random.randn(6, 6)
+        biases = np.random.randn(6)
+        joint, log_partition, marginals = get_bm_theo_brute_force(
+                weights, biases)
+
+        self.assertTrue(np.allclose(
+            sbs.cutils.get_bm_joint_theo(weights, biases), joint))
+
+    def test_large_parameters(self):
+        # exponents far beyond what a double can represent when
+        # exponentiated directly
+        weights, biases = self.get_random_parameters(8, scale=500.)
+        joint, log_partition, marginals = get_bm_theo_brute_force(
+                weights, biases)
+
+        self.assertTrue(np.allclose(
+            sbs.cutils.get_bm_joint_theo(weights, biases), joint))
+        self.assertTrue(np.isclose(
+            sbs.cutils.get_bm_log_partition_theo(weights, biases),
+            log_partition))
+        self.assertTrue(np.allclose(
+            sbs.cutils.get_bm_marginal_theo(weights, biases, np.arange(8)),
+            marginals))
+
+    def test_moments(self):
+        for scale in [1., 500.]:
+            weights, biases = self.get_random_parameters(7, scale=scale)
+            joint, log_partition, marginals = get_bm_theo_brute_force(
+                    weights, biases)
+
+            states = np.array(list(it.product([0, 1], repeat=7)))
+            expected = np.einsum("s,si,sj->ij", joint.reshape(-1),
+                                 states, states)
+
+            lp, marg, moments = sbs.cutils.get_bm_moments_theo(
+                    weights, biases, second_moments=True)
+
+            self.assertTrue(np.isclose(lp, log_partition))
+            self.assertTrue(np.allclose(marg, marginals))
+            self.assertTrue(np.allclose(moments, expected))
+
+    def test_joint_selected(self):
+        weights, biases = self.get_random_parameters(9)
+        joint = get_bm_theo_brute_force(weights, biases)[0]
+
+        for selected_idx in [[0], [2, 5, 8], [7, 1], range(9)]:
+            other_idx = tuple(i for i in xrange(9) if i not in selected_idx)
+            expected = joint.sum(axis=other_idx).transpose(
+                    np.argsort(np.argsort(selected_idx)))
+
+            for num_threads in [1, 3]:
+                self.assertTrue(np.allclose(
+                    sbs.cutils.get_bm_joint_theo_selected(
+                        weights, biases, np.array(selected_idx),
+                        num_threads=num_threads),
+                    expected))
+
+    def test_parallel(self):
+        weights, biases = self.get_random_parameters(9)
+
+        lp, marg, moments = sbs.cutils.get_bm_moments_theo(
+                weights, biases, second_moments=True)
+        joint = sbs.cutils.get_bm_joint_theo(weights, biases)
+
+        for num_threads in [2, 3, 4]:
+            lp_p, marg_p, moments_p = sbs.cutils.get_bm_moments_theo(
+                    weights, biases, second_moments=True,
+                    num_threads=num_threads)
+
+            self.assertTrue(np.isclose(lp, lp_p))
+            self.assertTrue(np.allclose(marg, marg_p))
+            self.assertTrue(np.allclose(moments, moments_p))
+            self.assertTrue(np.allclose(joint, sbs.cutils.get_bm_joint_theo(
+                weights, biases, num_threads=num_threads)))
+
+
+def get_dense_parameters(layer_weights, num_units_per_layer):
+    offsets = np.r_[0, np.cumsum(num_units_per_layer)]
+    weights = np.zeros((offsets[-1], offsets[-1]))
+    for i, w in enumerate(layer_weights):
+        weights[offsets[i]:offsets[i+1], offsets[i+1]:offsets[i+2]] = w
+    return weights + weights.T
+
+
+class TestRBMTheoDistributions(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def compare_to_dense(self, num_units_per_layer, scale=1.):
+        layer_weights = [
+            np.random.randn(n_pre, n_post) * scale
+            for n_pre, n_post in zip(num_units_per_layer[:-1],
+                                     num_units_per_layer[1:])]
+        biases = np.random.randn(sum(num_units_per_layer)) * scale
+
+        joint, log_partition, marginals = get_bm_theo_brute_force(
+                get_dense_parameters(layer_weights, num_units_per_layer),
+                biases)
+
+        lp, marg = sbs.inference.get_rbm_moments_theo(
+                layer_weights, biases, num_units_per_layer, chunk_size=4)
+
+        self.assertTrue(np.isclose(lp, log_partition))
+        self.assertTrue(np.allclose(marg, marginals))
+
+        num_visible = num_units_per_layer[0]
+        joint_visible = joint.reshape(1 << num_visible, -1).sum(axis=1)
+
+        self.assertTrue(np.allclose(
+            sbs.inference.get_rbm_joint_theo(
+                layer_weights, biases, num_units_per_layer, chunk_size=4),
+            joint_visible.reshape([2] * num_visible)))
+
+    def test_rbm(self):
+        self.compare_to_dense([3, 5])
+        self.compare_to_dense([5, 3])
+
+    def test_large_parameters(self):
+        self.compare_to_dense([4, 3], scale=300.)
+
+    def test_multilayer(self):
+        self.compare_to_dense([2, 3, 2, 4])
+        self.compare_to_dense([4, 2, 3])
+
+    def test_network(self):
+        nparams = sbs.db.NeuronParametersConductanceExponential()
+        num_units_per_layer = [3, 4]
+
+        rbm = sbs.network.ThoroughRBM(
+                num_units_per_layer=num_units_per_layer,
+                sampler_config=[nparams] * 7)
+
+        layer_weights = [np.random.randn(3, 4)]
+        rbm.weights_theo = list(layer_weights)
+        rbm.biases_theo = np.random.randn(7)
+
+        joint, log_partition, marginals = get_bm_theo_brute_force(
+                get_dense_parameters(layer_weights, num_units_per_layer),
+                rbm.biases_theo)
+
+        self.assertTrue(np.allclose(rbm.dist_marginal_theo, marginals))
+        self.assertTrue(np.allclose(
+            rbm.dist_joint_theo.reshape(-1),
+            joint.reshape(8, -1).sum(axis=1)))
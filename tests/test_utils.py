@@ -81,3 +81,69 @@ class TestGroupIdenticalParameters(unittest.TestCase):
                                  "frequency": 5.,
                                  "phase": 0.})
             ])
+
+
+class TestCorrelationFunctions(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+
+    def get_expected(self, x, y, max_lag):
+        return np.array([np.corrcoef(x[:len(x)-lag], y[lag:])[0, 1]
+                         for lag in xrange(max_lag)])
+
+    def test_trace(self):
+        # AR(1)-process with a large offset akin to a membrane potential
+        trace = np.empty(2000)
+        trace[0] = 0.
+        for i in xrange(1, len(trace)):
+            trace[i] = .95 * trace[i-1] + np.random.randn()
+        trace -= 55.
+
+        autocorr = sbs.utils.get_autocorrelation(trace, max_lag=300)
+        self.assertEqual(autocorr.shape, (300,))
+        self.assertTrue(np.allclose(
+            autocorr, self.get_expected(trace, trace, 300)))
+
+    def test_crosscorrelation(self):
+        x = np.random.randn(500)
+        y = np.r_[np.random.randn(7), x[:-7]] + .1 * np.random.randn(500)
+
+        crosscorr = sbs.utils.get_crosscorrelation(x, y)
+        self.assertEqual(crosscorr.shape, (500,))
+        self.assertTrue(np.allclose(
+            crosscorr[:450], self.get_expected(x, y, 450)))
+        self.assertEqual(np.argmax(crosscorr[:450]), 7)
+
+    def test_states(self):
+        states = np.random.rand(1000, 4) < [.1, .5, .9, 0.]
+
+        autocorr = sbs.utils.get_autocorrelation(states, max_lag=50)
+        self.assertEqual(autocorr.shape, (50, 4))
+
+        for i in xrange(3):
+            self.assertTrue(np.allclose(
+                autocorr[:, i],
+                self.get_expected(states[:, i] * 1., states[:, i] * 1., 50)))
+        self.assertTrue(np.all(np.isnan(autocorr[:, 3])))
+
+
+class TestOrderedSpikes(unittest.TestCase):
+
+    def test_merge(self):
+        np.random.seed(42)
+        spiketrains = [np.sort(np.round(np.random.rand(n) * 100.))
+                       for n in [0, 1, 20, 7, 50, 0, 3]]
+        # unsorted trains are sorted beforehand
+        spiketrains.append(np.array([5., 2., 9.]))
+
+        spikes = sbs.utils.get_ordered_spike_idx(spiketrains)
+
+        self.assertEqual(len(spikes), sum(len(st) for st in spiketrains))
+        self.assertEqual(spikes["id"].dtype, np.dtype(int))
+        self.assertTrue(np.all(np.diff(spikes["t"]) >= 0.))
+        for i, st in enumerate(spiketrains):
+            self.assertTrue(np.all(spikes["t"][spikes["id"] == i]
+                                   == np.sort(st)))
+
+        self.assertEqual(len(sbs.utils.get_ordered_spike_idx([])), 0)